@@ -0,0 +1,831 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright (c) 2025 by OCLC
+#
+#  File		    : mdt_misc_lhrclient.py
+#  Description	: Importable client for the LHR operations of the MAPIv2
+#  Author(s)	: Elena-Iulia Popa
+#  Creation	    : 19-10-2026
+#
+#  History:
+#  19-10-2026	: popae    : creation
+#           	: Same requests, retries and classification as the mdt_misc_lhr* scripts,
+#           	: without argparse/credentials/session work at import time
+#           	: Requests dispatched concurrently under an AIMD concurrency limit
+#           	: Concurrent results handed out in input order (ReorderBuffer)
+#           	: run_many(ordered=False): results handed out as they are answered
+#           	: HTTP status of the last answer kept in LhrResult (for LOG.jsonl)
+#           	: Deferred retry queue: transient failures retried later, drained at the end
+#           	: Time spent in requests kept in LhrResult; *_many(only=...) for samples
+#           	: Optional rate limiter (acquire() before every request)
+#           	: Per-institution profile (API_PROFILES.env): concurrency, rate, timeouts, retries, buffers
+#           	: API_KEYS.env next to the scripts, or in $LHR_CONFIG_DIR, instead of /home/popae/Scripts
+#           	: Optional ledger of added LHRs: adds of records already added are not sent again
+#           	: Ledger claim before an add, confirmed after the response; ledger skips in the summary
+#           	: Optional hedging of GETs: duplicate of a slow request, first answer kept
+#           	: Connect/read timeouts on every request, per record deadline over all retries,
+#           	: run deadline: no new requests when it is near, the rest handed out as 'unsent'
+#           	: Requests counted, request budget (quota window of mdt_misc_lhrplan.py) stops the run like the deadline
+#           	: workers: concurrency and rate limit of the institution divided among the worker processes
+#           	: Ledger claim released only when the add was rejected or never sent, otherwise kept as unknown
+#           	: API rate limit exceeded: records in flight awaited, all others handed out as 'unsent'
+#
+#  Notes	:
+#           	: from mdt_misc_lhrclient import LhrClient
+#           	: client = LhrClient("OCLCSYMBOL1")
+#           	: for result in client.get_many(["227503625", "227503626"]):
+#           	:     print(result.ctrl_nr, result.outcome)
+#           	: API_KEYS.env and API_PROFILES.env are read from the directory of the scripts,
+#           	: or from $LHR_CONFIG_DIR when set ($LHR_API_KEYS / $LHR_PROFILES for single files).
+#
+#  SVN ident	: $Id$
+
+# Built-in/Generic Imports
+import os
+import time
+import datetime
+import threading
+import collections
+import heapq
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field, fields
+
+from dotenv import load_dotenv, dotenv_values
+from oauthlib.oauth2 import BackendApplicationClient
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from requests.exceptions import RetryError, RequestException, Timeout, ConnectionError, ConnectTimeout
+from requests_oauthlib import OAuth2Session
+import requests
+import urllib3
+
+from mdt_misc_lhrcommon import CircuitBreaker, AimdLimiter, ReorderBuffer, Unordered, TokenBucket, is_outage_response, record_control_number
+from mdt_misc_lhrcommon import normalized_record_hash
+from mdt_misc_lhrcommon import NOT_FOUND_MARKERS, BAD_REQUEST_MARKER, AUTH_ERROR_MARKER, RATE_LIMIT_MARKER
+
+
+CONFIG_DIR = os.getenv("LHR_CONFIG_DIR", os.path.dirname(os.path.abspath(__file__)))
+ENV_FILE = os.getenv("LHR_API_KEYS", os.path.join(CONFIG_DIR, "API_KEYS.env"))
+PROFILE_FILE = os.getenv("LHR_PROFILES", os.path.join(CONFIG_DIR, "API_PROFILES.env"))
+LEDGER_FILE = os.getenv("LHR_LEDGER", os.path.join(CONFIG_DIR, "lhr_ledger.db"))
+INDEX_FILE = os.getenv("LHR_INDEX", os.path.join(CONFIG_DIR, "lhr_index.db"))
+
+# serviceURL = config.get('metadata_service_url')
+serviceURL = 'https://metadata.api.oclc.org/worldcat'
+tokenURL = 'https://oauth.oclc.org/token'
+
+# Scope
+scope = ['WorldCatMetadataAPI:manage_institution_lhrs']
+
+# Defaults of the institution profiles (see LhrProfile)
+max_concurrency = 8
+max_retries = 10
+retry_delay = 3
+timeout_token = 50
+timeout_connect = 10   # seconds to set up the connection to the API
+timeout_request = 50   #default timeout for the API (read: seconds to wait for the answer)
+record_deadline = 0    # seconds a record may take over all its attempts, 0 = no limit
+deadline_margin = 10   # no new request when the run deadline is closer than this (seconds)
+token_margin = 60      # seconds before expiry a token is refreshed
+drain_retries = 3      # extra attempts at the end of the run for records out of attempts
+max_defer_delay = 300  # longest wait (seconds) before a deferred record is sent again
+reorder_capacity = 10000
+
+headers = {"Accept": "application/marc", "Content-Type": "application/marc"}
+
+class RateLimitExceeded(Exception):
+    """The API answered 'API rate limit exceeded'; no use to continue the run."""
+
+
+@dataclass
+class LhrResult:
+    """Outcome of one LHR operation."""
+    operation: str                  # get, delete, add, replace
+    outcome: str                    # success, not_found, bad_request, error, failed, requeued, deferred, already_added, unsent
+    ctrl_nr: str = None             # Control Number (for add: the one given by the API)
+    nr: int = None                  # ordinal of the record in the input (add, replace)
+    body: str = ''                  # answer of the API (the LHR in MARC on success)
+    attempts: int = 0
+    http_status: int = None         # HTTP status of the last answer
+    record: bytes = None            # the input record of a failed add/replace (for the Retry file)
+    elapsed: float = 0.0            # seconds spent waiting for the API, all attempts
+    errors: list = field(default_factory=list)   # (attempt, answer) of the retried attempts
+
+    @property
+    def ok(self):
+        return self.outcome == 'success'
+
+
+def never_sent(err):
+    """True when the request did not reach the API: no connection (refused, unknown host) or none in time."""
+    if isinstance(err, ConnectTimeout):
+        return True
+    reason = getattr(err.args[0], 'reason', None) if isinstance(err, ConnectionError) and err.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+#============================================================#
+#                   CREDENTIALS
+#============================================================#
+_env_loaded = set()
+
+def load_oauth_credentials(inst_symbol: str, env_file=None):
+    env_file = env_file or ENV_FILE
+    if env_file not in _env_loaded:
+        load_dotenv(env_file)
+        _env_loaded.add(env_file)
+
+    prefix = inst_symbol.upper()
+
+    client_id = os.getenv(f"{prefix}_CLIENT_ID")
+    client_secret = os.getenv(f"{prefix}_CLIENT_SECRET")
+
+    if not all([client_id, client_secret]):
+        raise ValueError(f"Missing credentials for user '{inst_symbol}'")
+
+    return {
+        "client_id": client_id,
+        "client_secret": client_secret,
+    }
+
+
+#============================================================#
+#                   INSTITUTION PROFILES
+#============================================================#
+@dataclass
+class LhrProfile:
+    """Tuning of the requests for one institution.
+
+    Read from API_PROFILES.env with the <SYMBOL>_ prefix of API_KEYS.env,
+    e.g. OCLCSYMBOL1_MAX_CONCURRENCY=4, OCLCSYMBOL1_RATE_LIMIT=5; DEFAULT_
+    entries apply to all institutions. Missing entries keep the module
+    defaults.
+    """
+    max_concurrency: int = None     # maximum requests in flight (AIMD)
+    rate_limit: float = 0           # requests per second, 0 = no limit
+    rate_burst: int = 0             # requests sent at once after a pause (0 = one second of rate_limit)
+    timeout_token: float = None     # seconds
+    timeout_connect: float = None   # seconds
+    timeout_request: float = None   # seconds (read timeout)
+    record_deadline: float = None   # seconds over all attempts of a record, 0 = no limit
+    deadline_margin: float = None   # seconds before the run deadline without new requests
+    max_retries: int = None
+    retry_delay: float = None       # seconds, doubled per transient failure
+    max_defer_delay: float = None   # seconds
+    drain_retries: int = None
+    reorder_capacity: int = None    # results waiting in memory for their turn, the rest is spilled
+    spill_dir: str = None           # directory of the spill file (default: system temp)
+    columnar_batch_size: int = 10000   # rows per Parquet row group / CSV write
+    quota: int = 0                  # requests per quota window, 0 = no quota (see mdt_misc_lhrplan.py)
+    quota_window: float = 86400     # seconds
+    quota_reset: str = '00:00'      # local time at which a quota window starts
+
+    def __post_init__(self):
+        for name in ('max_concurrency', 'timeout_token', 'timeout_connect', 'timeout_request', 'record_deadline',
+                     'deadline_margin', 'max_retries', 'retry_delay', 'max_defer_delay', 'drain_retries', 'reorder_capacity'):
+            if getattr(self, name) is None:
+                setattr(self, name, globals()[name])
+
+
+def load_profile(inst_symbol: str, profile_file=None):
+    """LhrProfile of an institution: DEFAULT_ entries, then <SYMBOL>_ entries."""
+    profile_file = profile_file or PROFILE_FILE
+    values = dotenv_values(profile_file) if os.path.exists(profile_file) else {}
+
+    settings = {}
+    types = {item.name: item.type for item in fields(LhrProfile)}
+    for prefix in ("DEFAULT", inst_symbol.upper()):
+        for name, kind in types.items():
+            value = values.get(f"{prefix}_{name.upper()}")
+            if value is None or value.strip() == '':
+                continue
+            try:
+                settings[name] = value.strip() if kind is str else kind(value)
+            except ValueError:
+                raise ValueError(f"Invalid value '{value}' for {prefix}_{name.upper()} in {profile_file}")
+    return LhrProfile(**settings)
+
+
+#============================================================#
+#                   CLIENT
+#============================================================#
+class LhrClient:
+    """One institution, one warm OAuth2 session, reused for all calls.
+
+    Nothing is read or fetched before the first call: credentials are loaded
+    when the client is created and the token is fetched on first use and
+    refreshed shortly before it expires.
+
+    The *_many calls keep up to `max_concurrency` requests in flight; the
+    actual number is adapted by an AimdLimiter (1 = one request at a time).
+    Their results still come in input order: up to `reorder_capacity`
+    early results wait in memory, more are spilled to disk (`spill_dir`).
+    Transient failures (outage pages, timeouts, throttling) do not hold a
+    worker: the record goes on a deferred queue with a not-before time and
+    fresh records keep flowing (see run_many). An optional `rate_limiter`
+    (any object with acquire()) is asked for a token before every request.
+
+    Concurrency, rate limit, timeouts, retries and buffer sizes come from
+    the profile of the institution (see load_profile); the arguments, when
+    given, take precedence. A client in one of `workers` processes sending
+    for the same institution gets its share of the maximum concurrency and
+    of the rate limit.
+
+    With a `ledger` (AddLedger) an add of a record that was added before is
+    not sent: the result is 'already_added' with the Control Number the API
+    gave then. Every add claims its record in the ledger before it is sent
+    and confirms it with the Control Number of the response; the same
+    record claimed by another request waits (deferred) until that one is
+    answered. The claim is dropped only when the API rejected the add (4xx)
+    or it was never sent (connection refused); after a timeout or a 5xx
+    the LHR may have been added, so the add is not retried but reported
+    'failed' and kept as unknown in the ledger. Successful deletes are
+    removed from it.
+
+    With a `hedge` (HedgePolicy) a GET still unanswered after the usual
+    latency gets a duplicate (GET is idempotent); the first answer is kept
+    and the other one dropped. Hedges also take a token of the rate_limiter.
+
+    Every request has a connect and a read timeout; with a record deadline
+    (profile) a record gives up once its attempts took that long, and with
+    a run deadline (set_deadline) no new request is sent close to it.
+    The same happens once `requests` reaches `request_budget`.
+    """
+
+    def __init__(self, inst_symbol, env_file=None, verbose=False, breaker=None, max_concurrency=None, limiter=None,
+                 reorder_capacity=None, spill_dir=None, rate_limiter=None, profile=None, ledger=None, hedge=None,
+                 workers=1):
+        self.institution = inst_symbol.upper()
+        self.verbose = verbose
+        creds = load_oauth_credentials(inst_symbol, env_file)
+        self.auth = HTTPBasicAuth(creds["client_id"], creds["client_secret"])
+        self.oauth_client = BackendApplicationClient(client_id=creds["client_id"], scope=scope)
+        self.profile = profile or load_profile(inst_symbol)
+        self.max_retries = self.profile.max_retries
+        self.retry_delay = self.profile.retry_delay
+        self.drain_retries = self.profile.drain_retries
+        self.max_defer_delay = self.profile.max_defer_delay
+        self.timeout_token = self.profile.timeout_token
+        self.timeout_connect = self.profile.timeout_connect
+        self.timeout_request = self.profile.timeout_request
+        self.record_deadline = self.profile.record_deadline
+        self.deadline_margin = self.profile.deadline_margin
+        self.run_deadline = None   # time.monotonic() value, see set_deadline
+        self.unsent = 0            # records not sent because of the run deadline or request budget
+        self.requests = 0          # requests sent (hedges included)
+        self.request_budget = None # no new record is sent once `requests` reaches it
+        self.request_lock = threading.Lock()
+        max_concurrency = max((max_concurrency or self.profile.max_concurrency) // workers, 1)
+        self.limiter = limiter or AimdLimiter(initial=1, max_limit=max_concurrency)
+        self.reorder_capacity = reorder_capacity or self.profile.reorder_capacity
+        self.spill_dir = spill_dir or self.profile.spill_dir
+        if rate_limiter is None and self.profile.rate_limit > 0:
+            rate_limiter = TokenBucket(self.profile.rate_limit / workers, self.profile.rate_burst // workers or None)
+        self.rate_limiter = rate_limiter
+        self.ledger = ledger
+        self.hedge = hedge
+        self.hedge_pool = None
+        if hedge is not None:
+            # Requests run here so the caller can send a hedge while the first one is waiting
+            self.hedge_pool = ThreadPoolExecutor(max_workers=2 * self.limiter.max_limit,
+                                                 thread_name_prefix=f"lhr-hedge-{self.institution}")
+        self.deferrals = 0     # transient failures put on the deferred queue
+        self.ledger_skips = 0  # adds not sent: the record is in the ledger
+        self.drained = 0       # records retried in the final drain
+        self.wskey = self.new_session()
+        self.token = None
+        self.token_lock = threading.Lock()
+        self.shared_token = None
+        self.shared_lock = None
+        # Shared by all calls: pauses the requests while the API sends 502 / HTML error pages
+        self.breaker = breaker or CircuitBreaker(threshold=0.5, window=20, probe_delay=5, max_probe_delay=300)
+
+    def new_session(self, token=None):
+        """OAuth2 session with a connection pool big enough for the concurrency limit."""
+        session = OAuth2Session(client=self.oauth_client, token=token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.limiter.max_limit, 10))
+        session.mount('https://', adapter)
+        return session
+
+    #================ TOKEN ===============================>
+    def fetch_token(self):
+        for attempt in range(self.max_retries):
+            try:
+                token = self.wskey.fetch_token(token_url=tokenURL, auth=self.auth, timeout=self.timeout_token)
+                self.token = token
+                if self.shared_token is not None:
+                    self.shared_token.update(token)
+                if self.verbose:
+                    formatted_datetime_token = datetime.datetime.now().strftime("%H:%M:%S")
+                    print(f"Fetched new token at {formatted_datetime_token}: {token}\n")
+                    print("----------------------------------------------------------------------------------------------------\n")
+                return token
+            except requests.exceptions.Timeout:
+                print(f"Token request timed out for {self.institution}, retrying in {self.retry_delay} seconds... ({attempt + 1}/{self.max_retries})")
+                if attempt < self.max_retries - 1:
+                    time.sleep(self.retry_delay)
+                else:
+                    print("Max retries reached for token request.")
+                    return None
+            except Exception as e:
+                print(f"Error fetching token for {self.institution}: {e}")
+                return None
+
+    def share_token(self, shared_token, shared_lock):
+        """Use a token shared with other processes (manager dict and lock); None to stop."""
+        self.shared_token = shared_token
+        self.shared_lock = shared_lock
+        if shared_token is not None and self.token is not None and not shared_token:
+            shared_token.update(self.token)
+
+    def adopt_shared_token(self):
+        """Take over a token refreshed by another process; True if it changed."""
+        if self.shared_token is None:
+            return False
+        latest = dict(self.shared_token)
+        if latest and latest.get("access_token") != (self.token or {}).get("access_token"):
+            self.token = latest
+            self.wskey.token = latest
+            return True
+        return False
+
+    def _token_expiring(self):
+        if not self.token:
+            return True
+        expires_at = self.token.get("expires_at")
+        return expires_at is not None and expires_at - token_margin < time.time()
+
+    def refresh_token(self, rejected=None):
+        """Fetch a new token, unless someone else already replaced the `rejected` one."""
+        with self.token_lock:
+            current = (self.token or {}).get("access_token")
+            if rejected is not None and current != rejected:
+                return self.token
+
+            if self.shared_lock is None:
+                return self.fetch_token()
+
+            with self.shared_lock:
+                if self.adopt_shared_token() and not self._token_expiring():
+                    return self.token
+                return self.fetch_token()
+
+    def ensure_token(self):
+        if self.shared_token is not None:
+            self.adopt_shared_token()
+        if self._token_expiring():
+            self.refresh_token((self.token or {}).get("access_token"))
+
+    #================ DEF FOR API ===============================>
+    def set_deadline(self, deadline):
+        """Run deadline as a time.time() value (None: no deadline)."""
+        self.run_deadline = None if deadline is None else time.monotonic() + (deadline - time.time())
+
+    def deadline_near(self):
+        return self.run_deadline is not None and time.monotonic() >= self.run_deadline - self.deadline_margin
+
+    def count_request(self):
+        with self.request_lock:
+            self.requests += 1
+
+    def stop_sending(self):
+        """Run deadline near or request budget used: no new record is sent."""
+        return self.deadline_near() or (self.request_budget is not None and self.requests >= self.request_budget)
+
+    def request_timeout(self, deadline=None):
+        """(connect, read) timeouts, the read one shortened to the record and run deadlines."""
+        read = self.timeout_request
+        limits = [limit for limit in (deadline, self.run_deadline) if limit is not None]
+        if limits:
+            read = max(min(read, min(limits) - time.monotonic()), 0.1)
+        return (self.timeout_connect, read)
+
+    def request_data(self, operation, ctrl_nr=None, record=None, timeout=None):
+        timeout = timeout or (self.timeout_connect, self.timeout_request)
+        if operation == 'get':
+            r = self.wskey.get(serviceURL + f"/manage/lhrs/{ctrl_nr}", headers=headers, timeout=timeout)
+        elif operation == 'delete':
+            r = self.wskey.delete(serviceURL + f"/manage/lhrs/{ctrl_nr}", headers=headers, timeout=timeout)
+        elif operation == 'add':
+            r = self.wskey.post(serviceURL + "/manage/lhrs", data=record, headers=headers, timeout=timeout)
+        elif operation == 'replace':
+            r = self.wskey.put(serviceURL + f"/manage/lhrs/{ctrl_nr}", data=record, headers=headers, timeout=timeout)
+        else:
+            raise ValueError(f"Unknown operation '{operation}'")
+
+        return r.status_code, r.content.decode("UTF-8")
+
+    def request_hedged(self, operation, ctrl_nr, timeout=None):
+        """request_data with a duplicate sent when the answer is slower than the hedge delay.
+
+        The request that loses cannot be stopped once sent (requests has no
+        cancel); its answer is just dropped. Returns the first good answer,
+        or raises the error of the last request when both failed.
+        """
+        primary = self.hedge_pool.submit(self.request_data, operation, ctrl_nr, None, timeout)
+        delay = self.hedge.delay()
+        if delay is None or wait([primary], timeout=delay).done or not self.hedge.allow():
+            return primary.result()
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        self.count_request()
+        backup = self.hedge_pool.submit(self.request_data, operation, ctrl_nr, None, timeout)
+        running = [primary, backup]
+        while True:
+            done, pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is backup:
+                        self.hedge.won()
+                    return future.result()
+            if not pending:
+                raise done.pop().exception()
+            running = list(pending)
+
+    def call(self, operation, ctrl_nr=None, record=None, nr=None, attempts=None, first_attempt=1, defer=False, deadline=None):
+        """One operation with the retries of the scripts; returns an LhrResult.
+
+        The outcome is 'requeued' when the circuit breaker opened during the
+        call: the record was not processed and should be sent again later.
+        With `defer` a transient failure (outage page, timeout, throttling)
+        ends the call at once with outcome 'deferred' instead of retrying
+        here; `first_attempt` numbers the attempts of a record sent again.
+        `deadline` (time.monotonic() value) ends the retries of the record.
+        """
+        attempts = attempts or self.max_retries
+        if deadline is None and self.record_deadline and not defer:
+            deadline = time.monotonic() + self.record_deadline
+        if operation == 'replace' and ctrl_nr is None:
+            ctrl_nr = record_control_number(record)
+        result = LhrResult(operation=operation, outcome='failed', ctrl_nr=ctrl_nr, nr=nr)
+
+        if operation in ('get', 'delete', 'replace') and not ctrl_nr:
+            result.outcome = 'error'
+            result.body = "No Control Number (001) to send the request to."
+            return result
+
+        # Added before (interrupted run, same file twice): report the Control Number, no request
+        record_hash = None
+        if operation == 'add' and self.ledger is not None:
+            record_hash = normalized_record_hash(record)
+            known = self.ledger.claim(self.institution, record_hash)
+            if known == self.ledger.PENDING:
+                # Being added by another request: its Control Number is known once it is answered
+                result.attempts = first_attempt
+                result.errors.append((first_attempt, "Same record being added by another request"))
+                result.outcome = 'deferred' if defer else 'failed'
+                return result
+            if known == self.ledger.UNKNOWN:
+                result.attempts = first_attempt - 1
+                result.outcome = 'failed'
+                result.body = ("--> An earlier add of this record got no clear answer: it may have been added. "
+                               "Not sent again until checked (see the ledger)")
+                return result
+            if known is not None:
+                with self.request_lock:
+                    self.ledger_skips += 1
+                result.outcome = 'already_added'
+                result.ctrl_nr = known
+                return result
+
+        try:
+            result = self.send(operation, ctrl_nr, record, result, record_hash, attempts, first_attempt, defer, deadline)
+        except RateLimitExceeded:
+            if record_hash is not None:
+                self.ledger.release(self.institution, record_hash)
+            raise
+        except BaseException:
+            # Stopped, maybe with the add on its way: it may have been added
+            if record_hash is not None:
+                self.ledger.mark_unknown(self.institution, record_hash)
+            raise
+        # Rejected by the API or never sent: the record can be claimed again (deferred, retried, another run).
+        # An add without a clear answer was kept as unknown by send().
+        if record_hash is not None and result.outcome != 'success':
+            self.ledger.release(self.institution, record_hash)
+        return result
+
+    def add_unknown(self, result, record_hash, reason):
+        """An add without a clear answer (timeout, 5xx): the LHR may have been added
+        all the same, so the claim is kept as unknown and the add is not retried."""
+        self.ledger.mark_unknown(self.institution, record_hash)
+        result.outcome = 'failed'
+        result.body = (f"--> No clear answer to the add ({reason}): it may have been added. "
+                       f"Not sent again until checked (see the ledger)")
+        return result
+
+    def send(self, operation, ctrl_nr, record, result, record_hash, attempts, first_attempt, defer, deadline):
+        """The attempts of call(); fills in and returns `result`."""
+        for attempt in range(first_attempt - 1, first_attempt - 1 + attempts):
+            if deadline is not None and time.monotonic() >= deadline:
+                result.attempts = attempt
+                result.outcome = 'failed'
+                result.body = f"--> Record deadline of {self.record_deadline}s reached after {attempt} attempts"
+                return result
+            result.attempts = attempt + 1
+            started = None
+            try:
+                # Send the record to the API Request (waits while the API is down)
+                self.breaker.before_request()
+                self.ensure_token()
+                used_token = (self.token or {}).get("access_token")
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                self.count_request()
+                started = time.monotonic()
+                timeout = self.request_timeout(deadline)
+                if self.hedge is not None and operation == 'get':
+                    result.http_status, body = self.request_hedged(operation, ctrl_nr, timeout)
+                else:
+                    result.http_status, body = self.request_data(operation, ctrl_nr, record, timeout)
+                latency = time.monotonic() - started
+                result.elapsed += latency
+
+                # Process the response from the API
+                if RATE_LIMIT_MARKER in body:
+                    # Fewer requests in flight and try again; at the lowest limit it is the quota
+                    if not self.limiter.throttled(started):
+                        raise RateLimitExceeded(f"{ctrl_nr or nr}|API rate limit exceeded.")
+                    result.errors.append((attempt + 1, body))
+                    if defer:
+                        result.outcome = 'deferred'
+                        return result
+                    time.sleep(self.retry_delay)
+                    continue
+
+                elif AUTH_ERROR_MARKER in body or is_outage_response(body):
+                    result.errors.append((attempt + 1, body))
+                    if is_outage_response(body):
+                        self.limiter.overload(started)
+
+                    # API outage: give the record back instead of using up its attempts
+                    self.breaker.record(not is_outage_response(body))
+                    if record_hash is not None and is_outage_response(body):
+                        return self.add_unknown(result, record_hash, f"HTTP {result.http_status} outage")
+                    if self.breaker.is_open:
+                        result.outcome = 'requeued'
+                        return result
+
+                    if defer and is_outage_response(body):
+                        result.outcome = 'deferred'
+                        return result
+
+                    # Refresh token and try again
+                    self.refresh_token(used_token)
+                    continue
+
+                # If no error found, proceed
+                self.breaker.record(True)
+                self.limiter.success(latency, started)
+                if self.hedge is not None and operation == 'get':
+                    self.hedge.observe(latency)
+                result.body = body
+
+                #mrc returned - thus good
+                if '\x1E' in body:
+                    result.outcome = 'success'
+                    if operation == 'add':
+                        result.ctrl_nr = record_control_number(body.encode("UTF-8"))
+                        if record_hash is not None and result.ctrl_nr:
+                            self.ledger.store(self.institution, record_hash, result.ctrl_nr)
+                        elif record_hash is not None:
+                            self.ledger.mark_unknown(self.institution, record_hash)
+                    elif operation == 'delete' and self.ledger is not None:
+                        self.ledger.forget(self.institution, ctrl_nr)
+                elif BAD_REQUEST_MARKER in body:
+                    result.outcome = 'bad_request'
+                elif operation in ('get', 'delete') and any(marker in body for marker in NOT_FOUND_MARKERS):
+                    result.outcome = 'not_found'
+                # Any other errors: no retrying as the problem is the record itself or the request
+                elif record_hash is not None and not 400 <= (result.http_status or 0) < 500:
+                    return self.add_unknown(result, record_hash, f"HTTP {result.http_status}")
+                else:
+                    result.outcome = 'error'
+                return result
+
+            except RetryError as err:
+                if defer:
+                    result.errors.append((attempt + 1, f"{type(err).__name__}: {err}"))
+                    result.outcome = 'deferred'
+                    return result
+                result.outcome = 'failed'
+                result.body = f"--> Retry failed after {result.attempts} attempts"
+                return result
+
+            except RequestException as err:
+                self.limiter.overload(started)
+                if record_hash is not None and started is not None and not never_sent(err):
+                    return self.add_unknown(result, record_hash, f"{type(err).__name__}: {err}")
+                if defer and isinstance(err, (Timeout, ConnectionError)):
+                    result.errors.append((attempt + 1, f"{type(err).__name__}: {err}"))
+                    result.outcome = 'deferred'
+                    return result
+                result.outcome = 'error'
+                result.body = f"{type(err).__name__}: {err}"
+                return result
+
+        return result
+
+    #================ SINGLE CALLS ===============================>
+    def get(self, ctrl_nr):
+        return self.call('get', ctrl_nr=ctrl_nr)
+
+    def delete(self, ctrl_nr):
+        return self.call('delete', ctrl_nr=ctrl_nr)
+
+    def add(self, record, nr=None):
+        return self.call('add', record=record, nr=nr)
+
+    def replace(self, record, ctrl_nr=None, nr=None):
+        return self.call('replace', ctrl_nr=ctrl_nr, record=record, nr=nr)
+
+    #================ STREAMING CALLS ===============================>
+    def run_many(self, jobs, ordered=True):
+        """Yield one LhrResult per job, lazily and in the order of the jobs
+        (with `ordered` False: as they are answered); jobs are dicts of call()
+        arguments.
+
+        Up to limiter.limit requests are in flight. Jobs caught in an API
+        outage are sent again once the API is back, so no 'requeued' result
+        is ever yielded. A transient failure puts the job on the deferred
+        queue with a not-before time (retry_delay, doubled per failure, up
+        to max_defer_delay) and fresh jobs go first. Jobs that used up their
+        max_retries attempts get drain_retries more once all other work is
+        done; if those fail too the result is 'failed' (Retry file).
+
+        A record that would wait past its record deadline fails at once.
+        Close to the run deadline, or once the request budget is used, no
+        new request is sent: once the requests in flight are answered,
+        every job not done yet is yielded as 'unsent' (Resume file). The
+        same happens on 'API rate limit exceeded' (RateLimitExceeded, also
+        from `jobs`), raised once the unsent results are yielded.
+        """
+        jobs = enumerate(jobs)
+        pending = collections.deque()   # requeued after an outage: send again first
+        deferred = []                   # heap of (not before, seq, task)
+        final = []                      # out of attempts: retried at the end of the run
+        running = set()
+        reorder = ReorderBuffer(self.reorder_capacity, self.spill_dir) if ordered else Unordered()
+        exhausted = False
+        rate_limited = None             # RateLimitExceeded: no new request, raised once all is handed out
+
+        with ThreadPoolExecutor(max_workers=self.limiter.max_limit, thread_name_prefix=f"lhr-{self.institution}") as executor:
+            try:
+                while True:
+                    # Keep as many requests in flight as the limiter allows
+                    while self.limiter.has_room() and not self.stop_sending() and rate_limited is None:
+                        task = None
+                        if pending:
+                            task = pending.popleft()
+                        elif deferred and deferred[0][0] <= time.monotonic():
+                            task = heapq.heappop(deferred)[2]
+                        elif not exhausted:
+                            try:
+                                seq, job = next(jobs, (None, None))
+                            except RateLimitExceeded as err:
+                                rate_limited, seq, job = err, None, None
+                            if job is None:
+                                exhausted = True
+                            else:
+                                task = {'seq': seq, 'job': job, 'attempts': 0, 'budget': self.max_retries, 'errors': [], 'requeues': 0, 'elapsed': 0.0,
+                                        'deadline': time.monotonic() + self.record_deadline if self.record_deadline else None}
+                        if task is None:
+                            break
+                        self.limiter.acquire()
+                        future = executor.submit(self.call, **task['job'], attempts=task['budget'] - task['attempts'],
+                                                 first_attempt=task['attempts'] + 1, defer=True, deadline=task['deadline'])
+                        future.task = task
+                        running.add(future)
+
+                    # Run deadline, budget or rate limit: what is in flight is awaited, the rest is handed back unsent
+                    if (self.stop_sending() or rate_limited is not None) and not running:
+                        left = list(pending) + [entry[2] for entry in deferred] + final
+                        left += [{'seq': seq, 'job': job} for seq, job in ([] if exhausted else jobs)]
+                        for task in sorted(left, key=lambda task: task['seq']):
+                            job = task['job']
+                            self.unsent += 1
+                            yield from reorder.add(task['seq'], LhrResult(operation=job['operation'], outcome='unsent',
+                                                                          ctrl_nr=job.get('ctrl_nr'), nr=job.get('nr'),
+                                                                          record=job.get('record')))
+                        if rate_limited is not None:
+                            raise rate_limited
+                        return
+
+                    # Final drain: all other work done, the records out of attempts get another chance
+                    if exhausted and not running and not pending and not deferred and final:
+                        print(f"\nRetrying {len(final)} record(s) that failed during the run...")
+                        for task in final:
+                            task['budget'] += self.drain_retries
+                            heapq.heappush(deferred, (time.monotonic(), task['seq'], task))
+                        self.drained += len(final)
+                        final = []
+                        continue
+
+                    if not running:
+                        if not deferred:
+                            return
+                        time.sleep(self.wait_time(deferred[0][0]))
+                        continue
+
+                    timeout = self.wait_time(deferred[0][0]) if deferred and not self.stop_sending() and rate_limited is None else None
+                    done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.limiter.release()
+                        task = future.task
+                        try:
+                            result = future.result()
+                        except RateLimitExceeded as err:
+                            # No use to send more: this record is handed back unsent with the others
+                            rate_limited = err
+                            pending.append(task)
+                            continue
+                        if result.outcome == 'requeued':
+                            # A record that keeps getting an outage page while all others are done
+                            # would probe the API for ever: past max_retries requeues it counts as attempt
+                            task['requeues'] += 1
+                            task['elapsed'] += result.elapsed
+                            if task['requeues'] <= self.max_retries:
+                                task['errors'] += result.errors
+                                pending.append(task)
+                                continue
+                            result.outcome = 'deferred'
+
+                        result.errors = task['errors'] + result.errors
+                        result.elapsed += task['elapsed']
+                        if result.outcome == 'deferred':
+                            task['errors'] = result.errors
+                            task['elapsed'] = result.elapsed
+                            task['attempts'] = result.attempts
+                            if task['attempts'] < task['budget']:
+                                self.deferrals += 1
+                                delay = min(self.retry_delay * 2 ** (len(task['errors']) - 1), self.max_defer_delay)
+                                if task['deadline'] is not None and time.monotonic() + delay >= task['deadline']:
+                                    result.outcome = 'failed'
+                                    result.body = f"--> Record deadline of {self.record_deadline}s reached after {task['attempts']} attempts"
+                                    result.record = task['job'].get('record')
+                                    yield from reorder.add(task['seq'], result)
+                                    continue
+                                heapq.heappush(deferred, (time.monotonic() + delay, task['seq'], task))
+                                continue
+                            if task['budget'] == self.max_retries:
+                                final.append(task)
+                                continue
+                            # Out of attempts in the final drain too
+                            result.outcome = 'failed'
+                            result.body = ''
+
+                        if result.outcome == 'failed':
+                            result.record = task['job'].get('record')   # for the Retry file
+                        yield from reorder.add(task['seq'], result)
+
+            finally:
+                # Stopped early (caller gone): do not start what is still queued
+                for future in running:
+                    future.cancel()
+                reorder.close()
+
+    def wait_time(self, not_before):
+        """Seconds to wait for a deferred record, never past the point where the run deadline stops the run."""
+        delay = max(not_before - time.monotonic(), 0)
+        if self.run_deadline is not None:
+            delay = min(delay, max(self.run_deadline - self.deadline_margin - time.monotonic(), 0))
+        return delay
+
+    def summary(self):
+        """Concurrency limit, deferred retries and hedges of the runs of this client."""
+        summary = (f"{self.limiter.summary()}\n"
+                   f"Deferred retries: {self.deferrals}, records retried at the end of the run: {self.drained}")
+        if self.unsent:
+            summary += f"\nRecords not sent (run deadline, request budget or rate limit): {self.unsent}"
+        if self.ledger_skips:
+            summary += f"\nRecords not sent (already added, see the ledger): {self.ledger_skips}"
+
+        if self.hedge is not None:
+            summary += f"\n{self.hedge.summary()}"
+        return summary
+
+    def get_many(self, ctrl_nrs, ordered=True):
+        return self.run_many(({'operation': 'get', 'ctrl_nr': ctrl_nr} for ctrl_nr in ctrl_nrs), ordered)
+
+    def delete_many(self, ctrl_nrs, ordered=True):
+        return self.run_many(({'operation': 'delete', 'ctrl_nr': ctrl_nr} for ctrl_nr in ctrl_nrs), ordered)
+
+    def add_many(self, records, first_nr=1, skip=(), only=None, nrs=None):
+        """Add the records; `skip` / `only` are sets of record nrs (1 based in the input).
+        `nrs` gives the record nrs of records that are not consecutive (a selection)."""
+        numbered = zip(nrs, records) if nrs is not None else enumerate(records, start=first_nr)
+        return self.run_many({'operation': 'add', 'record': record, 'nr': nr}
+                             for nr, record in numbered
+                             if nr not in skip and (only is None or nr in only))
+
+    def replace_many(self, records, first_nr=1, skip=(), only=None, nrs=None):
+        """Replace the records; `skip` / `only` are sets of record nrs (1 based in the input).
+        `nrs` gives the record nrs of records that are not consecutive (a selection)."""
+        numbered = zip(nrs, records) if nrs is not None else enumerate(records, start=first_nr)
+        return self.run_many({'operation': 'replace', 'record': record, 'nr': nr}
+                             for nr, record in numbered
+                             if nr not in skip and (only is None or nr in only))
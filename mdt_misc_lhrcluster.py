@@ -0,0 +1,548 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright (c) 2025 by OCLC
+#
+#  File		    : mdt_misc_lhrcluster.py
+#  Description	: LHR get/delete/add/replace jobs spread over several nodes through leases in SQLite
+#  Author(s)	: Elena-Iulia Popa
+#  Creation	    : 19-10-2026
+#
+#  History:
+#  19-10-2026	: popae    : creation
+#           	: Leases with heartbeat and re-issue, per lease outputs merged at the end,
+#           	: one request rate per institution shared by all nodes
+#           	: Ledger of added LHRs, as in mdt_misc_lhradd.py ($LHR_LEDGER on shared storage for all nodes)
+#           	: --rate defaults to the RATE_LIMIT of the institution profile, always shared by the nodes
+#           	: Merge lease: a merge stopped halfway (node down) is run again by another node
+#
+#  Notes	:
+#           	: The queue file (SQLite), the input files and the output directory must be
+#           	: on storage shared by all nodes, with the same path everywhere.
+#           	:   mdt_misc_lhrcluster.py submit -q /shared/lhr.db -i /shared/ids.txt -k SYMBOL -r g --rate 10
+#           	:   mdt_misc_lhrcluster.py work   -q /shared/lhr.db            (on every node)
+#           	:   mdt_misc_lhrcluster.py status -q /shared/lhr.db
+#
+#  SVN ident	: $Id$
+
+# Built-in/Generic Imports
+import os
+import sys
+import argparse
+import datetime
+import json
+import math
+import socket
+import sqlite3
+import threading
+import time
+
+from mdt_misc_lhrclient import LhrClient, RateLimitExceeded, LEDGER_FILE, load_profile
+from mdt_misc_lhrcommon import ResultWriter, AddLedger, output_paths, part_path, merge_part_outputs, remove_part_outputs
+from mdt_misc_lhrcommon import mrc_byte_ranges, count_records, read_mrc_range, is_plain_file, input_extension, input_base_name
+
+#============================================================#
+#                   START OF HELP PARSER
+#============================================================#
+parser = argparse.ArgumentParser(
+    description='Run LHR get/delete/add/replace jobs on several nodes, coordinated through a SQLite queue' ,
+    formatter_class=argparse.RawTextHelpFormatter  # # This prevents argparse from reformatting help text
+)
+
+parser._optionals.title = 'Options' #Customize options title if desired
+parser._positionals.title = 'Mandatory arguments' #Customize positionals title if desired
+
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+submit_parser = subparsers.add_parser("submit", formatter_class=argparse.RawTextHelpFormatter, help="Split a job in leases")
+work_parser = subparsers.add_parser("work", formatter_class=argparse.RawTextHelpFormatter, help="Process leases on this node")
+status_parser = subparsers.add_parser("status", formatter_class=argparse.RawTextHelpFormatter, help="Show the jobs and their leases")
+
+for sub in (submit_parser, work_parser, status_parser):
+    sub.add_argument("-q", "--queue", required=True, help=(
+                                                "SQLite queue file on shared storage (created when missing).\n"
+ )
+)
+
+submit_parser.add_argument("-i", "--in", dest="input_file", required=True, help=(
+                                                "Input file on shared storage, uncompressed:\n"
+                                                "- .txt with Control Numbers for get/delete\n"
+                                                "- .mrc with LHRs for add/replace\n"
+ )
+)
+
+submit_parser.add_argument("-k", "--key", required=True, help=(
+                                                "Symbol of the Institution for the WSKey retrieval.\n"
+ )
+)
+
+submit_parser.add_argument("-r", "--run", required=True, choices=['g', 'd', 'a', 'r'], help=(
+                                                "'[g]et', '[d]elete', '[a]dd' or '[r]eplace'.\n"
+ )
+)
+
+submit_parser.add_argument("--lease-size", dest="lease_size", type=int, default=1000, help=(
+                                                "Records per lease (default 1000).\n"
+ )
+)
+
+submit_parser.add_argument("--rate", type=float, help=(
+                                                "Requests per second for the Institution, all nodes together\n"
+                                                "(default: RATE_LIMIT of the institution profile, see API_PROFILES.env).\n"
+                                                "- Must be above 0: without a shared limit N nodes would send N times the rate.\n"
+                                                "- Rates below 1 are fine: 0.5 is one request every 2 seconds.\n"
+ )
+)
+
+submit_parser.add_argument("-o", "--out-dir", dest="out_dir", help=(
+                                                "Shared directory for the outputs (default: the directory of the input file).\n"
+ )
+)
+
+submit_parser.add_argument("-c", "--compress", choices=['gz', 'zst'], help=(
+                                                "Write the .mrc output compressed (gzip or zstd).\n"
+ )
+)
+
+work_parser.add_argument("--node", default=f"{socket.gethostname()}:{os.getpid()}", help=(
+                                                "Name of this worker in the queue (default host:pid).\n"
+ )
+)
+
+work_parser.add_argument("--lease-ttl", dest="lease_ttl", type=float, default=120, help=(
+                                                "Seconds a lease stays ours without heartbeat (default 120);\n"
+                                                "after that another node takes it over. The same holds for the merge of the outputs.\n"
+ )
+)
+
+work_parser.add_argument("--max-concurrency", dest="max_concurrency", type=int, help=(
+                                                "Maximum number of requests in flight on this node (default 8), adapted by AIMD.\n"
+                                                "- Without this option every institution uses its profile (API_PROFILES.env).\n"
+ )
+)
+
+work_parser.add_argument("--exit-when-idle", dest="exit_when_idle", action='store_true', help=(
+                                                "Stop when no lease is left instead of waiting for new jobs.\n"
+ )
+)
+
+work_parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity.')
+
+#============================================================#
+#                   END OF HELP PARSER
+#============================================================#
+
+OPERATIONS = {'g': 'get', 'd': 'delete', 'a': 'add', 'r': 'replace'}
+SCRIPT_NAMES = {'get': 'mdt_misc_lhrget', 'delete': 'mdt_misc_lhrdelete', 'add': 'mdt_misc_lhradd', 'replace': 'mdt_misc_lhrreplace'}
+POLL_INTERVAL = 5   # seconds between two looks for a lease when there is none
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY,
+    operation   TEXT NOT NULL,
+    institution TEXT NOT NULL,
+    input_file  TEXT NOT NULL,
+    outfile     TEXT NOT NULL,
+    compress    TEXT,
+    rate        REAL NOT NULL DEFAULT 0,
+    leases      INTEGER NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'open',      -- open, merging, done
+    created     TEXT NOT NULL,
+    merge_owner   TEXT,
+    merge_expires REAL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    job_id      INTEGER NOT NULL,
+    idx         INTEGER NOT NULL,
+    start       INTEGER NOT NULL,
+    end         INTEGER NOT NULL,
+    first_nr    INTEGER NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',   -- pending, leased, done
+    owner       TEXT,
+    attempt     INTEGER NOT NULL DEFAULT 0,
+    expires_at  REAL,
+    counts      TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS rate_windows (
+    institution TEXT NOT NULL,
+    window      INTEGER NOT NULL,
+    count       INTEGER NOT NULL,
+    PRIMARY KEY (institution, window)
+);
+"""
+
+
+def connect(queue):
+    """Connection to the queue; every node and thread uses its own."""
+    db = sqlite3.connect(queue, timeout=60, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA busy_timeout = 60000")
+    db.executescript(SCHEMA)
+    # Queues created before the merge lease
+    columns = [row[1] for row in db.execute("PRAGMA table_info(jobs)")]
+    for column, kind in (('merge_owner', 'TEXT'), ('merge_expires', 'REAL')):
+        if column not in columns:
+            db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+    return db
+
+
+#============================================================#
+#                   SHARED RATE LIMIT
+#============================================================#
+class SqliteRateLimiter:
+    """Requests per second of one institution, counted in the queue for all nodes.
+
+    Time is cut in windows that hold a whole number of requests: `budget`
+    (the rate rounded up) per `period` seconds, e.g. 3 per 1.2s for 2.5/s or
+    1 per 2s for 0.5/s. Every node reserves tokens of the current window in
+    small batches, so the database is not hit for every single request.
+    """
+
+    def __init__(self, queue, institution, rate):
+        if rate <= 0:
+            raise ValueError(f"Rate must be above 0, not {rate}")
+        self.db = connect(queue)
+        self.institution = institution
+        self.rate = rate
+        self.budget = math.ceil(rate)
+        self.period = self.budget / rate
+        self.batch = max(1, self.budget // 10)
+        self.tokens = 0
+        self.window = None
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                window = int(time.time() / self.period)
+                if self.window == window and self.tokens > 0:
+                    self.tokens -= 1
+                    return
+                granted = self._reserve(window)
+                if granted:
+                    self.window, self.tokens = window, granted - 1
+                    return
+                time.sleep(max((window + 1) * self.period - time.time(), 0.01))
+
+    def _reserve(self, window):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute("SELECT count FROM rate_windows WHERE institution = ? AND window = ?",
+                                  (self.institution, window)).fetchone()
+            used = row[0] if row else 0
+            granted = max(min(self.batch, self.budget - used), 0)
+            if granted:
+                self.db.execute("INSERT OR REPLACE INTO rate_windows (institution, window, count) VALUES (?, ?, ?)",
+                                (self.institution, window, used + granted))
+                self.db.execute("DELETE FROM rate_windows WHERE institution = ? AND window < ?", (self.institution, window - 60 / self.period))
+            self.db.execute("COMMIT")
+            return granted
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+
+#============================================================#
+#                   SUBMIT
+#============================================================#
+def submit(queue, input_file, inst_symbol, operation, lease_size, rate, out_dir=None, compress=None):
+    input_file = os.path.abspath(input_file)
+    extension = '.txt' if operation in ('get', 'delete') else '.mrc'
+    if input_extension(input_file) != extension or not is_plain_file(input_file):
+        raise ValueError(f"{operation} jobs need an uncompressed '{extension}' input file")
+
+    # Leases are byte ranges of the input: aligned on lines (.txt) or on records (.mrc)
+    terminator = b'\n' if extension == '.txt' else b'\x1D'
+    total = count_records(input_file, 0, os.path.getsize(input_file), terminator)
+    ranges = mrc_byte_ranges(input_file, max(1, -(-total // lease_size)), terminator)
+
+    institution = inst_symbol.upper()
+    if rate is None:
+        rate = load_profile(institution).rate_limit
+    if not rate or rate <= 0:
+        raise ValueError(f"No request rate for {institution}: give --rate or {institution}_RATE_LIMIT in API_PROFILES.env (above 0)")
+    formatted_datetime = datetime.datetime.now().strftime("%y%m%d.%H%M%S")
+    out_dir = os.path.abspath(out_dir or os.path.dirname(input_file))
+    outfile = os.path.join(out_dir, f"{input_base_name(input_file)}.{SCRIPT_NAMES[operation]}.{institution}.{formatted_datetime}")
+
+    db = connect(queue)
+    db.execute("BEGIN IMMEDIATE")
+    cursor = db.execute("INSERT INTO jobs (operation, institution, input_file, outfile, compress, rate, leases, created) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (operation, institution, input_file, outfile, compress, rate, len(ranges), formatted_datetime))
+    job_id = cursor.lastrowid
+    db.executemany("INSERT INTO leases (job_id, idx, start, end, first_nr) VALUES (?, ?, ?, ?, ?)",
+                   [(job_id, idx, start, end, first_nr) for idx, (start, end, first_nr) in enumerate(ranges)])
+    db.execute("COMMIT")
+
+    print(f"Job {job_id}: {operation} of {total} records for {institution} in {len(ranges)} lease(s)")
+    print(f"Outputs: {outfile}.*")
+    return job_id
+
+
+#============================================================#
+#                   WORKER
+#============================================================#
+class LeaseWorker:
+    """Claims leases, keeps them alive with a heartbeat and processes them.
+
+    The outputs of a lease are written under a name of its own attempt and
+    only moved to the worker part files (.partNNN) when the lease is still
+    ours at the end, so a node that lost its lease never mixes its outputs
+    with those of the node that took it over. The node finishing the last
+    lease of a job merges the parts into the usual {outfile}.* files, under
+    a lease of its own: when it stops halfway, an idle node merges them again.
+    """
+
+    def __init__(self, queue, node, lease_ttl=120, max_concurrency=None, verbose=False):
+        self.queue = queue
+        self.node = node
+        self.lease_ttl = lease_ttl
+        self.max_concurrency = max_concurrency
+        self.verbose = verbose
+        self.db = connect(queue)
+        self.clients = {}
+        self.ledger = AddLedger(LEDGER_FILE)   # a lease taken over does not add its LHRs twice (same ledger on all nodes)
+        self.lease = None
+        self.merging = None   # job whose outputs this node is merging (heartbeat)
+        self.lost = threading.Event()
+        self.stop = threading.Event()
+
+    def client(self, institution, rate):
+        if institution not in self.clients:
+            # Jobs submitted without a rate: the one of the profile, still shared by all nodes
+            limiter = SqliteRateLimiter(self.queue, institution, rate or load_profile(institution).rate_limit)
+            self.clients[institution] = LhrClient(institution, verbose=self.verbose, max_concurrency=self.max_concurrency,
+                                                  rate_limiter=limiter, ledger=self.ledger)
+        return self.clients[institution]
+
+    #================ LEASES ===============================>
+    def claim(self):
+        """Take the first pending lease, or one whose owner stopped sending heartbeats."""
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                "SELECT l.job_id, l.idx, l.start, l.end, l.first_nr, l.attempt, l.status, "
+                "       j.operation, j.institution, j.input_file, j.outfile, j.compress, j.rate, j.leases "
+                "FROM leases l JOIN jobs j ON j.id = l.job_id "
+                "WHERE j.status = 'open' AND (l.status = 'pending' OR (l.status = 'leased' AND l.expires_at < ?)) "
+                "ORDER BY l.job_id, l.idx LIMIT 1", (now,)).fetchone()
+            if row is None:
+                self.db.execute("COMMIT")
+                return None
+            self.db.execute("UPDATE leases SET status = 'leased', owner = ?, attempt = attempt + 1, expires_at = ? "
+                            "WHERE job_id = ? AND idx = ?", (self.node, now + self.lease_ttl, row[0], row[1]))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        keys = ('job_id', 'idx', 'start', 'end', 'first_nr', 'attempt', 'previous_status',
+                'operation', 'institution', 'input_file', 'outfile', 'compress', 'rate', 'leases')
+        lease = dict(zip(keys, row))
+        lease['attempt'] += 1
+        if lease['previous_status'] == 'leased':
+            print(f"Job {lease['job_id']} lease {lease['idx'] + 1}/{lease['leases']}: previous owner stopped, taking it over (attempt {lease['attempt']}).")
+        return lease
+
+    def heartbeat(self):
+        db = connect(self.queue)
+        while not self.stop.wait(self.lease_ttl / 3):
+            if self.merging is not None:
+                db.execute("UPDATE jobs SET merge_expires = ? WHERE id = ? AND merge_owner = ? AND status = 'merging'",
+                           (time.time() + self.lease_ttl, self.merging, self.node))
+            lease = self.lease
+            if lease is None:
+                continue
+            cursor = db.execute("UPDATE leases SET expires_at = ? WHERE job_id = ? AND idx = ? AND owner = ? AND attempt = ? "
+                                "AND status = 'leased'",
+                                (time.time() + self.lease_ttl, lease['job_id'], lease['idx'], self.node, lease['attempt']))
+            if cursor.rowcount == 0:
+                print(f"Job {lease['job_id']} lease {lease['idx'] + 1}/{lease['leases']}: lost to another node, stopping it.")
+                self.lost.set()
+        db.close()
+
+    def release(self, lease):
+        """Give a lease back untouched (rate limit, stop)."""
+        self.db.execute("UPDATE leases SET status = 'pending', owner = NULL, expires_at = NULL "
+                        "WHERE job_id = ? AND idx = ? AND owner = ? AND attempt = ?",
+                        (lease['job_id'], lease['idx'], self.node, lease['attempt']))
+
+    #================ PROCESSING ===============================>
+    def process(self, lease):
+        operation = lease['operation']
+        client = self.client(lease['institution'], lease['rate'])
+
+        if operation in ('get', 'delete'):
+            with open(lease['input_file'], 'rb') as file:
+                file.seek(lease['start'])
+                lines = file.read(lease['end'] - lease['start']).decode('utf-8').splitlines()
+            ctrl_nrs = dict.fromkeys(line.strip() for line in lines)
+            ctrl_nrs.pop('', None)
+            results = client.get_many(ctrl_nrs) if operation == 'get' else client.delete_many(ctrl_nrs)
+        else:
+            records = read_mrc_range(lease['input_file'], lease['start'], lease['end'])
+            many = client.add_many if operation == 'add' else client.replace_many
+            results = many(records, first_nr=lease['first_nr'])
+
+        # Outputs of this attempt only; moved to the part files once the lease is done
+        attempt_outfile = f"{lease['outfile']}.lease{lease['idx']:05d}-{lease['attempt']}"
+        writer = ResultWriter(operation, attempt_outfile, lease['compress'])
+        counts = {}
+        try:
+            for result in results:
+                outcome = writer.write(result)
+                counts[outcome] = counts.get(outcome, 0) + 1
+                if self.lost.is_set():
+                    break
+        finally:
+            writer.close()
+        return writer.paths, counts
+
+    def finish(self, lease, attempt_paths, counts):
+        """Mark the lease done (if still ours) and move its outputs to the part files."""
+        final_paths = output_paths(lease['operation'], lease['outfile'], lease['compress'])
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self.db.execute("UPDATE leases SET status = 'done', counts = ?, expires_at = NULL "
+                                     "WHERE job_id = ? AND idx = ? AND owner = ? AND attempt = ? AND status = 'leased'",
+                                     (json.dumps(counts), lease['job_id'], lease['idx'], self.node, lease['attempt']))
+            still_ours = cursor.rowcount == 1 and not self.lost.is_set()
+            if still_ours:
+                for key, path in attempt_paths.items():
+                    if os.path.exists(path):   # outputs are only created by their first write
+                        os.replace(path, part_path(final_paths[key], lease['idx']))
+                self.db.execute("COMMIT")
+            else:
+                self.db.execute("ROLLBACK")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        if not still_ours:
+            for path in attempt_paths.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        per_outcome = "  ".join(f"{outcome} {count}" for outcome, count in counts.items())
+        print(f"Job {lease['job_id']} lease {lease['idx'] + 1}/{lease['leases']} done: {per_outcome}")
+        self.merge_if_complete(lease['job_id'])
+
+    def merge_if_complete(self, job_id):
+        """The node that sees the last lease done merges the part files; a merge
+        whose node stopped sending heartbeats is taken over."""
+        now = time.time()
+        cursor = self.db.execute("UPDATE jobs SET status = 'merging', merge_owner = ?, merge_expires = ? "
+                                 "WHERE id = ? AND (status = 'open' OR (status = 'merging' AND merge_expires < ?)) "
+                                 "AND NOT EXISTS (SELECT 1 FROM leases WHERE job_id = ? AND status != 'done')",
+                                 (self.node, now + self.lease_ttl, job_id, now, job_id))
+        if cursor.rowcount != 1:
+            return
+
+        operation, outfile, compress, leases = self.db.execute(
+            "SELECT operation, outfile, compress, leases FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        paths = output_paths(operation, outfile, compress).values()
+        self.merging = job_id
+        try:
+            # The part files stay until the job is done: a merge stopped halfway is run again from them
+            merge_part_outputs(paths, leases, keep_parts=True)
+        finally:
+            self.merging = None
+
+        totals = {}
+        for (counts,) in self.db.execute("SELECT counts FROM leases WHERE job_id = ?", (job_id,)):
+            for outcome, count in json.loads(counts or '{}').items():
+                totals[outcome] = totals.get(outcome, 0) + count
+        cursor = self.db.execute("UPDATE jobs SET status = 'done', merge_expires = NULL "
+                                 "WHERE id = ? AND merge_owner = ? AND status = 'merging'", (job_id, self.node))
+        if cursor.rowcount != 1:
+            print(f"Job {job_id}: merge taken over by another node.")
+            return
+        remove_part_outputs(paths, leases)
+        per_outcome = "  ".join(f"{outcome} {count}" for outcome, count in totals.items())
+        print(f"Job {job_id} complete, outputs merged in {outfile}.*: {per_outcome}")
+
+    def merge_stalled(self):
+        """Merge the jobs whose leases are all done but that nobody merges (node stopped before or during the merge)."""
+        now = time.time()
+        for (job_id,) in self.db.execute("SELECT id FROM jobs WHERE (status = 'open' OR (status = 'merging' AND merge_expires < ?)) "
+                                         "AND NOT EXISTS (SELECT 1 FROM leases WHERE job_id = jobs.id AND status != 'done')",
+                                         (now,)).fetchall():
+            print(f"Job {job_id}: merge left unfinished, merging again.")
+            self.merge_if_complete(job_id)
+
+    #================ MAIN LOOP ===============================>
+    def run(self, exit_when_idle=False):
+        beat = threading.Thread(target=self.heartbeat, daemon=True)
+        beat.start()
+        print(f"Worker {self.node} on {self.queue}\n")
+        try:
+            while True:
+                lease = self.claim()
+                if lease is None:
+                    self.merge_stalled()
+                    if exit_when_idle:
+                        break
+                    time.sleep(POLL_INTERVAL)
+                    continue
+
+                self.lost.clear()
+                self.lease = lease
+                try:
+                    attempt_paths, counts = self.process(lease)
+                except (RateLimitExceeded, ValueError) as err:
+                    print(f"{err} Lease given back, stopping worker...\n")
+                    self.release(lease)
+                    break
+                except KeyboardInterrupt:
+                    self.release(lease)
+                    raise
+                finally:
+                    self.lease = None
+                self.finish(lease, attempt_paths, counts)
+        finally:
+            self.stop.set()
+
+
+#============================================================#
+#                   STATUS
+#============================================================#
+def status(queue):
+    db = connect(queue)
+    now = time.time()
+    for job_id, operation, institution, outfile, leases, job_status in db.execute(
+            "SELECT id, operation, institution, outfile, leases, "
+            "CASE WHEN status = 'merging' AND merge_expires < ? THEN 'merge stalled' ELSE status END "
+            "FROM jobs ORDER BY id", (now,)).fetchall():
+        counts = dict(db.execute("SELECT CASE WHEN status = 'leased' AND expires_at < ? THEN 'expired' ELSE status END, COUNT(*) "
+                                 "FROM leases WHERE job_id = ? GROUP BY 1", (now, job_id)).fetchall())
+        per_status = "  ".join(f"{key} {counts.get(key, 0)}" for key in ('pending', 'leased', 'expired', 'done'))
+        print(f"Job {job_id} [{job_status}] {operation} {institution}: {leases} lease(s) | {per_status}")
+        print(f"    {outfile}.*")
+
+
+if __name__ == '__main__':
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.command == 'submit':
+        try:
+            submit(args.queue, args.input_file, args.key, OPERATIONS[args.run], args.lease_size, args.rate,
+                   args.out_dir, args.compress)
+        except ValueError as err:
+            print(f"\n!ERROR: {err}\n\nExiting program without execution...\n")
+            sys.exit(1)
+
+    elif args.command == 'work':
+        if args.verbose:
+            print("Verbose mode is ON.\n")
+        LeaseWorker(args.queue, args.node, args.lease_ttl, args.max_concurrency, args.verbose).run(args.exit_when_idle)
+
+    elif args.command == 'status':
+        status(args.queue)
+
+    print(f"***End of script***")
@@ -0,0 +1,1914 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright (c) 2025 by OCLC
+#
+#  File		    : mdt_misc_lhrcommon.py
+#  Description	: Shared helpers for the mdt_misc_lhr* scripts
+#  Author(s)	: Elena-Iulia Popa
+#  Creation	    : 19-10-2026
+#
+#  History:
+#  19-10-2026	: popae    : creation
+#           	: Record aligned byte ranges and merge of per worker outputs
+#           	: Local validation of the input files before any API call
+#           	: Progress line with rate and ETA instead of per record prints
+#           	: Transparent gzip/zstd inputs (also from stdin) and compressed outputs
+#           	: Circuit breaker for API outages (502 / HTML error pages)
+#           	: Output files of the scripts written from LhrResult objects
+#           	: AIMD limit of the requests in flight (adaptive concurrency)
+#           	: Reorder buffer: results in input order, spilled to disk when full
+#           	: LOG.jsonl: one JSON entry per error, identical bodies stored once
+#           	: Retry.txt / Retry.mrc: ready-to-run input with the records that failed
+#           	: Streaming MARCXML input, converted to ISO 2709 record by record
+#           	: Columnar sidecar of downloaded LHRs (Parquet, CSV without pyarrow)
+#           	: Canary: sample of the input first, thresholds, projection of the full run
+#           	: Token bucket rate limiter (requests per second of an institution profile)
+#           	: Hedging policy: when to send a duplicate of a slow GET, capped share of extra requests
+#           	: Run registry: a Control Number in several input files is requested once per run
+#           	: Ledger of added LHRs (SQLite): normalized record hash -> Control Number
+#           	: Ledger claims: a pending row taken before the add, confirmed or released after it
+#           	: Local index of the holdings (SQLite), filled by get, queried without the API
+#           	: build_iso2709 / set_control_fields: records rebuilt with other 001/005 (reconcile)
+#           	: Run deadline (parse_deadline) and Resume.txt / Resume.mrc with the records not sent
+#           	: Offset index of .mrc files (<file>.offsets): records by ordinal or 001 through mmap
+#           	: AddLedger: adds without a clear answer kept as 'unknown', not sent again
+#           	: merge_part_outputs through a temporary file, parts optionally kept (merge run again)
+#           	: ResultWriter opens each output on its first write: no empty output files
+#           	: parse_percent for shares given in percent (--hedge-max)
+#
+#  Notes	:
+#
+#  SVN ident	: $Id$
+
+# Built-in/Generic Imports
+import os
+import io
+import re
+import sys
+import gzip
+import mmap
+import array
+import atexit
+import pickle
+import json
+import hashlib
+import tempfile
+import time
+import shutil
+import threading
+import collections
+import random
+import datetime
+import multiprocessing
+import csv
+import sqlite3
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard   # optional: pip install zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow     # optional: pip install pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+RECORD_TERMINATOR = b'\x1D'     # GS - end of an ISO 2709 record
+FIELD_TERMINATOR = b'\x1E'      # RS - end of a field
+SUBFIELD_DELIMITER = b'\x1F'    # US - start of a subfield
+CHUNK_SIZE = 64 * 1024 * 1024   # bytes read at once when counting records
+
+
+#============================================================#
+#                   COMPRESSED INPUTS AND OUTPUTS
+#============================================================#
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+COMPRESSION_SUFFIXES = {'gz': '.gz', 'zst': '.zst'}
+
+
+def compression_of(file_name):
+    """'gz', 'zst' or None, looking at the first bytes of the file."""
+    with open(file_name, 'rb') as file:
+        magic = file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gz'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zst'
+    return None
+
+
+def strip_compression_suffix(file_name):
+    """Name of the file without its .gz/.zst extension."""
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+
+def input_extension(file_name):
+    """Extension of an input file, not counting the compression (data.mrc.gz -> .mrc)."""
+    return os.path.splitext(strip_compression_suffix(file_name))[1]
+
+
+def input_base_name(file_name):
+    """Base name used for the output files (dir/data.mrc.gz -> data)."""
+    return os.path.splitext(os.path.basename(strip_compression_suffix(file_name)))[0]
+
+
+def is_plain_file(file_name):
+    """True when the input can be read with seek/mmap (not compressed)."""
+    return compression_of(file_name) is None
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd files need the zstandard package: pip install zstandard")
+
+
+def open_input(file_name, mode='rb'):
+    """Open an input file, decompressing gzip/zstd on the fly.
+
+    The compression is recognised on the content, not on the extension.
+    """
+    compression = compression_of(file_name)
+    text = 't' in mode
+    if compression == 'gz':
+        return gzip.open(file_name, 'rt' if text else 'rb')
+    if compression == 'zst':
+        _require_zstandard()
+        reader = zstandard.ZstdDecompressor().stream_reader(open(file_name, 'rb'), read_across_frames=True, closefd=True)
+        reader = io.BufferedReader(reader)
+        return io.TextIOWrapper(reader) if text else reader
+    return open(file_name, 'r' if text else 'rb')
+
+
+def output_name(file_name, compress=None):
+    """Name of an output file, with the extension of the compression if any."""
+    return file_name + COMPRESSION_SUFFIXES[compress] if compress else file_name
+
+
+def open_output(file_name, mode='a'):
+    """Open an output file; .gz/.zst names (also as worker part) are written compressed."""
+    text = 'b' not in mode
+    name = re.sub(r'\.part\d+$', '', file_name)
+    if name.endswith('.gz'):
+        return gzip.open(file_name, mode.replace('t', '').replace('b', '') + ('t' if text else 'b'))
+    if name.endswith('.zst'):
+        _require_zstandard()
+        writer = zstandard.ZstdCompressor().stream_writer(open(file_name, mode.replace('t', '').replace('b', '') + 'b'), closefd=True)
+        return io.TextIOWrapper(writer) if text else writer
+    return open(file_name, mode)
+
+
+def spool_stdin():
+    """Copy stdin (compressed or not) to a temporary file named 'stdin'.
+
+    The scripts read their input more than once (validation, worker
+    processes), which a pipe does not allow. The file is removed at exit.
+    """
+    spool_dir = tempfile.mkdtemp(prefix='lhr_stdin_')
+    spool_file = os.path.join(spool_dir, 'stdin')
+    with open(spool_file, 'wb') as out:
+        shutil.copyfileobj(sys.stdin.buffer, out, CHUNK_SIZE)
+    atexit.register(shutil.rmtree, spool_dir, True)
+    return spool_file
+
+
+def read_mrc_records(file_name):
+    """All records of an (optionally compressed) .mrc file, split on the record terminator."""
+    with open_input(file_name, 'rb') as file:
+        data_in_file = file.read()
+
+    records = data_in_file.split(RECORD_TERMINATOR)
+    if records and records[-1].strip() == b'':
+        records = records[:-1]   # Exclude the last empty record
+    return records
+
+
+#============================================================#
+#                   MARCXML INPUT
+#============================================================#
+def _local_name(tag):
+    """Tag of an element without its namespace ({http://www.loc.gov/MARC21/slim}record -> record)."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def marcxml_to_iso2709(record):
+    """Convert one MARCXML <record> element to an ISO 2709 record (UTF-8).
+
+    The record is returned without its record terminator, like the records
+    of read_mrc_records (see build_iso2709).
+    """
+    leader = None
+    fields = []
+    for child in record:
+        name = _local_name(child.tag)
+        if name == 'leader':
+            leader = (child.text or '')
+        elif name == 'controlfield':
+            fields.append((child.get('tag', ''), (child.text or '').encode('utf-8')))
+        elif name == 'datafield':
+            data = (child.get('ind1', ' ') or ' ')[:1].encode('utf-8') + (child.get('ind2', ' ') or ' ')[:1].encode('utf-8')
+            for subfield in child:
+                if _local_name(subfield.tag) == 'subfield':
+                    data += SUBFIELD_DELIMITER + subfield.get('code', '').encode('utf-8') + (subfield.text or '').encode('utf-8')
+            fields.append((child.get('tag', ''), data))
+    return build_iso2709(leader, fields, coding='a')   # the data of MARCXML is UTF-8
+
+
+def build_iso2709(leader, fields, coding=None):
+    """ISO 2709 record (without record terminator) from a leader and (tag, data) fields.
+
+    Record length and base address of the leader are computed. Position 9
+    (character coding) is set to `coding` when given, otherwise it keeps
+    the value of `leader`: a MARC-8 record (blank) stays MARC-8.
+    """
+    if isinstance(leader, bytes):
+        leader = leader.decode('ascii', 'replace')
+    leader = (leader or '').ljust(24)[:24]
+    directory = b''
+    data = b''
+    for tag, value in fields:
+        value += FIELD_TERMINATOR
+        directory += tag.encode('ascii', 'replace')[:3].rjust(3, b'0') + b'%04d%05d' % (len(value), len(data))
+        data += value
+    directory += FIELD_TERMINATOR
+
+    base_address = 24 + len(directory)
+    record_length = base_address + len(data) + 1
+    leader = f"{record_length:05d}{leader[5:9]}{coding or leader[9]}{leader[10:12]}{base_address:05d}{leader[17:24]}"
+    return leader.encode('ascii', 'replace') + directory + data
+
+
+def read_marcxml_records(file_name):
+    """Yield the records of a MARCXML file (also gzip/zstd) as ISO 2709, one by one.
+
+    The file is parsed incrementally and every record is dropped from the
+    tree once converted, so memory stays the same whatever the size of the
+    collection.
+    """
+    with open_input(file_name, 'rb') as file:
+        root = None
+        for event, elem in ET.iterparse(file, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+            if _local_name(elem.tag) == 'record':
+                yield marcxml_to_iso2709(elem)
+                elem.clear()
+                if root is not elem:
+                    root.clear()   # drop the converted records from the collection
+
+
+def is_marcxml(file_name):
+    """True for a .xml input, or an input without extension (stdin) that starts like XML."""
+    extension = input_extension(file_name)
+    if extension:
+        return extension == '.xml'
+    with open_input(file_name, 'rb') as file:
+        return file.read(64).lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'<')
+
+
+def read_input_records(file_name):
+    """Records of an add/replace input: MARCXML (.xml) streamed, ISO 2709 (.mrc) read at once."""
+    if is_marcxml(file_name):
+        return read_marcxml_records(file_name)
+    return read_mrc_records(file_name)
+
+
+#============================================================#
+#                   SHARDING OF .mrc FILES
+#============================================================#
+def mrc_byte_ranges(file_name, parts, terminator=RECORD_TERMINATOR):
+    """Cut an .mrc file in at most `parts` record aligned byte ranges.
+
+    Every range ends right after a record terminator (or at the end of the
+    file), so no record is split between two ranges.
+    Returns a list of (start, end, first_nr) where first_nr is the ordinal
+    (1 based) of the first record of the range in the whole file.
+    With terminator=b'\\n' a .txt file is cut on its lines in the same way.
+    """
+    size = os.path.getsize(file_name)
+    if size == 0:
+        return []
+
+    parts = max(1, parts)
+    cuts = [0]
+    with open(file_name, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for i in range(1, parts):
+                target = max(size * i // parts, cuts[-1])
+                pos = mm.find(terminator, target)
+                if pos == -1:
+                    break
+                if pos + 1 > cuts[-1] and pos + 1 < size:
+                    cuts.append(pos + 1)
+    cuts.append(size)
+
+    ranges = []
+    first_nr = 1
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        ranges.append((start, end, first_nr))
+        first_nr += count_records(file_name, start, end, terminator)
+    return ranges
+
+
+def count_records(file_name, start, end, terminator=RECORD_TERMINATOR):
+    """Count the records between two byte offsets of an .mrc file (lines with b'\\n')."""
+    count = 0
+    last = b''
+    with open(file_name, 'rb') as file:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            count += chunk.count(terminator)
+            remaining -= len(chunk)
+            last = chunk
+    # A last record without terminator still counts (same as the split in main)
+    if last[last.rfind(terminator) + 1:].strip() != b'':
+        count += 1
+    return count
+
+
+def read_mrc_range(file_name, start, end):
+    """Return the records of one byte range, split on the record terminator."""
+    with open(file_name, 'rb') as file:
+        file.seek(start)
+        data_in_range = file.read(end - start)
+
+    records = data_in_range.split(RECORD_TERMINATOR)
+    if records and records[-1].strip() == b'':
+        records = records[:-1]   # Exclude the last empty record
+    return records
+
+
+#============================================================#
+#                   OFFSET INDEX OF .mrc FILES
+#============================================================#
+class MrcOffsetIndex:
+    """Byte offset, length and 001 of every record of an uncompressed .mrc file.
+
+    Records are numbered from 1 as in read_mrc_records (the `nr` of the
+    scripts). The index is kept next to the file as <file>.offsets, built in
+    one pass over the file the first time it is needed and built again when
+    the file changed (size or modification time). Records are then read
+    through mmap, so a slice of a huge file costs what the slice costs.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.path = f"{file_name}.offsets"
+        stat = os.stat(file_name)
+        self.stamp = (stat.st_size, stat.st_mtime_ns)
+        self.built = False
+        if not self._load():
+            self._build()
+            self._save()
+        self._by_ctrl_nr = None
+        self._file = open(file_name, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                stamp, self.offsets, self.lengths, self.ctrl_nrs = pickle.load(file)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return False
+        return tuple(stamp) == self.stamp
+
+    def _build(self):
+        self.offsets = array.array('q')
+        self.lengths = array.array('q')
+        self.ctrl_nrs = []
+        with open(self.file_name, 'rb') as file:
+            if self.stamp[0]:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    start = 0
+                    while start < len(mm):
+                        end = mm.find(RECORD_TERMINATOR, start)
+                        if end == -1:
+                            end = len(mm)
+                            if mm[start:end].strip() == b'':
+                                break   # Exclude the last empty record
+                        self.offsets.append(start)
+                        self.lengths.append(end - start)
+                        self.ctrl_nrs.append(record_control_number(mm[start:end]))
+                        start = end + 1
+        self.built = True
+
+    def _save(self):
+        try:
+            with open(self.path + '.tmp', 'wb') as file:
+                pickle.dump((self.stamp, self.offsets, self.lengths, self.ctrl_nrs), file, pickle.HIGHEST_PROTOCOL)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as err:
+            print(f"Offset index not saved ({err}); it is built again next time.")
+
+    def record(self, nr):
+        """Record nr (1 based), without its record terminator."""
+        offset = self.offsets[nr - 1]
+        return self._mm[offset:offset + self.lengths[nr - 1]]
+
+    def records(self, nrs):
+        for nr in nrs:
+            yield self.record(nr)
+
+    def parse_range(self, spec):
+        """'START:END' (1 based, both included; either may be left out) -> range of record nrs."""
+        start, sep, end = spec.partition(':')
+        if not sep:
+            raise ValueError(f"Range '{spec}' is not START:END")
+        start = int(start) if start.strip() else 1
+        end = int(end) if end.strip() else len(self)
+        if start < 1 or end < start:
+            raise ValueError(f"Range '{spec}' is empty or starts before record 1")
+        return range(start, min(end, len(self)) + 1)
+
+    def nrs_of(self, ctrl_nrs):
+        """(record nrs in file order, Control Numbers not in the file) of records with these 001s."""
+        if self._by_ctrl_nr is None:
+            self._by_ctrl_nr = collections.defaultdict(list)
+            for nr, ctrl_nr in enumerate(self.ctrl_nrs, start=1):
+                if ctrl_nr:
+                    self._by_ctrl_nr[ctrl_nr].append(nr)
+        nrs = []
+        missing = []
+        for ctrl_nr in dict.fromkeys(ctrl_nrs):
+            if ctrl_nr in self._by_ctrl_nr:
+                nrs.extend(self._by_ctrl_nr[ctrl_nr])
+            else:
+                missing.append(ctrl_nr)
+        return sorted(nrs), missing
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+
+#============================================================#
+#                   PER WORKER OUTPUTS
+#============================================================#
+def part_path(path, index):
+    """Name of the output file written by worker `index`."""
+    return f"{path}.part{index:03d}"
+
+
+def merge_part_outputs(paths, parts, keep_parts=False):
+    """Write the per worker outputs to the usual output files, in order.
+
+    Every output is written to a temporary file first and renamed when
+    complete, so a merge stopped halfway can simply be run again as long as
+    the part files are kept (`keep_parts`, remove them with
+    remove_part_outputs once done). Outputs nobody wrote to are not created.
+    """
+    for path in paths:
+        part_files = [part_path(path, index) for index in range(parts)]
+        part_files = [p for p in part_files if os.path.exists(p)]
+        if not part_files:
+            continue
+        handle, merging = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.merging')
+        try:
+            with os.fdopen(handle, 'wb') as out:
+                for part_file in part_files:
+                    with open(part_file, 'rb') as part:
+                        shutil.copyfileobj(part, out, CHUNK_SIZE)
+            os.replace(merging, path)
+        except BaseException:
+            os.remove(merging)
+            raise
+    if not keep_parts:
+        remove_part_outputs(paths, parts)
+
+
+def remove_part_outputs(paths, parts):
+    for path in paths:
+        for index in range(parts):
+            if os.path.exists(part_path(path, index)):
+                os.remove(part_path(path, index))
+
+
+#============================================================#
+#                   LOCAL VALIDATION OF THE INPUT
+#============================================================#
+def check_mrc_record(record, required_tags=(), forbidden_tags=()):
+    """Check one ISO 2709 record (without its record terminator).
+
+    Returns the reason of the rejection, or None when the record is fine.
+    """
+    if len(record) < 24:
+        return "truncated record (no complete leader)"
+
+    leader = record[:24]
+    if not leader[0:5].isdigit():
+        return f"bad leader length '{leader[0:5].decode('latin-1')}'"
+    record_length = int(leader[0:5])
+    if record_length != len(record) + 1:
+        if record_length > len(record) + 1:
+            return f"truncated record (leader length {record_length}, found {len(record) + 1})"
+        return f"leader length {record_length} does not match record length {len(record) + 1}"
+
+    if not leader[12:17].isdigit():
+        return f"bad base address '{leader[12:17].decode('latin-1')}'"
+    base_address = int(leader[12:17])
+    if base_address < 25 or base_address > len(record):
+        return f"base address {base_address} outside of the record"
+
+    directory = record[24:base_address - 1]
+    if record[base_address - 1:base_address] != FIELD_TERMINATOR or len(directory) % 12 != 0:
+        return "bad directory"
+
+    data_length = len(record) - base_address
+    tags = set()
+    for pos in range(0, len(directory), 12):
+        entry = directory[pos:pos + 12]
+        tag = entry[0:3].decode('latin-1')
+        if not entry[3:12].isdigit():
+            return f"bad directory entry for tag {tag}"
+        field_length = int(entry[3:7])
+        field_start = int(entry[7:12])
+        if field_start + field_length > data_length:
+            return f"field {tag} outside of the record"
+        tags.add(tag)
+
+    for tag in forbidden_tags:
+        if tag in tags:
+            return f"field {tag} must not be present"
+    for tag in required_tags:
+        if tag not in tags:
+            return f"field {tag} is missing"
+    return None
+
+
+def record_control_number(record):
+    """Value of the 001 of an ISO 2709 record (bytes or str), None when absent."""
+    if isinstance(record, str):
+        record = record.encode('utf-8')
+    if len(record) < 24 or not record[12:17].isdigit():
+        return None
+    base_address = int(record[12:17])
+    directory = record[24:base_address - 1]
+    for pos in range(0, len(directory) - 11, 12):
+        if directory[pos:pos + 3] == b'001' and directory[pos + 3:pos + 12].isdigit():
+            field_length = int(directory[pos + 3:pos + 7])
+            field_start = base_address + int(directory[pos + 7:pos + 12])
+            value = record[field_start:field_start + field_length].rstrip(FIELD_TERMINATOR)
+            return value.decode('utf-8', 'replace').strip()
+    return None
+
+
+def set_control_fields(record, values):
+    """Copy of an ISO 2709 record with control fields set or removed.
+
+    `values` maps a tag to its new value, or to None to remove the field,
+    e.g. {'001': '123456', '005': None}. Set fields go before the first
+    field with a higher tag.
+    """
+    if isinstance(record, str):
+        record = record.encode('utf-8')
+    record = record.rstrip(RECORD_TERMINATOR)
+    fields = [(tag, data) for tag, data in record_fields(record) if tag not in values]
+    for tag, value in sorted(values.items()):
+        if value is not None:
+            position = next((i for i, (other, data) in enumerate(fields) if other > tag), len(fields))
+            fields.insert(position, (tag, str(value).encode('utf-8')))
+    return build_iso2709(record[:24], fields)
+
+
+def check_ctrl_nr(ctrl_nr):
+    """Check one Control Number of a .txt input; returns the reason or None."""
+    if ctrl_nr == '':
+        return "empty line"
+    if not ctrl_nr.isdigit():
+        return "Control Number is not numeric"
+    return None
+
+
+def _validate_mrc_range(file_name, start, end, first_nr, required_tags, forbidden_tags):
+    return _validate_mrc_records(first_nr, read_mrc_range(file_name, start, end), required_tags, forbidden_tags)
+
+
+def _validate_ctrl_nrs(first_line_nr, lines):
+    rejects = []
+    for line_nr, line in enumerate(lines, start=first_line_nr):
+        reason = check_ctrl_nr(line.strip())
+        if reason is not None:
+            rejects.append((line_nr, line.strip(), reason))
+    return rejects
+
+
+def _validate_mrc_records(first_nr, records, required_tags, forbidden_tags):
+    rejects = []
+    for nr, record in enumerate(records, start=first_nr):
+        reason = check_mrc_record(record, required_tags, forbidden_tags)
+        if reason is not None:
+            rejects.append((nr, reason, record))
+    return rejects
+
+
+def validate_mrc_file(file_name, processes=None, required_tags=(), forbidden_tags=(), records_per_chunk=50000):
+    """Validate all records of an .mrc file, spread over `processes` processes.
+
+    Returns a list of (record nr, reason, raw record) of the rejected records,
+    ordered on the record nr.
+    """
+    if is_marcxml(file_name):
+        # Converted on the fly in this process: the parse is the expensive part
+        return _validate_mrc_records(1, read_marcxml_records(file_name), required_tags, forbidden_tags)
+
+    if not is_plain_file(file_name):
+        # No byte ranges in a compressed file: hand out chunks of records instead
+        records = read_mrc_records(file_name)
+        chunks = [(first + 1, records[first:first + records_per_chunk]) for first in range(0, len(records), records_per_chunk)]
+        if len(chunks) <= 1:
+            return [reject for first_nr, chunk in chunks for reject in _validate_mrc_records(first_nr, chunk, required_tags, forbidden_tags)]
+        with ProcessPoolExecutor(max_workers=min(len(chunks), processes or os.cpu_count() or 1)) as executor:
+            futures = [executor.submit(_validate_mrc_records, first_nr, chunk, required_tags, forbidden_tags) for first_nr, chunk in chunks]
+            return [reject for future in futures for reject in future.result()]
+
+    ranges = mrc_byte_ranges(file_name, processes or os.cpu_count() or 1)
+    if len(ranges) <= 1:
+        return [reject for start, end, first_nr in ranges
+                for reject in _validate_mrc_range(file_name, start, end, first_nr, required_tags, forbidden_tags)]
+
+    with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_validate_mrc_range, file_name, start, end, first_nr, required_tags, forbidden_tags)
+                   for start, end, first_nr in ranges]
+        return [reject for future in futures for reject in future.result()]
+
+
+def validate_ctrl_nr_file(file_name, processes=None, lines_per_chunk=100000):
+    """Validate all Control Numbers of a .txt file, spread over `processes` processes.
+
+    Returns a list of (line nr, value, reason) of the rejected lines.
+    """
+    with open_input(file_name, 'rt') as file:
+        lines = file.read().splitlines()
+
+    chunks = [(first, lines[first:first + lines_per_chunk]) for first in range(0, len(lines), lines_per_chunk)]
+    if len(chunks) <= 1:
+        return [reject for first, chunk in chunks for reject in _validate_ctrl_nrs(first + 1, chunk)]
+
+    with ProcessPoolExecutor(max_workers=min(len(chunks), processes or os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(_validate_ctrl_nrs, first + 1, chunk) for first, chunk in chunks]
+        return [reject for future in futures for reject in future.result()]
+
+
+#============================================================#
+#                   PROGRESS AND ETA
+#============================================================#
+class Progress:
+    """Counts the outcome of every record and shows one progress line.
+
+    On a terminal the line is rewritten in place a few times per second;
+    otherwise (log pipe, cron) a summary line is printed every
+    `summary_interval` seconds. The counters live in shared memory, so worker
+    processes started after the creation (forked, or given the Progress as
+    Pool initargs) can update them too, and so can the concurrency limits of
+    the `workers` processes (shown summed).
+    """
+
+    def __init__(self, total, outcomes, in_place=None, interval=0.25, summary_interval=30, stream=None, workers=1):
+        self.total = total
+        self.outcomes = list(outcomes)
+        self.limits = multiprocessing.Array('i', max(workers, 1))
+        self.stream = stream or sys.stdout
+        self.in_place = self.stream.isatty() if in_place is None else in_place
+        self.interval = interval if self.in_place else summary_interval
+        self.counts = multiprocessing.Array('q', len(self.outcomes))
+        self.start_time = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __getstate__(self):
+        # Handed to a worker process (Pool initargs): the counters, not the display
+        state = self.__dict__.copy()
+        state.update(stream=None, _stop=None, _thread=None)
+        return state
+
+    def update(self, outcome, n=1):
+        if outcome not in self.outcomes:
+            outcome = self.outcomes[-1]
+        with self.counts.get_lock():
+            self.counts[self.outcomes.index(outcome)] += n
+
+    def done(self):
+        return sum(self.counts[:])
+
+    def set_limit(self, limit, slot=0):
+        """Current concurrency limit of one worker (see AimdLimiter)."""
+        self.limits[slot] = limit
+
+    def line(self):
+        counts = self.counts[:]
+        done = sum(counts)
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        rate = done / elapsed
+        if rate > 0 and self.total:
+            eta = format_duration(max(self.total - done, 0) / rate)
+        else:
+            eta = '--:--:--'
+        percent = f"{100 * done / self.total:5.1f}%" if self.total else "  -  "
+        total = self.total if self.total is not None else '?'   # streamed input: not known in advance
+        per_outcome = "  ".join(f"{outcome} {count}" for outcome, count in zip(self.outcomes, counts))
+        limit = sum(self.limits[:])
+        concurrency = f" | limit {limit}" if limit else ""
+        return f"[{done}/{total}] {percent} | {rate:.1f} rec/s | ETA {eta}{concurrency} | {per_outcome}"
+
+    def render(self):
+        if self.in_place:
+            self.stream.write("\r" + self.line() + "\033[K")
+        else:
+            self.stream.write(self.line() + "\n")
+        self.stream.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.render()
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        elapsed = format_duration(time.monotonic() - self.start_time)
+        if self.in_place:
+            self.stream.write("\r" + self.line() + "\033[K\n")
+        else:
+            self.stream.write(self.line() + "\n")
+        self.stream.write(f"Elapsed: {elapsed}\n")
+        self.stream.flush()
+
+
+def format_duration(seconds):
+    """Seconds as H:MM:SS."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+#============================================================#
+#                   CIRCUIT BREAKER
+#============================================================#
+class CircuitBreaker:
+    """Stops all requests while the API is down (502 Bad Gateway, HTML pages).
+
+    closed    : requests go through; the last `window` responses are kept and
+                the breaker opens when `threshold` of them are outage errors.
+    open      : before_request() blocks every caller for `probe_delay` seconds.
+    half open : one caller is let through as probe. A good response closes the
+                breaker, an outage error opens it again with a doubled delay
+                (up to `max_probe_delay`).
+    """
+
+    def __init__(self, threshold=0.5, window=20, min_calls=5, probe_delay=5, max_probe_delay=300, probe_timeout=120):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.base_delay = probe_delay
+        self.max_delay = max_probe_delay
+        self.probe_timeout = probe_timeout
+        self.delay = probe_delay
+        self.state = 'closed'
+        self.open_until = 0
+        self.probe_started = 0
+        self.outages = 0
+        self.results = collections.deque(maxlen=window)
+        self.cond = threading.Condition()
+
+    @property
+    def is_open(self):
+        return self.state != 'closed'
+
+    def before_request(self):
+        """Return when a request may be sent; blocks while the breaker is open."""
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.state == 'closed':
+                    return
+                if self.state == 'open' and now >= self.open_until:
+                    self.state = 'half_open'
+                    self.probe_started = now
+                    return   # this caller is the probe
+                if self.state == 'half_open' and now - self.probe_started > self.probe_timeout:
+                    self.probe_started = now
+                    return   # the previous probe never came back, send another one
+                if self.state == 'open':
+                    self.cond.wait(self.open_until - now)
+                else:
+                    self.cond.wait(1)
+
+    def record(self, ok):
+        """Register a response: ok=False for an outage error, True for any real answer."""
+        with self.cond:
+            if self.state == 'half_open':
+                if ok:
+                    print(f"\nCircuit breaker closed: API answers again, resuming.")
+                    self.state = 'closed'
+                    self.delay = self.base_delay
+                    self.results.clear()
+                else:
+                    self.delay = min(self.delay * 2, self.max_delay)
+                    self._open()
+                self.cond.notify_all()
+                return
+
+            if self.state == 'open':
+                return   # late answer of a request sent before the breaker opened
+
+            self.results.append(ok)
+            failures = self.results.count(False)
+            if len(self.results) >= self.min_calls and failures >= self.threshold * len(self.results):
+                self.outages += 1
+                print(f"\nCircuit breaker open: {failures} outage errors in the last {len(self.results)} responses.")
+                self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self.open_until = time.monotonic() + self.delay
+        print(f"Pausing all requests, next probe in {self.delay} seconds.")
+
+
+# Markers of the answers of the API
+NOT_FOUND_MARKERS = ('"type": "NOT_FOUND",', '{"type":"NOT_FOUND"')
+BAD_REQUEST_MARKER = '<type>BAD_REQUEST</type>'
+AUTH_ERROR_MARKER = 'API Key or Authorization header is required'
+RATE_LIMIT_MARKER = 'API rate limit exceeded'
+
+
+def is_outage_response(result):
+    """True for the error pages the gateway sends when the API is down."""
+    return '<!DOCTYPE html>' in result or '<head><title>502 Bad Gateway</title></head>' in result
+
+
+def error_type(body):
+    """Short name of the kind of error in an answer of the API (for LOG.jsonl)."""
+    if RATE_LIMIT_MARKER in body:
+        return 'rate_limit'
+    if is_outage_response(body):
+        return 'outage'
+    if AUTH_ERROR_MARKER in body:
+        return 'auth'
+    if BAD_REQUEST_MARKER in body:
+        return 'bad_request'
+    if any(marker in body for marker in NOT_FOUND_MARKERS):
+        return 'not_found'
+    return 'api_error'
+
+
+#============================================================#
+#                   ADAPTIVE CONCURRENCY (AIMD)
+#============================================================#
+class AimdLimiter:
+    """Limit of the requests in flight, adapted like TCP congestion control.
+
+    Additive increase: every healthy response raises the limit by
+    `increase / limit`, so about `increase` per round of `limit` requests.
+    Multiplicative decrease: a throttled answer ('API rate limit exceeded'),
+    an outage error (5xx, timeout) or a latency spike (more than
+    `latency_factor` times the usual latency and above `latency_floor`
+    seconds) multiplies the limit by `decrease`. Only one cut per round:
+    answers to requests sent before the last cut do not cut again.
+    """
+
+    def __init__(self, initial=1, min_limit=1, max_limit=16, increase=1.0, decrease=0.5,
+                 latency_factor=3.0, latency_floor=1.0, on_change=None):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor
+        self.on_change = on_change
+        self._limit = float(min(max(initial, min_limit), self.max_limit))
+        self.peak = int(self._limit)
+        self.cuts = 0
+        self.in_flight = 0
+        self.latency = None           # moving average of the healthy latencies
+        self.last_cut = 0
+        self.lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def has_room(self):
+        return self.in_flight < self.limit
+
+    def acquire(self):
+        self.in_flight += 1
+        return time.monotonic()
+
+    def release(self):
+        self.in_flight -= 1
+
+    def _changed(self, old):
+        if int(self._limit) != int(old):
+            self.peak = max(self.peak, int(self._limit))
+            if self.on_change is not None:
+                self.on_change(int(self._limit))
+
+    def success(self, latency, started=None):
+        """A real answer of the API after `latency` seconds."""
+        with self.lock:
+            if self.latency is not None and latency > max(self.latency * self.latency_factor, self.latency_floor):
+                self._cut(started)
+                return
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+            old = self._limit
+            self._limit = min(self._limit + self.increase / self._limit, self.max_limit)
+            self._changed(old)
+
+    def overload(self, started=None):
+        """Outage error or timeout: the API has more than it can handle."""
+        with self.lock:
+            self._cut(started)
+
+    def throttled(self, started=None):
+        """'API rate limit exceeded'; False when the limit is already at its minimum."""
+        with self.lock:
+            if self._limit <= self.min_limit and (started is None or started >= self.last_cut):
+                return False
+            self._cut(started)
+            return True
+
+    def _cut(self, started):
+        if started is not None and started < self.last_cut:
+            return   # sent before the last cut: this round was cut already
+        old = self._limit
+        self._limit = max(self._limit * self.decrease, self.min_limit)
+        self.last_cut = time.monotonic()
+        self.cuts += 1
+        self._changed(old)
+
+    def summary(self):
+        return f"Concurrency limit: {self.limit} (peak {self.peak}, max {self.max_limit}, {self.cuts} cut(s))"
+
+
+class TokenBucket:
+    """At most `rate` requests per second, with bursts of up to `burst` requests.
+
+    acquire() waits until a token is available; usable as the rate_limiter
+    of an LhrClient.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+class HedgePolicy:
+    """When a slow idempotent request gets a duplicate (hedge), and how many.
+
+    The delay before the hedge is the `percentile` of the last `window`
+    latencies (not less than `min_delay`); no hedge before `min_samples`
+    latencies are known. Hedges stay below `max_share` of the requests, so
+    the extra load is bounded whatever the API does.
+    """
+
+    def __init__(self, percentile=0.95, max_share=0.05, window=500, min_samples=20, min_delay=0.05):
+        self.percentile = percentile
+        self.max_share = max_share
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0          # hedges answering before the first request
+        self.lock = threading.Lock()
+        self._delay = None
+        self._stale = 0
+
+    def observe(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self._stale += 1
+
+    def delay(self):
+        """Seconds to wait before hedging a request just sent; None: no hedge."""
+        with self.lock:
+            self.requests += 1
+            if len(self.latencies) < self.min_samples:
+                return None
+            if self._delay is None or self._stale >= 10:   # no sort for every request
+                ordered = sorted(self.latencies)
+                self._delay = max(ordered[min(int(self.percentile * len(ordered)), len(ordered) - 1)], self.min_delay)
+                self._stale = 0
+            return self._delay
+
+    def allow(self):
+        """True (and counted) when one more hedge stays within max_share."""
+        with self.lock:
+            if self.hedges + 1 > self.max_share * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def won(self):
+        with self.lock:
+            self.wins += 1
+
+    def summary(self):
+        share = self.hedges / self.requests if self.requests else 0.0
+        return (f"Hedged requests: {self.hedges} ({share:.1%} of {self.requests}, max {self.max_share * 100:g}%), "
+                f"{self.wins} answered first")
+
+
+#============================================================#
+#                   INPUT ORDER OF THE RESULTS
+#============================================================#
+class ReorderBuffer:
+    """Hands out items in sequence order while they arrive in any order.
+
+    Items that arrive before their turn wait in memory; once `capacity` of
+    them wait, the next ones are pickled to a temporary spill file instead,
+    so a slow request at the head never stalls the ones behind it.
+    """
+
+    def __init__(self, capacity=10000, spill_dir=None, first_seq=0):
+        self.capacity = capacity
+        self.spill_dir = spill_dir
+        self.next_seq = first_seq
+        self.memory = {}
+        self.spilled = {}          # seq -> (offset, length) in the spill file
+        self.spill_file = None
+        self.spill_count = 0
+
+    def __len__(self):
+        return len(self.memory) + len(self.spilled)
+
+    def add(self, seq, item):
+        """Register item `seq`; returns the items that can be written now, in order."""
+        if seq != self.next_seq:
+            if len(self.memory) < self.capacity:
+                self.memory[seq] = item
+            else:
+                self._spill(seq, item)
+            return []
+
+        ready = [item]
+        self.next_seq += 1
+        while True:
+            item = self._take(self.next_seq)
+            if item is None:
+                break
+            ready.append(item)
+            self.next_seq += 1
+        return ready
+
+    def drain(self):
+        """The waiting items in sequence order, gaps skipped (run stopped early)."""
+        ready = [self._take(seq) for seq in sorted(list(self.memory) + list(self.spilled))]
+        self.close()
+        return ready
+
+    def _spill(self, seq, item):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix='lhr_reorder_', dir=self.spill_dir)
+        data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        offset = self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(data)
+        self.spilled[seq] = (offset, len(data))
+        self.spill_count += 1
+
+    def _take(self, seq):
+        if seq in self.memory:
+            return self.memory.pop(seq)
+        if seq not in self.spilled:
+            return None
+        offset, length = self.spilled.pop(seq)
+        self.spill_file.seek(offset)
+        item = pickle.loads(self.spill_file.read(length))
+        if not self.spilled:
+            self.spill_file.truncate(0)   # all read back: give the disk space back
+        return item
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.memory = {}
+        self.spilled = {}
+
+
+class Unordered:
+    """Stand-in for a ReorderBuffer when the order does not matter: every item is handed out at once."""
+
+    def add(self, seq, item):
+        return [item]
+
+    def drain(self):
+        return []
+
+    def close(self):
+        pass
+
+
+#============================================================#
+#                   ONE REQUEST PER CONTROL NUMBER AND RUN
+#============================================================#
+class RunRegistry:
+    """Results of a run per Control Number, for all its input files.
+
+    coalesce() sends only the Control Numbers not seen in an earlier input
+    file of the run and hands out the stored result for the others, so
+    every file still gets all its outputs. Up to `capacity` results are
+    kept in memory, the next ones are pickled to a temporary spill file.
+    """
+
+    def __init__(self, capacity=100000, spill_dir=None):
+        self.capacity = capacity
+        self.spill_dir = spill_dir
+        self.memory = {}           # ctrl_nr -> (result, input file)
+        self.spilled = {}          # ctrl_nr -> (offset, length) in the spill file
+        self.spill_file = None
+        self.hits = 0
+
+    def __contains__(self, key):
+        return key in self.memory or key in self.spilled
+
+    def put(self, key, result, source):
+        if len(self.memory) < self.capacity:
+            self.memory[key] = (result, source)
+            return
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix='lhr_registry_', dir=self.spill_dir)
+        data = pickle.dumps((result, source), pickle.HIGHEST_PROTOCOL)
+        offset = self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(data)
+        self.spilled[key] = (offset, len(data))
+
+    def get(self, key):
+        """(result, input file where it was requested)."""
+        if key in self.memory:
+            return self.memory[key]
+        offset, length = self.spilled[key]
+        self.spill_file.seek(offset)
+        return pickle.loads(self.spill_file.read(length))
+
+    def coalesce(self, keys, many, source):
+        """Yield (result, earlier input file or None) per key, in the order of the keys;
+        `many` is the *_many call of the client for the new keys."""
+        keys = list(keys)
+        known = [key in self for key in keys]
+        results = many(key for key, seen in zip(keys, known) if not seen)
+        try:
+            for key, seen in zip(keys, known):
+                if seen:
+                    self.hits += 1
+                    yield self.get(key)
+                else:
+                    result = next(results)
+                    if result.outcome != 'unsent':   # not sent: a later input file may still send it
+                        self.put(key, result, source)
+                    yield result, None
+        finally:
+            results.close()
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+        self.memory = {}
+        self.spilled = {}
+
+
+#============================================================#
+#                   COLUMNAR EXPORT OF LHRs
+#============================================================#
+# name=TAG or name=TAG$code, comma separated; repeated fields/subfields are joined with '|'
+DEFAULT_COLUMNS = ("001=ctrl_nr,004=ocn,005=last_modified,852$a=institution,852$b=location,"
+                   "852$h=call_number,876$p=barcode_876,877$p=barcode_877")
+VALUE_SEPARATOR = '|'
+
+
+def parse_column_spec(spec):
+    """'852$b=location,001' -> [('location', '852', 'b'), ('001', '001', None)]."""
+    columns = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        source, _, name = item.partition('=')
+        tag, _, code = source.strip().partition('$')
+        if len(tag) != 3 or (code and len(code) != 1):
+            raise ValueError(f"Bad column '{item}': use TAG or TAG$code, optionally followed by =name")
+        columns.append((name.strip() or source.strip(), tag, code or None))
+    return columns
+
+
+def record_fields(record):
+    """(tag, data) of every field of an ISO 2709 record (bytes), field terminators removed."""
+    if len(record) < 24 or not record[12:17].isdigit():
+        return
+    base_address = int(record[12:17])
+    directory = record[24:base_address - 1]
+    for pos in range(0, len(directory) - 11, 12):
+        entry = directory[pos:pos + 12]
+        if not entry[3:12].isdigit():
+            continue
+        start = base_address + int(entry[7:12])
+        yield entry[0:3].decode('latin-1'), record[start:start + int(entry[3:7])].rstrip(FIELD_TERMINATOR)
+
+
+def extract_columns(record, columns):
+    """Values of the columns (see parse_column_spec) for one record, as a dict."""
+    if isinstance(record, str):
+        record = record.encode('utf-8')
+    wanted = set(tag for name, tag, code in columns)
+    found = collections.defaultdict(list)
+    for tag, data in record_fields(record):
+        if tag in wanted:
+            found[tag].append(data)
+
+    row = {}
+    for name, tag, code in columns:
+        values = []
+        for data in found.get(tag, ()):
+            if code is None:
+                values.append(data.decode('utf-8', 'replace').strip())
+            else:
+                for subfield in data.split(SUBFIELD_DELIMITER)[1:]:
+                    if subfield[:1].decode('latin-1') == code:
+                        values.append(subfield[1:].decode('utf-8', 'replace').strip())
+        row[name] = VALUE_SEPARATOR.join(values) if values else None
+    return row
+
+
+class ColumnarWriter:
+    """One row per LHR in {outfile}.LHRs.parquet, or {outfile}.LHRs.csv without pyarrow.
+
+    Rows are written in batches of `batch_size` (one Parquet row group each)
+    while the run goes on, so the MARC never has to be parsed again to read
+    a few fields. All columns are strings.
+    """
+
+    def __init__(self, outfile, columns, batch_size=10000, file_format=None):
+        self.columns = columns
+        self.names = [name for name, tag, code in columns]
+        self.batch_size = batch_size
+        self.format = file_format or ('parquet' if pyarrow is not None else 'csv')
+        if self.format == 'parquet' and pyarrow is None:
+            raise ImportError("Parquet output needs the pyarrow package: pip install pyarrow")
+        self.path = f"{outfile}.LHRs.{self.format}"
+        self.rows = []
+        self.count = 0
+        self.lock = threading.Lock()
+        if self.format == 'parquet':
+            self.schema = pyarrow.schema([(name, pyarrow.string()) for name in self.names])
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        else:
+            self.file = open(self.path, 'w', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=self.names)
+            self.writer.writeheader()
+
+    def write(self, record):
+        row = extract_columns(record, self.columns)
+        with self.lock:
+            self.rows.append(row)
+            self.count += 1
+            if len(self.rows) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self.rows:
+            return
+        if self.format == 'parquet':
+            self.writer.write_table(pyarrow.Table.from_pylist(self.rows, schema=self.schema))
+        else:
+            self.writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.format == 'parquet':
+                self.writer.close()
+            else:
+                self.file.close()
+
+
+#============================================================#
+#                   CANARY RUN
+#============================================================#
+# Highest share of each outcome a canary may have before the run is stopped
+DEFAULT_CANARY_MAX = "bad_request=0.02,error=0.05,failed=0.05"
+
+
+class CanaryFailed(Exception):
+    """The canary sample went above one of its thresholds; the full run is not started."""
+
+
+def parse_canary_size(value, total):
+    """'200' -> 200 records, '5%' -> 5 percent of `total` (at least 1)."""
+    value = value.strip()
+    if value.endswith('%'):
+        size = int(total * float(value[:-1]) / 100)
+    else:
+        size = int(value)
+    return max(1, min(size, total)) if total else 0
+
+
+def parse_limit(value, total):
+    """'200' -> 200, '5%' -> 5 percent of `total` (rounded down); '0' and '0%' mean 0.
+
+    Unlike parse_canary_size there is no minimum of 1: for limits such as
+    --max-delete, 0 must allow nothing.
+    """
+    value = value.strip()
+    if value.endswith('%'):
+        limit = int(total * float(value[:-1]) / 100)
+    else:
+        limit = int(value)
+    if limit < 0:
+        raise ValueError(f"Limit '{value}' is negative")
+    return min(limit, total)
+
+
+def parse_percent(value):
+    """'5%' or '5' -> 0.05: a share given in percent, between 0 and 100."""
+    value = str(value).strip()
+    share = float(value[:-1] if value.endswith('%') else value)
+    if not 0 <= share <= 100:
+        raise ValueError(f"'{value}' is not a percentage between 0 and 100")
+    return share / 100
+
+
+def parse_deadline(value, now=None):
+    """Run deadline as a time.time() value.
+
+    '+90m', '+2h', '+30s': from now; 'HH:MM': the next time the clock shows
+    it (tomorrow when already past); 'YYYY-MM-DD HH:MM' or ISO: that moment.
+    """
+    now = now or datetime.datetime.now()
+    value = value.strip()
+    match = re.fullmatch(r'\+(\d+(?:\.\d+)?)([smh]?)', value)
+    if match:
+        seconds = float(match.group(1)) * {'': 60, 's': 1, 'm': 60, 'h': 3600}[match.group(2)]
+        return (now + datetime.timedelta(seconds=seconds)).timestamp()
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', value)
+    if match:
+        deadline = now.replace(hour=int(match.group(1)), minute=int(match.group(2)), second=0, microsecond=0)
+        if deadline <= now:
+            deadline += datetime.timedelta(days=1)
+        return deadline.timestamp()
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Deadline '{value}' is not +N[smh], HH:MM or YYYY-MM-DD HH:MM") from None
+
+
+def parse_canary_max(spec):
+    """'bad_request=0.02,error=0.05' -> {'bad_request': 0.02, 'error': 0.05}."""
+    limits = {}
+    for item in spec.split(','):
+        if item.strip():
+            outcome, _, rate = item.partition('=')
+            limits[outcome.strip()] = float(rate)
+    return limits
+
+
+def canary_sample(total, size, method='stratified', seed=None):
+    """Positions (0 based) of the canary records among `total`.
+
+    stratified: the input is cut in `size` equal slices and one random record
+    is taken from every slice, so the sample covers the whole file (old and
+    new records, every export batch). random: a plain random sample.
+    """
+    rng = random.Random(seed)
+    if size >= total:
+        return set(range(total))
+    if method == 'random':
+        return set(rng.sample(range(total), size))
+    return set(rng.randrange(total * i // size, max(total * (i + 1) // size, total * i // size + 1)) for i in range(size))
+
+
+class CanaryReport:
+    """Outcomes, latency and throughput of a canary run, and what they mean for the full run."""
+
+    def __init__(self, operation, size, total, method):
+        self.operation = operation
+        self.size = size
+        self.total = total
+        self.method = method
+        self.counts = collections.Counter()
+        self.latencies = []
+        self.requests = 0
+        self.start_time = time.monotonic()
+        self.elapsed = 0
+
+    def add(self, result):
+        self.counts[result.outcome] += 1
+        self.latencies.append(result.elapsed)
+        self.requests += max(result.attempts, 1)
+
+    def close(self):
+        self.elapsed = max(time.monotonic() - self.start_time, 1e-6)
+
+    def rate(self, outcome):
+        done = sum(self.counts.values())
+        return self.counts[outcome] / done if done else 0.0
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def check(self, limits):
+        """Reasons to stop (empty when the canary is within all limits)."""
+        return [f"{outcome} {self.rate(outcome):.1%} > {limit:.1%}"
+                for outcome, limit in limits.items() if self.rate(outcome) > limit]
+
+    def print_report(self, limits, limit=None):
+        done = sum(self.counts.values())
+        throughput = done / self.elapsed if self.elapsed else 0.0
+        remaining = max(self.total - done, 0)
+        print(f"\n==== Canary: {done} of {self.total} records ({self.method}) ====")
+        for outcome in sorted(self.counts, key=lambda outcome: -self.counts[outcome]):
+            maximum = f"   (max {limits[outcome]:.1%})" if outcome in limits else ""
+            print(f"{outcome:<12} {self.counts[outcome]:>7}  {self.rate(outcome):6.1%}{maximum}")
+        print(f"Latency: p50 {self.percentile(0.5):.2f}s  p95 {self.percentile(0.95):.2f}s  max {max(self.latencies or [0]):.2f}s")
+        concurrency = f" (concurrency limit {limit})" if limit else ""
+        print(f"Throughput: {throughput:.1f} rec/s{concurrency}, {self.requests / max(done, 1):.2f} request(s) per record")
+        if throughput > 0:
+            seconds = remaining / throughput
+            finish = (datetime.datetime.now() + datetime.timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M")
+            print(f"Projected for the other {remaining} records: {format_duration(seconds)}, "
+                  f"about {int(self.requests / max(done, 1) * remaining)} requests, done around {finish}")
+
+
+#============================================================#
+#                   LEDGER OF ADDED LHRs
+#============================================================#
+LEDGER_IGNORED_TAGS = ('001', '003', '005')   # set by the API or changed by every export
+
+
+def normalized_record_hash(record):
+    """SHA-256 of an ISO 2709 record, the same for every copy of the same LHR.
+
+    Only what describes the holding counts: leader positions 05-09 and 17-19
+    and the fields in their order, without 001/003/005 and without trailing
+    spaces. Lengths, directory and base address do not count.
+    """
+    if isinstance(record, str):
+        record = record.encode('utf-8')
+    digest = hashlib.sha256(record[5:10] + record[17:20])
+    found = False
+    for tag, data in record_fields(record):
+        found = True
+        if tag not in LEDGER_IGNORED_TAGS:
+            digest.update(tag.encode('latin-1') + data.rstrip(b' ') + FIELD_TERMINATOR)
+    if not found:
+        digest.update(record.rstrip(RECORD_TERMINATOR))   # no readable directory: the raw record
+    return digest.hexdigest()
+
+
+class AddLedger:
+    """Control Numbers the API gave to the LHRs added, per institution and
+    normalized record hash, in a SQLite file.
+
+    An add first claims the hash of its record (claim): the claim is a
+    'pending' row, taken in one transaction, so two requests (threads,
+    processes, nodes) never send the same record at once. store() confirms
+    it with the Control Number of the response, release() drops it when
+    the API rejected the add. When the add got no clear answer (timeout,
+    5xx) the record may have been added all the same: mark_unknown() keeps
+    the claim as 'unknown', and the record is not sent again until the
+    LHRs of the institution are checked (`retry_unknown`). The same holds
+    for a claim older than `claim_timeout` seconds (process killed during
+    the add). A record found in the ledger is not sent again (see
+    LhrClient.call); a successful delete removes its Control Number, so the
+    record can be added again. Usable from threads and forked processes:
+    every process opens its own connection.
+    """
+
+    PENDING = 'pending'   # claim() result: the record is being added by another request
+    UNKNOWN = 'unknown'   # claim() result: an earlier add of the record got no clear answer
+
+    def __init__(self, path, claim_timeout=900, retry_unknown=False):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.retry_unknown = retry_unknown
+        self.lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    def db(self):
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS added (institution TEXT NOT NULL, record_hash TEXT NOT NULL, "
+                             "ctrl_nr TEXT NOT NULL, added TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'added', "
+                             "PRIMARY KEY (institution, record_hash))")
+            # Ledgers written before the claims: every row is an add confirmed
+            if 'status' not in [row[1] for row in self._db.execute("PRAGMA table_info(added)")]:
+                self._db.execute("ALTER TABLE added ADD COLUMN status TEXT NOT NULL DEFAULT 'added'")
+            self._db.execute("CREATE INDEX IF NOT EXISTS added_ctrl_nr ON added (institution, ctrl_nr)")
+            self._pid = os.getpid()
+        return self._db
+
+    def lookup(self, institution, record_hash):
+        """Control Number of an LHR added earlier, or None."""
+        with self.lock:
+            row = self.db().execute("SELECT ctrl_nr FROM added WHERE institution = ? AND record_hash = ? AND status = 'added'",
+                                    (institution, record_hash)).fetchone()
+        return row[0] if row else None
+
+    def claim(self, institution, record_hash):
+        """Control Number of an LHR added earlier, PENDING while another request
+        adds the same record, UNKNOWN when an earlier add may or may not have
+        added it, or None: the claim is taken, send the add."""
+        now = datetime.datetime.now()
+        with self.lock:
+            db = self.db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT ctrl_nr, status, added FROM added WHERE institution = ? AND record_hash = ?",
+                                 (institution, record_hash)).fetchone()
+                if row is not None and row[1] == 'added':
+                    db.execute("COMMIT")
+                    return row[0]
+                if row is not None and row[1] == 'pending' and \
+                        (now - datetime.datetime.fromisoformat(row[2])).total_seconds() < self.claim_timeout:
+                    db.execute("COMMIT")
+                    return self.PENDING
+                # Unknown outcome, or a claim left by a process killed during its add
+                if row is not None and not self.retry_unknown:
+                    db.execute("UPDATE added SET status = 'unknown' WHERE institution = ? AND record_hash = ?",
+                               (institution, record_hash))
+                    db.execute("COMMIT")
+                    return self.UNKNOWN
+                db.execute("INSERT OR REPLACE INTO added (institution, record_hash, ctrl_nr, added, status) VALUES (?, ?, '', ?, 'pending')",
+                           (institution, record_hash, now.isoformat(timespec='seconds')))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return None
+
+    def store(self, institution, record_hash, ctrl_nr):
+        """Confirm the claim of a record with the Control Number the API gave it."""
+        with self.lock:
+            self.db().execute("INSERT OR REPLACE INTO added (institution, record_hash, ctrl_nr, added, status) VALUES (?, ?, ?, ?, 'added')",
+                              (institution, record_hash, ctrl_nr, datetime.datetime.now().isoformat(timespec='seconds')))
+
+    def release(self, institution, record_hash):
+        """Drop the claim of a record the API did not add (rejected, or never sent)."""
+        with self.lock:
+            self.db().execute("DELETE FROM added WHERE institution = ? AND record_hash = ? AND status = 'pending'",
+                              (institution, record_hash))
+
+    def mark_unknown(self, institution, record_hash):
+        """Keep the claim of a record whose add got no clear answer: it may have been added."""
+        with self.lock:
+            self.db().execute("UPDATE added SET status = 'unknown' WHERE institution = ? AND record_hash = ? AND status = 'pending'",
+                              (institution, record_hash))
+
+    def forget(self, institution, ctrl_nr):
+        with self.lock:
+            self.db().execute("DELETE FROM added WHERE institution = ? AND ctrl_nr = ?", (institution, ctrl_nr))
+
+
+#============================================================#
+#                   LOCAL INDEX OF THE HOLDINGS
+#============================================================#
+INDEX_COLUMNS = parse_column_spec("001=ctrl_nr,004=ocn,005=last_modified,852$b=location,852$c=sublocation,"
+                                  "852$h=call_number,852$i=call_number_item,876$p=barcode_876,877$p=barcode_877,"
+                                  "878$p=barcode_878")
+
+
+class HoldingsIndex:
+    """The LHRs of the institutions as last downloaded, in a SQLite file.
+
+    One row per LHR with its Control Number, 004 (OCLC number), 005, 852
+    location, sublocation and call number and the record itself; barcodes
+    (876-878 $p) in a table of their own. get keeps it up to date (upsert
+    on success, removal on not found), delete removes what it deleted;
+    mdt_misc_lhrindex.py queries it. Writes are committed in batches of
+    `batch_size`, and by commit(). Every process opens its own connection.
+    """
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        self._db = None
+        self._pid = None
+
+    def db(self):
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS holdings (
+                    institution TEXT NOT NULL, ctrl_nr TEXT NOT NULL, ocn TEXT, last_modified TEXT,
+                    location TEXT, sublocation TEXT, call_number TEXT, record BLOB NOT NULL, indexed TEXT NOT NULL,
+                    PRIMARY KEY (institution, ctrl_nr));
+                CREATE INDEX IF NOT EXISTS holdings_ocn ON holdings (institution, ocn);
+                CREATE INDEX IF NOT EXISTS holdings_location ON holdings (institution, location, sublocation);
+                CREATE INDEX IF NOT EXISTS holdings_last_modified ON holdings (institution, last_modified);
+                CREATE TABLE IF NOT EXISTS barcodes (
+                    institution TEXT NOT NULL, ctrl_nr TEXT NOT NULL, barcode TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS barcodes_barcode ON barcodes (institution, barcode);
+                CREATE INDEX IF NOT EXISTS barcodes_ctrl_nr ON barcodes (institution, ctrl_nr);
+            """)
+            self._pid = os.getpid()
+            self.uncommitted = 0
+        return self._db
+
+    def _write(self, statements):
+        with self.lock:
+            db = self.db()
+            if not self.uncommitted:
+                db.execute("BEGIN")
+            for sql, params in statements:
+                db.execute(sql, params)
+            self.uncommitted += 1
+            if self.uncommitted >= self.batch_size:
+                db.execute("COMMIT")
+                self.uncommitted = 0
+
+    def upsert(self, institution, record):
+        """Store one downloaded LHR (ISO 2709, str or bytes); returns its Control Number."""
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        row = extract_columns(record, INDEX_COLUMNS)
+        ctrl_nr = row['ctrl_nr']
+        if not ctrl_nr:
+            return None
+        call_number = " ".join(part for part in (row['call_number'], row['call_number_item']) if part) or None
+        barcodes = [barcode for name in ('barcode_876', 'barcode_877', 'barcode_878') if row[name]
+                    for barcode in row[name].split(VALUE_SEPARATOR)]
+        statements = [
+            ("INSERT OR REPLACE INTO holdings (institution, ctrl_nr, ocn, last_modified, location, sublocation, "
+             "call_number, record, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+             (institution, ctrl_nr, row['ocn'], row['last_modified'], row['location'], row['sublocation'],
+              call_number, record, datetime.datetime.now().isoformat(timespec='seconds'))),
+            ("DELETE FROM barcodes WHERE institution = ? AND ctrl_nr = ?", (institution, ctrl_nr)),
+        ]
+        statements += [("INSERT INTO barcodes (institution, ctrl_nr, barcode) VALUES (?, ?, ?)",
+                        (institution, ctrl_nr, barcode)) for barcode in barcodes]
+        self._write(statements)
+        return ctrl_nr
+
+    def remove(self, institution, ctrl_nr):
+        """Forget an LHR that was deleted or is not found any more."""
+        self._write([("DELETE FROM holdings WHERE institution = ? AND ctrl_nr = ?", (institution, ctrl_nr)),
+                     ("DELETE FROM barcodes WHERE institution = ? AND ctrl_nr = ?", (institution, ctrl_nr))])
+
+    def commit(self):
+        with self.lock:
+            if self._db is not None and self._pid == os.getpid() and self.uncommitted:
+                self._db.execute("COMMIT")
+                self.uncommitted = 0
+
+    def query(self, institution, location=None, sublocation=None, ocns=None, older_than=None, newer_than=None,
+              call_number=None, barcodes=None):
+        """(ctrl_nr, record) of the LHRs matching all given criteria, by Control Number.
+
+        location, sublocation and call_number accept * wildcards; older_than and
+        newer_than compare with 005 (YYYYMMDD, or any leading part of it).
+        """
+        where = ["h.institution = ?"]
+        params = [institution]
+        for column, value in (('location', location), ('sublocation', sublocation), ('call_number', call_number)):
+            if value is not None:
+                where.append(f"h.{column} LIKE ? ESCAPE '\\'")
+                params.append(value.replace('%', r'\%').replace('_', r'\_').replace('*', '%'))
+        if ocns:
+            where.append(f"h.ocn IN ({', '.join('?' * len(ocns))})")
+            params += list(ocns)
+        if older_than:
+            where.append("h.last_modified < ?")
+            params.append(older_than)
+        if newer_than:
+            where.append("h.last_modified >= ?")
+            params.append(newer_than)
+        if barcodes:
+            where.append(f"h.ctrl_nr IN (SELECT ctrl_nr FROM barcodes WHERE institution = ? "
+                         f"AND barcode IN ({', '.join('?' * len(barcodes))}))")
+            params += [institution] + list(barcodes)
+
+        sql = (f"SELECT h.ctrl_nr, h.record FROM holdings h WHERE {' AND '.join(where)} "
+               f"ORDER BY h.ctrl_nr")
+        with self.lock:
+            rows = self.db().execute(sql, params).fetchall()
+        return rows
+
+    def counts(self):
+        """(institution, number of LHRs, last indexed) per institution."""
+        with self.lock:
+            return self.db().execute("SELECT institution, COUNT(*), MAX(indexed) FROM holdings "
+                                     "GROUP BY institution ORDER BY institution").fetchall()
+
+    def close(self):
+        self.commit()
+        with self.lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+
+#============================================================#
+#                   OUTPUT FILES OF THE SCRIPTS
+#============================================================#
+# Output files per operation: key -> suffix of {outfile}.<suffix>
+OUTPUT_FILES = {
+    'get':     {'success': 'SuccessCtrlNrs.txt', 'records': 'DownloadedLHRs.mrc', 'not_found': 'NotFoundLHRs.json',
+                'bad_request': 'BadRequest.xml', 'log': 'LOG.jsonl', 'retry': 'Retry.txt', 'resume': 'Resume.txt'},
+    'delete':  {'success': 'SuccessCtrlNrs.txt', 'records': 'DeletedLHRs.mrc', 'not_found': 'NotFoundLHRs.json',
+                'bad_request': 'BadRequest.xml', 'log': 'LOG.jsonl', 'retry': 'Retry.txt', 'resume': 'Resume.txt'},
+    'add':     {'records': 'AddedLHRs.mrc', 'bad_request': 'BadRequest.xml', 'log': 'LOG.jsonl', 'retry': 'Retry.mrc',
+                'already_added': 'AlreadyAdded.txt', 'resume': 'Resume.mrc'},
+    'replace': {'records': 'ReplacedLHRs.mrc', 'bad_request': 'BadRequest.xml', 'log': 'LOG.jsonl', 'retry': 'Retry.mrc',
+                'resume': 'Resume.mrc'},
+}
+# Outputs holding the input records as they were read (bytes)
+BINARY_OUTPUTS = {('add', 'retry'), ('replace', 'retry'), ('add', 'resume'), ('replace', 'resume')}
+
+
+def output_paths(operation, outfile, compress=None):
+    """Names of the output files of an operation, per key of OUTPUT_FILES."""
+    paths = {}
+    for key, suffix in OUTPUT_FILES[operation].items():
+        path = f"{outfile}.{suffix}"
+        paths[key] = output_name(path, compress) if key == 'records' else path
+    return paths
+
+
+class ResultWriter:
+    """Writes LhrResult objects to the usual {outfile}.* files of an operation.
+
+    Each file is opened on its first write and stays open for the whole
+    input file, so an outcome that never happened leaves no empty file; the
+    'records' output (the LHRs in MARC) is compressed when `compress` is
+    'gz' or 'zst'. With `part` set every name gets the .partNNN suffix of a
+    worker process.
+
+    Errors go to LOG.jsonl, one JSON object per line (see log_error). The
+    answer of the API is stored once per distinct text, as a
+    {"body_hash", "body"} line ahead of the first entry that refers to it.
+    Records that failed for good also go to Retry.txt / Retry.mrc, a
+    ready-to-run input for the same script. Adds skipped because of the
+    ledger are listed in AlreadyAdded.txt with their Control Number.
+    Records not sent before the run deadline go to Resume.txt / Resume.mrc,
+    the input of the next run.
+    """
+
+    def __init__(self, operation, outfile, compress=None, part=None):
+        self.operation = operation
+        self.paths = output_paths(operation, outfile, compress)
+        if part is not None:
+            self.paths = {key: part_path(path, part) for key, path in self.paths.items()}
+        self.files = {}       # outputs written to so far
+        self.lock = threading.Lock()
+        self.bodies = set()   # hashes of the bodies already in LOG.jsonl
+
+    def out(self, key):
+        if key not in self.files:
+            self.files[key] = open_output(self.paths[key], 'ab' if (self.operation, key) in BINARY_OUTPUTS else 'a')
+        return self.files[key]
+
+    def write(self, result):
+        """Write one result; returns its outcome."""
+        with self.lock:
+            if self.operation in ('get', 'delete'):
+                self._write_ctrl_nr_result(result)
+            else:
+                self._write_record_result(result)
+        return result.outcome
+
+    def log_error(self, result, status, attempt=None, body=None, error=None, message=None):
+        """One LOG.jsonl entry: who (ctrl_nr / nr), attempt, status, error type, body hash."""
+        entry = {'operation': self.operation}
+        if result.ctrl_nr is not None:
+            entry['ctrl_nr'] = result.ctrl_nr
+        if result.nr is not None:
+            entry['nr'] = result.nr
+        entry['attempt'] = attempt if attempt is not None else result.attempts
+        entry['status'] = status
+        if body:
+            entry['error'] = error or error_type(body)
+            entry['body'] = self._body_hash(body)
+        else:
+            entry['error'] = error
+        if message:
+            entry['message'] = message
+        if status != 'retry' and result.http_status is not None:
+            entry['http_status'] = result.http_status
+        self.out('log').write(json.dumps(entry) + "\n")
+
+    def _body_hash(self, body):
+        body_hash = hashlib.sha1(body.encode('utf-8', 'replace')).hexdigest()[:16]
+        if body_hash not in self.bodies:
+            self.bodies.add(body_hash)
+            self.out('log').write(json.dumps({'body_hash': body_hash, 'body': body}) + "\n")
+        return body_hash
+
+    def _write_ctrl_nr_result(self, result):
+        ctrl_nr = result.ctrl_nr
+        sep = "\n" if self.operation == 'get' else "|"
+        end = "" if self.operation == 'get' else "\n"
+
+        for attempt, body in result.errors:
+            self.log_error(result, 'retry', attempt, body)
+
+        if result.outcome == 'success':
+            self.out('success').write(f"Success for Control Number: {ctrl_nr}\n")
+            self.out('records').write(f"{result.body}")
+        elif result.outcome == 'bad_request':
+            self.out('bad_request').write(f"Control Number: {ctrl_nr}\n{result.body}{end}")   # Bad request xml response
+        elif result.outcome == 'not_found':
+            self.out('not_found').write(f"Control Number: {ctrl_nr}{sep}{result.body}{end}")  # Not found json response
+        elif result.outcome == 'failed':
+            self.log_error(result, 'failed', error='gave_up', message=result.body or f"--> Giving up after {result.attempts} attempts")
+            self.out('retry').write(f"{ctrl_nr}\n")
+        elif result.outcome == 'unsent':
+            self.out('resume').write(f"{ctrl_nr}\n")
+        else:
+            self.log_error(result, 'error', body=result.body)
+
+    def _write_record_result(self, result):
+        for attempt, body in result.errors:
+            self.log_error(result, 'retry', attempt, body)
+
+        if result.outcome == 'success':
+            self.out('records').write(f"{result.body}")
+        elif result.outcome == 'bad_request':
+            self.out('bad_request').write(f"{result.body}")   # Bad request xml response
+        elif result.outcome == 'already_added':
+            self.out('already_added').write(f"Record nr {result.nr}: already added as Control Number {result.ctrl_nr}\n")
+        elif result.outcome == 'failed':
+            self.log_error(result, 'failed', error='gave_up', message=result.body or f"--> Giving up after {result.attempts} attempts")
+            if result.record is not None:
+                self.out('retry').write(result.record + RECORD_TERMINATOR)
+        elif result.outcome == 'unsent':
+            self.out('resume').write(result.record + RECORD_TERMINATOR)
+        else:
+            self.log_error(result, 'error', body=result.body)
+
+    def close(self):
+        with self.lock:
+            for out in self.files.values():
+                out.close()
+            self.files = {}
+
+
+def read_error_log(file_name, statuses=('error', 'failed')):
+    """Entries of a LOG.jsonl file with the given statuses, body hashes resolved.
+
+    With statuses=None every entry is returned (retries included). The file
+    may be compressed. Yields dicts with the 'body' text in place of its hash.
+    """
+    bodies = {}
+    with open_input(file_name, 'rt') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'body_hash' in entry:
+                bodies[entry['body_hash']] = entry['body']
+                continue
+            if statuses is not None and entry.get('status') not in statuses:
+                continue
+            if 'body' in entry:
+                entry['body'] = bodies.get(entry['body'], entry['body'])
+            yield entry
+
+
+def error_log_keys(file_name, key='ctrl_nr', statuses=('error', 'failed')):
+    """Control Numbers (key='ctrl_nr') or record nrs (key='nr') of the records
+    that did not make it in a LOG.jsonl, in order and without duplicates."""
+    return list(dict.fromkeys(entry[key] for entry in read_error_log(file_name, statuses) if key in entry))
@@ -0,0 +1,300 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright (c) 2025 by OCLC
+#
+#  File		    : mdt_misc_lhrdaemon.py
+#  Description	: Long-running service processing LHR job files dropped in a spool directory
+#  Author(s)	: Elena-Iulia Popa
+#  Creation	    : 19-10-2026
+#
+#  History:
+#  19-10-2026	: popae    : creation
+#           	: One warm LhrClient (session + token) per institution for all jobs
+#           	: --max-concurrency: requests in flight adapted by AIMD
+#           	: Outputs in the order of the job file
+#           	: add/replace also take MARCXML (.xml) job files
+#           	: Concurrency, rate limit, timeouts and retries from the institution profile (API_PROFILES.env)
+#           	: Ledger of added LHRs, as in mdt_misc_lhradd.py
+#           	: Jobs still queued at shutdown go back to the spool directory; --settle 0 by default
+#           	: --once processes all the jobs found, also those queued behind another job of the institution
+#
+#  Notes	:
+#           	: Layout of the spool directory:
+#           	:   <spool>/<SYMBOL>/get/       .txt  Control Numbers to download
+#           	:   <spool>/<SYMBOL>/delete/    .txt  Control Numbers to delete
+#           	:   <spool>/<SYMBOL>/add/       .mrc/.xml  LHRs to add
+#           	:   <spool>/<SYMBOL>/replace/   .mrc/.xml  LHRs to replace
+#           	: Every operation directory gets (when needed):
+#           	:   work/    job being processed
+#           	:   out/     the usual {outfile}.* output files
+#           	:   done/    processed jobs
+#           	:   failed/  jobs that could not be processed (see the output of the daemon)
+#           	: Write job files under a name starting with '.' or ending with '.tmp'
+#           	: and rename them when complete; those names are never picked up.
+#
+#  SVN ident	: $Id$
+
+# Built-in/Generic Imports
+import os
+import sys
+import argparse
+import datetime
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mdt_misc_lhrclient import LhrClient, RateLimitExceeded, LEDGER_FILE
+from mdt_misc_lhrcommon import ResultWriter, AddLedger, open_input, read_input_records, input_extension, input_base_name
+
+#============================================================#
+#                   START OF HELP PARSER
+#============================================================#
+parser = argparse.ArgumentParser(
+    description='Service processing LHR get/delete/add/replace job files dropped in a spool directory' ,
+    formatter_class=argparse.RawTextHelpFormatter  # # This prevents argparse from reformatting help text
+)
+
+parser._optionals.title = 'Options' #Customize options title if desired
+parser._positionals.title = 'Mandatory arguments' #Customize positionals title if desired
+
+# Positional (mandatory) argument:
+parser.add_argument("-s", "--spool", required=True, help=(
+                                                "Spool directory to watch.\n"
+                                                "- Job files go in <spool>/<SYMBOL>/<get|delete|add|replace>/\n"
+                                                "- get and delete take .txt files, add and replace .mrc or MARCXML .xml files\n"
+                                                "  (also gzip/zstd compressed).\n"
+ )
+)
+
+# Optional arguments
+parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity.')
+
+parser.add_argument("--interval", type=float, default=0.1, help=(
+                                                "Seconds between two scans of the spool directory (default 0.1).\n"
+ )
+)
+
+parser.add_argument("--settle", type=float, default=0, help=(
+                                                "Seconds a job file must be left unchanged before it is picked up (default 0).\n"
+                                                "- Job files written as .tmp (or .name) and renamed when complete are picked up\n"
+                                                "  at once; set this only for producers that copy straight to the final name.\n"
+ )
+)
+
+parser.add_argument("-c", "--compress", choices=['gz', 'zst'], help=(
+                                                "Write the .mrc outputs compressed (gzip or zstd).\n"
+ )
+)
+
+parser.add_argument("--max-concurrency", dest="max_concurrency", type=int, help=(
+                                                "Maximum number of requests in flight per institution (default 8),\n"
+                                                "adapted by AIMD as in the mdt_misc_lhr* scripts.\n"
+                                                "- Without this option every institution uses its profile (API_PROFILES.env).\n"
+ )
+)
+
+parser.add_argument("--once", action='store_true', help=(
+                                                "Process the jobs present now and exit, instead of watching the spool directory.\n"
+ )
+)
+
+#============================================================#
+#                   END OF HELP PARSER
+#============================================================#
+
+# Operation -> extensions of its job files and name of the script whose outputs are mimicked
+OPERATIONS = {
+    'get':     (('.txt',), 'mdt_misc_lhrget'),
+    'delete':  (('.txt',), 'mdt_misc_lhrdelete'),
+    'add':     (('.mrc', '.xml'), 'mdt_misc_lhradd'),
+    'replace': (('.mrc', '.xml'), 'mdt_misc_lhrreplace'),
+}
+JOB_DIRS = ('work', 'out', 'done', 'failed')
+
+
+class LhrDaemon:
+    """Watches the spool directory and runs the jobs, one thread per institution.
+
+    Jobs of one institution run one after the other on the same LhrClient, so
+    the session, its connection pool and the token stay warm between jobs;
+    jobs of different institutions run side by side.
+    """
+
+    def __init__(self, spool, interval=0.1, settle=0, compress=None, verbose=False, max_concurrency=None):
+        self.spool = spool
+        self.interval = interval
+        self.settle = settle
+        self.compress = compress
+        self.verbose = verbose
+        self.max_concurrency = max_concurrency
+        self.clients = {}
+        self.ledger = AddLedger(LEDGER_FILE)   # a job processed again (recover) does not add its LHRs twice
+        self.executors = {}
+        self.queued = {}       # future of a job -> (operation directory, path in work/)
+        self.stopping = threading.Event()
+
+    #================ SPOOL DIRECTORY ===============================>
+    def scan(self):
+        """Yield (institution, operation, path) of the job files ready to be processed."""
+        now = time.time()
+        for symbol in sorted(os.listdir(self.spool)):
+            inst_dir = os.path.join(self.spool, symbol)
+            if symbol.startswith('.') or not os.path.isdir(inst_dir):
+                continue
+            for operation in OPERATIONS:
+                op_dir = os.path.join(inst_dir, operation)
+                if not os.path.isdir(op_dir):
+                    continue
+                with os.scandir(op_dir) as entries:
+                    jobs = sorted((entry.stat().st_mtime, entry.path) for entry in entries
+                                  if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith('.tmp'))
+                for mtime, path in jobs:
+                    if now - mtime >= self.settle:
+                        yield symbol.upper(), operation, path
+
+    def move(self, path, operation_dir, target):
+        """Move a job file to one of the JOB_DIRS of its operation directory."""
+        target_dir = os.path.join(operation_dir, target)
+        os.makedirs(target_dir, exist_ok=True)
+        new_path = os.path.join(target_dir, os.path.basename(path))
+        os.replace(path, new_path)
+        return new_path
+
+    def recover(self):
+        """Put back the jobs left in work/ by a daemon that was killed."""
+        for symbol in os.listdir(self.spool):
+            for operation in OPERATIONS:
+                work_dir = os.path.join(self.spool, symbol, operation, 'work')
+                if os.path.isdir(work_dir):
+                    for name in os.listdir(work_dir):
+                        print(f"Job {symbol}/{operation}/{name} was interrupted, processing it again.")
+                        os.replace(os.path.join(work_dir, name), os.path.join(self.spool, symbol, operation, name))
+
+    #================ JOBS ===============================>
+    def client(self, institution):
+        if institution not in self.clients:
+            self.clients[institution] = LhrClient(institution, verbose=self.verbose, max_concurrency=self.max_concurrency,
+                                                  ledger=self.ledger)
+        return self.clients[institution]
+
+    def submit(self, institution, operation, path):
+        op_dir = os.path.dirname(path)
+
+        # Claim the job first, so the next scan does not see it again
+        work_path = self.move(path, op_dir, 'work')
+
+        if institution not in self.executors:
+            self.executors[institution] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"lhr-{institution}")
+        future = self.executors[institution].submit(self.run_job, institution, operation, op_dir, work_path)
+        self.queued[future] = (op_dir, work_path)
+        future.add_done_callback(self.forget)
+
+    def forget(self, future):
+        if not future.cancelled():
+            self.queued.pop(future, None)
+
+    def run_job(self, institution, operation, op_dir, work_path):
+        extensions, script_name = OPERATIONS[operation]
+        job_name = os.path.basename(work_path)
+        start = time.monotonic()
+
+        try:
+            if input_extension(work_path) not in extensions:
+                raise ValueError(f"{operation} job files must be {' or '.join(extensions)}")
+
+            client = self.client(institution)
+
+            formatted_datetime = datetime.datetime.now().strftime("%y%m%d.%H%M%S")
+            out_dir = os.path.join(op_dir, 'out')
+            os.makedirs(out_dir, exist_ok=True)
+            outfile = os.path.join(out_dir, f"{input_base_name(work_path)}.{script_name}.{institution}.{formatted_datetime}")
+
+            counts = self.process(client, operation, work_path, outfile)
+
+        except RateLimitExceeded as err:
+            print(f"[{institution}/{operation}] {job_name}: {err} Job moved to failed/.")
+            self.move(work_path, op_dir, 'failed')
+            return
+        except Exception as err:
+            print(f"[{institution}/{operation}] {job_name}: {type(err).__name__}: {err}. Job moved to failed/.")
+            self.move(work_path, op_dir, 'failed')
+            return
+
+        self.move(work_path, op_dir, 'done')
+        per_outcome = "  ".join(f"{outcome} {count}" for outcome, count in counts.items())
+        print(f"[{institution}/{operation}] {job_name}: {sum(counts.values())} record(s) in {time.monotonic() - start:.2f}s | "
+              f"limit {self.clients[institution].limiter.limit} | {per_outcome}")
+
+    def process(self, client, operation, file_name, outfile):
+        """Same requests and output files as the mdt_misc_lhr<operation> script."""
+        if operation in ('get', 'delete'):
+            with open_input(file_name, 'rt') as file:
+                ctrl_nrs = dict.fromkeys(line.strip() for line in file)
+            ctrl_nrs.pop('', None)
+            results = client.get_many(ctrl_nrs) if operation == 'get' else client.delete_many(ctrl_nrs)
+        else:
+            records = read_input_records(file_name)
+            results = client.add_many(records) if operation == 'add' else client.replace_many(records)
+
+        counts = {}
+        writer = ResultWriter(operation, outfile, self.compress)
+        try:
+            for result in results:
+                outcome = writer.write(result)
+                counts[outcome] = counts.get(outcome, 0) + 1
+        finally:
+            writer.close()
+        return counts
+
+    #================ MAIN LOOP ===============================>
+    def run(self, once=False):
+        self.recover()
+        print(f"Watching {self.spool} for job files (every {self.interval}s)...\n")
+        try:
+            while not self.stopping.is_set():
+                for institution, operation, path in self.scan():
+                    try:
+                        self.submit(institution, operation, path)
+                    except OSError as err:
+                        print(f"Cannot claim job {path}: {err}")
+                if once:
+                    break
+                self.stopping.wait(self.interval)
+        finally:
+            # Let the running jobs finish; when stopped, the queued ones go back to the spool directory
+            # (--once: every job found is processed)
+            for executor in self.executors.values():
+                executor.shutdown(wait=True, cancel_futures=self.stopping.is_set())
+            for future, (op_dir, work_path) in list(self.queued.items()):
+                if future.cancelled():
+                    os.replace(work_path, os.path.join(op_dir, os.path.basename(work_path)))
+                    print(f"Job {os.path.basename(work_path)} not started, left in {op_dir}")
+
+    def stop(self, *args):
+        self.stopping.set()
+
+
+if __name__ == '__main__':
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.verbose:
+        print("Verbose mode is ON.\n")
+
+    if not os.path.isdir(args.spool):
+        print(f"\n!ERROR: Spool directory '{args.spool}' does not exist\n\nExiting program without execution...\n")
+        sys.exit(1)
+
+    daemon = LhrDaemon(args.spool, interval=args.interval, settle=args.settle, compress=args.compress, verbose=args.verbose,
+                       max_concurrency=args.max_concurrency)
+
+    # Stop watching on SIGTERM/Ctrl-C, after the jobs in progress
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+
+    daemon.run(once=args.once)
+
+    print(f"***End of script***")
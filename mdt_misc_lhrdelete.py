@@ -10,6 +10,22 @@
 #
 #  History:
 #  24-11-2025	: popae    : creation
+#  19-10-2026	: popae    : requests through mdt_misc_lhrclient.LhrClient,
+#           	: no argparse/credentials/session work at import time
+#           	: --max-concurrency: requests in flight adapted by AIMD, limit in the summary
+#           	: Outputs in input order also with concurrent requests (default 8 in flight)
+#           	: LOG.jsonl error log, also accepted as input to process the errors again
+#           	: Transient failures retried later from a deferred queue, Retry.txt for the rest
+#           	: --canary N|P%: sample first, report and projection, stop or continue
+#           	: Concurrency, rate limit, timeouts and retries from the institution profile (API_PROFILES.env)
+#           	: Deleted Control Numbers removed from the ledger of mdt_misc_lhradd.py
+#           	: and from the local index of the holdings
+#           	: Control Numbers in several input files requested once per run, result written for each file
+#           	: --deadline / --record-deadline: run and per record deadlines, Resume file with what was not sent
+#           	: --snapshot: every LHR downloaded and synced to Snapshot.mrc before its DELETE, GETs ahead of the deletes
+#           	: --snapshot: GETs and DELETEs handed on as they are answered, results back in input order
+#           	: --snapshot: GETs and DELETEs share the concurrency and rate limit of the institution
+#           	: Options, canary and validation shared with mdt_misc_lhrget.py (mdt_misc_lhrscript.CtrlNrScript)
 #
 #  Notes	:
 #
@@ -18,32 +34,24 @@
 # Built-in/Generic Imports
 import os
 import sys
-
-
-
-import os
-import sys
+import collections
+import queue
+import threading
 import argparse
 import fnmatch
-import threading  # to refresh the token
 import glob
-from requests.exceptions import RetryError  # Import the correct exception
-
-#import yaml
-from dotenv import load_dotenv
-load_dotenv("/home/popae/Scripts/API_KEYS.env")
-
-from oauthlib.oauth2 import BackendApplicationClient
-from requests.auth import HTTPBasicAuth
-from requests_oauthlib import OAuth2Session
-import requests
 import datetime
-import sys
 import json
 import re
 import time
 import xml.etree.ElementTree as ET
 
+from mdt_misc_lhrclient import LhrClient, LhrResult, RateLimitExceeded, LEDGER_FILE, INDEX_FILE
+from mdt_misc_lhrcommon import CanaryFailed, parse_deadline, RunRegistry, ReorderBuffer
+from mdt_misc_lhrcommon import input_extension, input_base_name, spool_stdin, AddLedger, HoldingsIndex
+from mdt_misc_lhrscript import CtrlNrScript, add_compress_argument, add_canary_arguments, add_concurrency_argument
+from mdt_misc_lhrscript import add_deadline_arguments, add_dry_run_argument
+
 #============================================================#
 #                   START OF HELP PARSER
 #============================================================#
@@ -59,6 +67,9 @@ parser._positionals.title = 'Mandatory arguments' #Customize positionals title i
 parser.add_argument("-i", "--in", dest="input_file", required=True, help=(
                                                 'Input file to be processed or "file_pattern".\n'
                                                 '- "file_pattern" requires double quotes.\n'
+                                                '- gzip/zstd compressed files (.txt.gz, .txt.zst) are read directly.\n'
+                                                '- "-" reads the input from stdin.\n'
+                                                '- A *.LOG.jsonl of an earlier run processes again the Control Numbers that failed there.\n'
                                                 "- Input file is a txt file with Control Numbers of the LHRs to be deleted.\n"
  )
 )
@@ -76,291 +87,272 @@ parser.add_argument("-r", "--run", nargs="?", required=True, choices=['d'], help
 # Optional arguments
 parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity; use as argumnet AFTER the input file.')
 
-# Parse the arguments
-args = parser.parse_args()
-
-#============================================================#
-#                   END OF HELP PARSER
-#============================================================#
+add_compress_argument(parser, "DeletedLHRs.mrc")
 
+parser.add_argument("--validate", action='store_true', help=(
+                                                "Check the input locally before any API call (in parallel over all cores).\n"
+                                                "- Lines that are not a numeric Control Number are written to {outfile}.Rejected.txt\n"
+                                                "  and are not sent to the API.\n"
+ )
+)
 
-if args.verbose:
-    print("Verbose mode is ON.\n")
-
-# Ensure input_file is provided if -morehelp is not used
-if args.input_file is None:
-    parser.error("The following arguments are required: input_file. Type -h or --help or -morehelp for more information")
-
-input_arg = args.input_file
-
-
-# serviceURL = config.get('metadata_service_url')
-serviceURL = 'https://metadata.api.oclc.org/worldcat'
-
-# Scope
-#scope = ['WorldCatMetadataAPI:manage_bibs', 'WorldCatMetadataAPI:view_brief_bib']
-scope = ['WorldCatMetadataAPI:manage_institution_lhrs']
-
-def load_oauth_credentials(inst_symbol: str):
-    prefix = inst_symbol.upper()
-
-    client_id = os.getenv(f"{prefix}_CLIENT_ID")
-    #print(f"Client ID: {client_id}\n")
-
-    client_secret = os.getenv(f"{prefix}_CLIENT_SECRET")
-    #print(f"Client Secret: {client_secret}\n")
-
+add_canary_arguments(parser)
 
-    if not all([client_id, client_secret]):
-        raise ValueError(f"Missing credentials for user '{inst_symbol}'")
+add_concurrency_argument(parser)
 
-    return {
-        "client_id": client_id,
-        "client_secret": client_secret,
-    }
+add_deadline_arguments(parser, "Resume.txt")
 
-inst_symbol = args.key
-institution = inst_symbol.upper()
-print(f"Running script for Institution: {institution}\n")
+parser.add_argument("--snapshot", action='store_true', help=(
+                                                "Download every LHR right before it is deleted and keep it in {outfile}.Snapshot.mrc.\n"
+                                                "- A DELETE is only sent once its LHR is on disk (fsync), so the backup is never\n"
+                                                "  older than the delete and no separate mdt_misc_lhrget.py run is needed.\n"
+                                                "- The GETs of the next Control Numbers run while the deletes are in flight;\n"
+                                                "  GETs and DELETEs each use half of the concurrency and rate limit of the institution.\n"
+                                                "- Control Numbers whose GET did not succeed are not deleted (NotFound / Retry / LOG).\n"
+ )
+)
 
-creds = load_oauth_credentials(inst_symbol)
+add_dry_run_argument(parser)
 
-auth = HTTPBasicAuth(creds["client_id"], creds["client_secret"])
-client = BackendApplicationClient(client_id=creds["client_id"], scope=scope)
+#============================================================#
+#                   END OF HELP PARSER
+#============================================================#
 
+SNAPSHOT_SYNC_RECORDS = 100   # LHRs written to the snapshot between two fsyncs at most
+SNAPSHOT_SYNC_SECONDS = 1.0   # or this long after the first LHR written since the last fsync
+
+
+class Snapshot:
+    """--snapshot: GET, write to {outfile}.Snapshot.mrc, fsync, then DELETE.
+
+    delete_many has the same contract as LhrClient.delete_many (one result
+    per Control Number, in order) so it also fits the run registry. The
+    GETs go through their own client (GETs and deletes each half of the
+    concurrency and rate limit, one circuit breaker), run by a thread of
+    their own that puts every answer on a queue as it comes. A slow or
+    deferred GET holds back no other delete: the LHRs answered are written
+    in batches, each batch queued for its deletes once fsync returned, at
+    the latest SNAPSHOT_SYNC_SECONDS after its first LHR. Deletes are
+    handed out as they are answered too; only the results go back to
+    input order. On 'API rate limit exceeded' every Control Number not
+    deleted yet is handed out as 'unsent'.
+    """
+
+    def __init__(self, outfile):
+        self.path = f"{outfile}.Snapshot.mrc"
+        self.backup = open(self.path, 'ab')
+        self.count = 0
+
+    def sync(self):
+        self.backup.flush()
+        os.fsync(self.backup.fileno())
+
+    def fetch(self, ctrl_nrs, answers, stop):
+        """GETs of the Control Numbers (own thread): every result on `answers` as it is
+        answered, then None; an exception of the run goes on `answers` instead."""
+        try:
+            for result in snapshot_client.get_many(ctrl_nrs, ordered=False):
+                if stop.is_set():
+                    return
+                answers.put(result)
+            answers.put(None)
+        except Exception as err:
+            answers.put(err)
+
+    def deletable(self, ctrl_nrs, skipped):
+        """Control Numbers whose LHR is safely in the snapshot, as their GET is answered;
+        the GET results of the others are put on `skipped`."""
+        answers = queue.Queue(maxsize=SNAPSHOT_SYNC_RECORDS)   # the GETs stay at most this far ahead
+        stop = threading.Event()
+        threading.Thread(target=self.fetch, args=(ctrl_nrs, answers, stop), daemon=True,
+                         name="lhr-snapshot").start()
+        batch = []
+        first_written = None   # time.monotonic() of the first LHR of the batch
+        try:
+            while True:
+                try:
+                    result = answers.get(timeout=max(first_written + SNAPSHOT_SYNC_SECONDS - time.monotonic(), 0) if batch else None)
+                except queue.Empty:
+                    result = False   # nothing answered in time: the batch goes as it is
+                if result is None:
+                    break
+                if isinstance(result, Exception):
+                    raise result
+                if result and result.outcome == 'success':
+                    self.backup.write(result.body.encode('utf-8'))
+                    self.count += 1
+                    if not batch:
+                        first_written = time.monotonic()
+                    batch.append(result.ctrl_nr)
+                elif result:
+                    skipped.append(result)
+                if len(batch) >= SNAPSHOT_SYNC_RECORDS or (batch and time.monotonic() - first_written >= SNAPSHOT_SYNC_SECONDS):
+                    self.sync()
+                    yield from batch
+                    batch = []
+            self.sync()
+            yield from batch
+        finally:
+            # Stopped early: let the GET thread see it, even when it waits for room on the queue
+            stop.set()
+            while not answers.empty():
+                answers.get_nowait()
+
+    def delete_many(self, ctrl_nrs):
+        ctrl_nrs = list(ctrl_nrs)
+        seqs = {ctrl_nr: seq for seq, ctrl_nr in enumerate(ctrl_nrs)}
+        answered = collections.deque()   # delete results, and GET results of the LHRs not deleted
+        reorder = ReorderBuffer(client.reorder_capacity, client.spill_dir)
+        deletes = client.delete_many(self.deletable(ctrl_nrs, answered), ordered=False)
+        handed = set()   # seqs with a result
+
+        def hand_out():
+            while answered:
+                result = answered.popleft()
+                handed.add(seqs[result.ctrl_nr])
+                yield from reorder.add(seqs[result.ctrl_nr], result)
 
-wskey = OAuth2Session(client=client)
+        try:
+            for result in deletes:
+                answered.append(result)
+                yield from hand_out()
+            yield from hand_out()   # GETs that went wrong after the last delete
+        except RateLimitExceeded:
+            # Write what is done already; the Control Numbers not deleted yet (GET waiting, in the
+            # snapshot but not sent) go back unsent, so all of them are in the Resume file
+            yield from hand_out()
+            for seq, ctrl_nr in enumerate(ctrl_nrs):
+                if seq not in handed:
+                    client.unsent += 1
+                    yield from reorder.add(seq, LhrResult(operation='delete', outcome='unsent', ctrl_nr=ctrl_nr))
+            raise
+        finally:
+            deletes.close()
+            reorder.close()
+
+    def close(self):
+        self.backup.close()
+        print(f"Snapshot: {self.count} LHR(s) downloaded before their delete, in {self.path}")
+
+
+class DeleteScript(CtrlNrScript):
+    operation = 'delete'
+    snapshot = None
+
+    def open_sender(self, outfile, canary=False):
+        if self.args.snapshot:
+            self.snapshot = Snapshot(outfile)
+            return self.snapshot.delete_many
+        return self.client.delete_many
+
+    def close_sender(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def keep(self, result):
+        if self.index is not None and result.outcome in ('success', 'not_found'):
+            self.index.remove(self.institution, result.ctrl_nr)
 
-token = None
-max_retries = 3
-timeout_token = 50
-timeout_request = 50   #default timeout for the API
-max_retries = 10
-retry_delay = 3
 
-is_first_line = True
+if __name__ == '__main__':
 
+    # Parse the arguments
+    args = parser.parse_args()
 
-def main(file_name):
-    
-    token = fetch_token()
-    if token is None:
-        print("Fetching token in failed")
-    else:
-        if args.verbose:
-            print("Token in main fetched")
-    
-    with open(file_name, 'r') as file:
-        ctrl_nrs = set(line.strip() for line in file)
-
-    records_count = len(ctrl_nrs)
-    print(f"Nr. of records found: {records_count}")
-  
-    for ctrl_nr in ctrl_nrs:
-        process_record(ctrl_nr)
-    
-def process_record(ctrl_nr):    
-    #print("I am here 1")
-    try:
-        #print("I am here 2")
-
-        #================ DEF FOR API ===============================>
-        def request_data(ctrl_nr):
-            #print("I am here 6")
-
-            #### !!! When you deal with responses sent back to you --> you need the Accept header -> basically what you want to receive !!! ###
-            r = wskey.delete(serviceURL + f"/manage/lhrs/{ctrl_nr}", headers={"Accept": "application/marc", "Content-Type":"application/marc"})   
-
-            r.raise_for_status
-            result = r.content
-            result = result.decode("UTF-8")
-
-            return result
-            
-            # How an error result looks like:
-            """
-            {"type":"NOT_FOUND","title":"Search returns no result.","detail":"The LHR could not be found in the system."}
-            """
-
-            # How a good result looks:
-            """
-            00260nx  a2200121zi 4500001001000000004000700010005001700017007000300034008003300037852002900070876001100099538002800110\u001E227503625....\u001E\u001D
-            """
-        #================ DEF FOR API ===============================>                    
-        
-        
-        with open(output6, 'a') as out6, open(output1, 'a') as out1, open(output2, 'a') as out2, open(output3, 'a') as out3, open(output4, 'a') as out4:
-            processed = False
-            for attempt in range(max_retries): 
-                try:
-                    # Send the record to the API Request
-                    result = request_data(ctrl_nr)
-                    print(f"{result}\n")
-                    #input("Press Enter to continue...")
-                    
-                    # Process the response from the API
-                    if 'API rate limit exceeded' in result:
-                        print(f"{ctrl_nr}|API rate limit exceeded.Exiting program...\n")
-                        sys.exit(0)
-                    
-                    elif (
-                            'API Key or Authorization header is required' in result or 
-                            '<!DOCTYPE html>' in result or  
-                            '<head><title>502 Bad Gateway</title></head>' in result
-                         ):
-
-                        out6.write(f"Attempt {attempt+1} - Error for Control Number {ctrl_nr}:\n{result}\n")
-                        out6.flush()
-                        
-                        print(f'Error encountered for Control Number: {ctrl_nr}:\n***{result}***')
-                        print(f'Retrying request for Control Number: {ctrl_nr}\n')
-                        
-                        # Refresh token and try again
-                        fetch_token()
-                        #result = request_data(ctrl_nr) This only sends to function, does not check for error again, it assume succes
-                        continue  # Go to next attempt to retry
-                            
-                            
-                    # If no error found, proceed                                
-                    
-                    #mcrc returned - thus good
-                    if '\x1E' in result:
-                        print(f"Success for Control Number: {ctrl_nr}\n")
-                        out1.write(f"Success for Control Number: {ctrl_nr}\n")
-                        out2.write(f"{result}")
-
-                    # bad requests go in a different file because of xml
-                    elif '<type>BAD_REQUEST</type>' in result:
-                        print(f"Bad Request for Control Number: {ctrl_nr}\n")
-                        out4.write(f"Control Number: {ctrl_nr}\n{result}\n") # Bad request xml response
-                    
-                    # Not found separate file to examine
-                    elif '{"type":"NOT_FOUND"' in result:
-                        print(f"Not Found for Control Number: {ctrl_nr}\n")
-                        out3.write(f"Control Number: {ctrl_nr}|{result}\n") # Not found json response
-                    
-                    # Any other errors that are not caputred above in the log.
-                    # No retrying as the problem is not related to the request but to the record itself or the request is not valid.
-                    else:
-                        print(f"Went wrong for Control Number: {ctrl_nr}\n")
-                        out6.write(f"Control Number: {ctrl_nr}|{result}\n") # 
-
-
-                    processed = True
-                    break  # Exit retry loop and move to next record
-                    #return result
-
-                except RetryError:
-                    #print(f"-->Retry failed after {max_retries} attempts.")
-                    error_msg = f"--> Retry failed after {max_retries} attempts for Control Number: {ctrl_nr}.\n"
-                    print(error_msg)
-                    #out6.write(f"Retry failed after {max_retries} attempts for ID: {identifier}.\n")
-                    out6.write(error_msg)
-                    out6.flush()
-                    processed = True
-                    break  # Exit retry loop and move to next record
-                    
-                    
-                
-                except requests.exceptions.HTTPError as err:
-                    print("HTTP Error:")
-                    print(err)
-                        
-            if not processed:
-                print(f"Giving up on Control Number: {ctrl_nr}. Moving to next record.\n")
-            #return None  # Return a value indicating failure so the calling code can skip
-
-    except BaseException as err:
-        print("Base Exception error:")
-        print(err)
-
-def fetch_token():
-    global token
-    
-    for attempt in range(max_retries):
+    if args.verbose:
+        print("Verbose mode is ON.\n")
+
+    # Ensure input_file is provided if -morehelp is not used
+    if args.input_file is None:
+        parser.error("The following arguments are required: input_file. Type -h or --help or -morehelp for more information")
+
+    inst_symbol = args.key
+    institution = inst_symbol.upper()
+    print(f"Running script for Institution: {institution}\n")
+
+    # One session for all input files; the token is fetched on first use and refreshed before it expires
+    # Deleted LHRs leave the ledger of mdt_misc_lhradd.py, so they can be added again
+    ledger = AddLedger(LEDGER_FILE) if os.path.exists(LEDGER_FILE) else None
+    # --snapshot: GETs and DELETEs each get half of the concurrency and rate limit of the institution
+    client = LhrClient(inst_symbol, verbose=args.verbose, max_concurrency=args.max_concurrency, ledger=ledger,
+                       workers=2 if args.snapshot else 1)
+    index = HoldingsIndex(INDEX_FILE) if os.path.exists(INDEX_FILE) and not args.dry_run else None
+    registry = RunRegistry(spill_dir=client.profile.spill_dir)   # one request per Control Number for all input files
+    script = DeleteScript(args, client, institution, registry, index)
+    if args.record_deadline is not None:
+        client.record_deadline = args.record_deadline
+    if args.deadline:
         try:
-            token = wskey.fetch_token(token_url='https://oauth.oclc.org/token', auth=auth, timeout=timeout_token)
-            current_datetime = datetime.datetime.now()
-            formatted_datetime_token = current_datetime.strftime("%H:%M:%S")
-            if args.verbose:
-                print(f"Fetched new token at {formatted_datetime_token}: {token}\n")
-                print("----------------------------------------------------------------------------------------------------\n")
-            return token
-        except requests.exceptions.Timeout:
-            print(f"Token request timed out for {institution}, retrying in 3 seconds... ({attempt + 1}/{max_retries})")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                print("Max retries reached for token request.")
-                return None
-        
-        except Exception as e:
-            print(f"Error fetching token for {institution}: {e}")
-            return None
-        
-def token_refresher():
+            client.set_deadline(parse_deadline(args.deadline))
+        except ValueError as err:
+            print(f"\n!ERROR: {err}\n\nExiting program without execution...\n")
+            sys.exit(1)
+    # --snapshot: the GETs get their own client, so they are not held up by the deletes in flight
+    snapshot_client = None
+    if args.snapshot:
+        snapshot_client = LhrClient(inst_symbol, verbose=args.verbose, max_concurrency=args.max_concurrency,
+                                    breaker=client.breaker, workers=2)
+        snapshot_client.record_deadline = client.record_deadline
+        snapshot_client.run_deadline = client.run_deadline
     if args.verbose:
-        print("Fetching token for the first time...")
-    while True:
-        #time.sleep(10) # Sleep for 30 seconds
-        time.sleep(18 * 60) # Sleep for 18 minutes
-        if args.verbose:
-            print("Token refresh!")
-        fetch_token()
-        if args.verbose:
-            print("Refreshed token!")
+        print(f"Profile of {institution}: {client.profile}\n")
 
-
-if __name__ == '__main__':
-    
     # Get the name of the script
     script_name = os.path.basename(__file__)[:-3]
 
     # Get the current date
     current_datetime = datetime.datetime.now()
-    #formatted_datetime = current_datetime.strftime("%Y-%m-%d.%H.%M.%S")
     formatted_datetime = current_datetime.strftime("%y%m%d.%H%M%S")
 
-    # Token refresher call
-    token_thread = threading.Thread(target=token_refresher, daemon=True)
-    token_thread.start()
-    
-    
+
     # Use glob to expand the wildcard pattern
-    file_list = glob.glob(args.input_file)
-    
+    if args.input_file == '-':
+        file_list = [spool_stdin()]
+    else:
+        file_list = glob.glob(args.input_file)
+
     # Check if files were found
     if not file_list:
         raise FileNotFoundError(f"No files found matching the pattern: {args.input_file}")
         sys.exit(1)
-            
-    
+
+
     if args.run == 'd':
-        if all(os.path.splitext(file)[1] == '.txt' for file in file_list):
+        if args.input_file == '-' or all(input_extension(file) in ('.txt', '.jsonl') for file in file_list):
             print(f"\n***Format file approved '.txt'\n")
         else:
-            print(f"\n!ERROR: All input files must be '.txt'\n\nExiting program without execution...\n")
+            print(f"\n!ERROR: All input files must be '.txt' (or a '.LOG.jsonl' of an earlier run)\n\nExiting program without execution...\n")
             sys.exit(1)
-    
 
-    # Select function to execute based on the second argument             
-    if args.run == 'd':        
-        # Process each file found 
+
+    # Select function to execute based on the second argument
+    if args.run == 'd':
+        # Process each file found
         for file_name in file_list:
             print("\n==================================================")
             print(f"-->Input file processed: {file_name}\n")
 
             # Output file paths
-            base_name = os.path.splitext(os.path.basename(file_name))[0]
+            base_name = input_base_name(file_name)
             outfile=f"{base_name}.{script_name}.{institution}.{formatted_datetime}"
-            output1=f"{outfile}.SuccessCtrlNrs.txt"
-            output2=f"{outfile}.DeletedLHRs.mrc"
-            output3=f"{outfile}.NotFoundLHRs.json"
-            output4=f"{outfile}.BadRequest.xml"
-            output6=f"{outfile}.LOG.txt"
 
-            main(file_name)
+            try:
+                script.main(file_name, outfile)
+            except RateLimitExceeded as err:
+                print(f"{err} Exiting program...\n")
+                sys.exit(0)
+            except CanaryFailed as err:
+                print(f"\n{err} Exiting program...\n")
+                sys.exit(1)
+
+        if registry.hits:
+            print(f"\nControl Numbers found in more than one input file, requested once: {registry.hits}")
+        registry.close()
+
+
+    if client.unsent:
+        print(f"\nRun deadline reached: {client.unsent} record(s) not sent, see the Resume.txt file(s) to continue")
 
-      
     print(f"\n***End of file***")
     print(f"***End of script***")
@@ -12,40 +12,45 @@
 #  25-11-2025	: popae    : creation
 #           	: When you download an LHR from API it comes with 005
 #           	: To test if needed while LHR add is used
+#  19-10-2026	: popae    : requests through mdt_misc_lhrclient.LhrClient,
+#           	: no argparse/credentials/session work at import time
+#           	: --max-concurrency: requests in flight adapted by AIMD, limit in the summary
+#           	: Outputs in input order also with concurrent requests (default 8 in flight)
+#           	: LOG.jsonl error log, also accepted as input to process the errors again
+#           	: Transient failures retried later from a deferred queue, Retry.txt for the rest
+#           	: --columnar: Parquet/CSV sidecar with selected fields of the downloaded LHRs
+#           	: --canary N|P%: sample first, report and projection, stop or continue
+#           	: Concurrency, rate limit, timeouts and retries from the institution profile (API_PROFILES.env)
+#           	: Downloaded LHRs kept in the local index of the holdings (see mdt_misc_lhrindex.py)
+#           	: --hedge: duplicate of GETs slower than a latency percentile, capped extra load
+#           	: Control Numbers in several input files requested once per run, result written for each file
+#           	: --deadline / --record-deadline: run and per record deadlines, Resume file with what was not sent
+#           	: --hedge-max in percent with or without '%', checked to be between 0 and 100
+#           	: Options, canary and validation shared with mdt_misc_lhrdelete.py (mdt_misc_lhrscript.CtrlNrScript)
 #
 #  Notes	:
 #
 #  SVN ident	: $Id$
 
 # Built-in/Generic Imports
-import os
-import sys
-
-
-
 import os
 import sys
 import argparse
 import fnmatch
-import threading  # to refresh the token
 import glob
-from requests.exceptions import RetryError  # Import the correct exception
-
-#import yaml
-from dotenv import load_dotenv
-load_dotenv("/home/popae/Scripts/API_KEYS.env")
-
-from oauthlib.oauth2 import BackendApplicationClient
-from requests.auth import HTTPBasicAuth
-from requests_oauthlib import OAuth2Session
-import requests
 import datetime
-import sys
 import json
 import re
 import time
 import xml.etree.ElementTree as ET
 
+from mdt_misc_lhrclient import LhrClient, RateLimitExceeded, INDEX_FILE
+from mdt_misc_lhrcommon import CanaryFailed, parse_deadline, RunRegistry
+from mdt_misc_lhrcommon import input_extension, input_base_name, spool_stdin
+from mdt_misc_lhrcommon import ColumnarWriter, parse_column_spec, DEFAULT_COLUMNS, HoldingsIndex, HedgePolicy, parse_percent
+from mdt_misc_lhrscript import CtrlNrScript, add_compress_argument, add_canary_arguments, add_concurrency_argument
+from mdt_misc_lhrscript import add_deadline_arguments, add_dry_run_argument
+
 #============================================================#
 #                   START OF HELP PARSER
 #============================================================#
@@ -61,6 +66,9 @@ parser._positionals.title = 'Mandatory arguments' #Customize positionals title i
 parser.add_argument("-i", "--in", dest="input_file", required=True, help=(
                                                 'Input file to be processed or "file_pattern".\n'
                                                 '- "file_pattern" requires double quotes.\n'
+                                                '- gzip/zstd compressed files (.txt.gz, .txt.zst) are read directly.\n'
+                                                '- "-" reads the input from stdin.\n'
+                                                '- A *.LOG.jsonl of an earlier run processes again the Control Numbers that failed there.\n'
                                                 "- Input file is a txt file with Control Numbers of the LHRs to be downloaded.\n"
  )
 )
@@ -78,293 +86,181 @@ parser.add_argument("-r", "--run", nargs="?", required=True, choices=['g'], help
 # Optional arguments
 parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity; use as argumnet AFTER the input file.')
 
-# Parse the arguments
-args = parser.parse_args()
-
-#============================================================#
-#                   END OF HELP PARSER
-#============================================================#
+add_compress_argument(parser, "DownloadedLHRs.mrc")
 
+parser.add_argument("--columnar", action='store_true', help=(
+                                                "Also write {outfile}.LHRs.parquet (or .LHRs.csv when pyarrow is not installed)\n"
+                                                "with one row per downloaded LHR and the fields of --columns.\n"
+ )
+)
 
-if args.verbose:
-    print("Verbose mode is ON.\n")
+parser.add_argument("--columns", default=DEFAULT_COLUMNS, help=(
+                                                "Columns of --columnar: TAG or TAG$code, optionally =name, comma separated.\n"
+                                                "- Repeated fields/subfields are joined with '|'.\n"
+                                                f"- Default: {DEFAULT_COLUMNS}\n"
+ )
+)
 
-# Ensure input_file is provided if -morehelp is not used
-if args.input_file is None:
-    parser.error("The following arguments are required: input_file. Type -h or --help or -morehelp for more information")
+parser.add_argument("--no-index", dest="no_index", action='store_true', help=(
+                                                "Do not store the downloaded LHRs in the local index of the holdings.\n"
+                                                "- By default every LHR downloaded is stored (or updated) in lhr_index.db next to\n"
+                                                "  the scripts (or $LHR_INDEX) and Control Numbers not found are removed from it;\n"
+                                                "  query it with mdt_misc_lhrindex.py.\n"
+ )
+)
 
-input_arg = args.input_file
+parser.add_argument("--validate", action='store_true', help=(
+                                                "Check the input locally before any API call (in parallel over all cores).\n"
+                                                "- Lines that are not a numeric Control Number are written to {outfile}.Rejected.txt\n"
+                                                "  and are not sent to the API.\n"
+ )
+)
 
+add_canary_arguments(parser)
 
-# serviceURL = config.get('metadata_service_url')
-serviceURL = 'https://metadata.api.oclc.org/worldcat'
+add_concurrency_argument(parser)
 
-# Scope
-#scope = ['WorldCatMetadataAPI:manage_bibs', 'WorldCatMetadataAPI:view_brief_bib']
-scope = ['WorldCatMetadataAPI:manage_institution_lhrs']
+parser.add_argument("--hedge", type=float, metavar="PERCENTILE", help=(
+                                                "Send a duplicate of a GET still unanswered after this percentile of the\n"
+                                                "observed latencies (e.g. 95); the first answer is kept, the other dropped.\n"
+                                                "- Cuts the few requests hanging for most of the timeout; off by default.\n"
+ )
+)
 
-def load_oauth_credentials(inst_symbol: str):
-    prefix = inst_symbol.upper()
+parser.add_argument("--hedge-max", dest="hedge_max", default="5%", help=(
+                                                "Highest share of extra requests sent as hedges, in percent: 5 or 5%% (default 5%%).\n"
+                                                "- Hedges also count for the RATE_LIMIT of the institution profile.\n"
+ )
+)
 
-    client_id = os.getenv(f"{prefix}_CLIENT_ID")
-    #print(f"Client ID: {client_id}\n")
+add_deadline_arguments(parser, "Resume.txt")
 
-    client_secret = os.getenv(f"{prefix}_CLIENT_SECRET")
-    #print(f"Client Secret: {client_secret}\n")
+add_dry_run_argument(parser)
 
+#============================================================#
+#                   END OF HELP PARSER
+#============================================================#
 
-    if not all([client_id, client_secret]):
-        raise ValueError(f"Missing credentials for user '{inst_symbol}'")
+class GetScript(CtrlNrScript):
+    operation = 'get'
+    columnar = None
 
-    return {
-        "client_id": client_id,
-        "client_secret": client_secret,
-    }
+    def open_sender(self, outfile, canary=False):
+        if self.args.columnar and not canary:
+            self.columnar = ColumnarWriter(outfile, parse_column_spec(self.args.columns), self.client.profile.columnar_batch_size)
+        return self.client.get_many
 
-inst_symbol = args.key
-institution = inst_symbol.upper()
-print(f"Running script for Institution: {institution}\n")
+    def close_sender(self):
+        if self.columnar is not None:
+            self.columnar.close()
+            print(f"Columnar export: {self.columnar.count} row(s) in {self.columnar.path}")
+            self.columnar = None
 
-creds = load_oauth_credentials(inst_symbol)
+    def keep(self, result):
+        # Local index of the holdings: latest version of every LHR seen
+        if self.index is not None:
+            if result.outcome == 'success':
+                self.index.upsert(self.institution, result.body)
+            elif result.outcome == 'not_found':
+                self.index.remove(self.institution, result.ctrl_nr)
+        if self.columnar is not None and result.ok:
+            self.columnar.write(result.body)
 
-auth = HTTPBasicAuth(creds["client_id"], creds["client_secret"])
-client = BackendApplicationClient(client_id=creds["client_id"], scope=scope)
 
+if __name__ == '__main__':
 
-wskey = OAuth2Session(client=client)
+    # Parse the arguments
+    args = parser.parse_args()
 
-token = None
-max_retries = 3
-timeout_token = 50
-timeout_request = 50   #default timeout for the API
-max_retries = 10
-retry_delay = 3
+    if args.verbose:
+        print("Verbose mode is ON.\n")
 
-is_first_line = True
+    # Ensure input_file is provided if -morehelp is not used
+    if args.input_file is None:
+        parser.error("The following arguments are required: input_file. Type -h or --help or -morehelp for more information")
 
+    inst_symbol = args.key
+    institution = inst_symbol.upper()
+    print(f"Running script for Institution: {institution}\n")
 
-def main(file_name):
-    
-    token = fetch_token()
-    if token is None:
-        print("Fetching token in failed")
-    else:
-        if args.verbose:
-            print("Token in main fetched")
-    
-    with open(file_name, 'r') as file:
-        ctrl_nrs = set(line.strip() for line in file)
-
-    records_count = len(ctrl_nrs)
-    print(f"Nr. of records found: {records_count}")
-  
-    for ctrl_nr in ctrl_nrs:
-        process_record(ctrl_nr)
-    
-def process_record(ctrl_nr):    
-    #print("I am here 1")
-    try:
-        #print("I am here 2")
-
-        #================ DEF FOR API ===============================>
-        def request_data(ctrl_nr):
-            #print("I am here 6")
-
-            #### !!! When you deal with responses sent back to you --> you need the Accept header -> basically what you want to receive !!! ###
-            r = wskey.get(serviceURL + f"/manage/lhrs/{ctrl_nr}", headers={"Accept": "application/marc", "Content-Type":"application/marc"})   
-
-            r.raise_for_status
-            result = r.content
-            result = result.decode("UTF-8")
-
-            #print(f"{result}\n")
-            #input("Press Enter to continue...")
-
-            return result
-            
-            # How an error result looks like:
-            # xml or json
-            """
-            {"type":"NOT_FOUND","title":"Search returns no result.","detail":"The LHR could not be found in the system."}
-            """
-
-            # How a good result looks:
-            #mrc binary file
-            """
-             00260nx  a2200121zi 4500001001000000004000700010005001700017007000300034008003300037852002900070876001100099538002800110\u001E227503625....\u001E\u001D      
-            """
-        #================ DEF FOR API ===============================>                    
-        
-        
-        with open(output6, 'a') as out6, open(output1, 'a') as out1, open(output2, 'a') as out2, open(output3, 'a') as out3, open(output4, 'a') as out4:
-            processed = False
-            for attempt in range(max_retries): 
-                try:
-                    # Send the record to the API Request
-                    result = request_data(ctrl_nr)
-                    
-                    # Process the response from the API
-                    if 'API rate limit exceeded' in result:
-                        print(f"{ctrl_nr}|API rate limit exceeded.Exiting program...\n")
-                        sys.exit(0)
-                    
-                    elif (
-                            'API Key or Authorization header is required' in result or 
-                            '<!DOCTYPE html>' in result or  
-                            '<head><title>502 Bad Gateway</title></head>' in result
-                         ):
-
-                        out6.write(f"Attempt {attempt+1} - Error for Control Number {ctrl_nr}:\n{result}\n")
-                        out6.flush()
-                        
-                        print(f'Error encountered for Control Number: {ctrl_nr}:\n***{result}***')
-                        print(f'Retrying request for Control Number: {ctrl_nr}\n')
-                        
-                        # Refresh token and try again
-                        fetch_token()
-                        #result = request_data(ctrl_nr) This only sends to function, does not check for error again, it assume succes
-                        continue  # Go to next attempt to retry
-                            
-                            
-                    # If no error found, proceed                                
-                    
-                    #mcrc returned - thus good
-                    if '\x1E' in result:
-                        print(f"Success for Control Number: {ctrl_nr}\n")
-                        out1.write(f"Success for Control Number: {ctrl_nr}\n")
-                        out2.write(f"{result}")
-
-                    # bad requests go in a different file because of xml
-                    elif '<type>BAD_REQUEST</type>' in result:
-                        print(f"Bad Request for Control Number: {ctrl_nr}\n")
-                        out4.write(f"Control Number: {ctrl_nr}\n{result}") # Bad request xml response
-                    
-                    # Not found separate file to examine
-                    elif '"type": "NOT_FOUND",' in result:
-                        print(f"Not Found for Control Number: {ctrl_nr}\n")
-                        out3.write(f"Control Number: {ctrl_nr}\n{result}") # Not found json response
-                    
-                    # Any other errors that are not caputred above in the log.
-                    # No retrying as the problem is not related to the request but to the record itself or the request is not valid.
-                    else:
-                        print(f"Went wrong for Control Number: {ctrl_nr}\n")
-                        out6.write(f"Control Number: {ctrl_nr}\n{result}") # 
-
-
-                    processed = True
-                    break  # Exit retry loop and move to next record
-                    #return result
-
-                except RetryError:
-                    #print(f"-->Retry failed after {max_retries} attempts.")
-                    error_msg = f"--> Retry failed after {max_retries} attempts for Control Number: {ctrl_nr}.\n"
-                    print(error_msg)
-                    #out6.write(f"Retry failed after {max_retries} attempts for ID: {identifier}.\n")
-                    out6.write(error_msg)
-                    out6.flush()
-                    processed = True
-                    break  # Exit retry loop and move to next record
-                    
-                    
-                
-                except requests.exceptions.HTTPError as err:
-                    print("HTTP Error:")
-                    print(err)
-                        
-            if not processed:
-                print(f"Giving up on Control Number: {ctrl_nr}. Moving to next record.\n")
-            #return None  # Return a value indicating failure so the calling code can skip
-
-    except BaseException as err:
-        print("Base Exception error:")
-        print(err)
-
-def fetch_token():
-    global token
-    
-    for attempt in range(max_retries):
+    # One session for all input files; the token is fetched on first use and refreshed before it expires
+    hedge = None
+    if args.hedge:
+        try:
+            hedge = HedgePolicy(parse_percent(args.hedge), parse_percent(args.hedge_max))
+        except ValueError as err:
+            print(f"\n!ERROR: --hedge / --hedge-max: {err}\n\nExiting program without execution...\n")
+            sys.exit(1)
+    client = LhrClient(inst_symbol, verbose=args.verbose, max_concurrency=args.max_concurrency, hedge=hedge)
+    index = None if args.no_index or args.dry_run else HoldingsIndex(INDEX_FILE)
+    registry = RunRegistry(spill_dir=client.profile.spill_dir)   # one request per Control Number for all input files
+    script = GetScript(args, client, institution, registry, index)
+    if args.record_deadline is not None:
+        client.record_deadline = args.record_deadline
+    if args.deadline:
         try:
-            token = wskey.fetch_token(token_url='https://oauth.oclc.org/token', auth=auth, timeout=timeout_token)
-            current_datetime = datetime.datetime.now()
-            formatted_datetime_token = current_datetime.strftime("%H:%M:%S")
-            if args.verbose:
-                print(f"Fetched new token at {formatted_datetime_token}: {token}\n")
-                print("----------------------------------------------------------------------------------------------------\n")
-            return token
-        except requests.exceptions.Timeout:
-            print(f"Token request timed out for {institution}, retrying in 3 seconds... ({attempt + 1}/{max_retries})")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                print("Max retries reached for token request.")
-                return None
-        
-        except Exception as e:
-            print(f"Error fetching token for {institution}: {e}")
-            return None
-        
-def token_refresher():
+            client.set_deadline(parse_deadline(args.deadline))
+        except ValueError as err:
+            print(f"\n!ERROR: {err}\n\nExiting program without execution...\n")
+            sys.exit(1)
     if args.verbose:
-        print("Fetching token for the first time...")
-    while True:
-        #time.sleep(10) # Sleep for 30 seconds
-        time.sleep(18 * 60) # Sleep for 18 minutes
-        if args.verbose:
-            print("Token refresh!")
-        fetch_token()
-        if args.verbose:
-            print("Refreshed token!")
-
+        print(f"Profile of {institution}: {client.profile}\n")
 
-if __name__ == '__main__':
-    
     # Get the name of the script
     script_name = os.path.basename(__file__)[:-3]
 
     # Get the current date
     current_datetime = datetime.datetime.now()
     formatted_datetime = current_datetime.strftime("%y%m%d.%H%M%S")
-    
-    # Token refresher call
-    token_thread = threading.Thread(target=token_refresher, daemon=True)
-    token_thread.start()
-    
-    
+
+
     # Use glob to expand the wildcard pattern
-    file_list = glob.glob(args.input_file)
-    
+    if args.input_file == '-':
+        file_list = [spool_stdin()]
+    else:
+        file_list = glob.glob(args.input_file)
+
     # Check if files were found
     if not file_list:
         raise FileNotFoundError(f"No files found matching the pattern: {args.input_file}")
         sys.exit(1)
-            
-    
+
+
     if args.run == 'g':
-        if all(os.path.splitext(file)[1] == '.txt' for file in file_list):
+        if args.input_file == '-' or all(input_extension(file) in ('.txt', '.jsonl') for file in file_list):
             print(f"\n***Format file approved '.txt'\n")
         else:
-            print(f"\n!ERROR: All input files must be '.txt'\n\nExiting program without execution...\n")
+            print(f"\n!ERROR: All input files must be '.txt' (or a '.LOG.jsonl' of an earlier run)\n\nExiting program without execution...\n")
             sys.exit(1)
-    
 
-    # Select function to execute based on the second argument             
-    if args.run == 'g':        
-        # Process each file found 
+
+    # Select function to execute based on the second argument
+    if args.run == 'g':
+        # Process each file found
         for file_name in file_list:
             print("\n==================================================")
             print(f"-->Input file processed: {file_name}\n")
 
             # Output file paths
-            base_name = os.path.splitext(os.path.basename(file_name))[0]
+            base_name = input_base_name(file_name)
             outfile=f"{base_name}.{script_name}.{institution}.{formatted_datetime}"
-            output1=f"{outfile}.SuccessCtrlNrs.txt"
-            output2=f"{outfile}.DownloadedLHRs.mrc"
-            output3=f"{outfile}.NotFoundLHRs.json"
-            output4=f"{outfile}.BadRequest.xml"
-            output6=f"{outfile}.LOG.txt"
 
-            main(file_name)
+            try:
+                script.main(file_name, outfile)
+            except RateLimitExceeded as err:
+                print(f"{err} Exiting program...\n")
+                sys.exit(0)
+            except CanaryFailed as err:
+                print(f"\n{err} Exiting program...\n")
+                sys.exit(1)
+
+        if registry.hits:
+            print(f"\nControl Numbers found in more than one input file, requested once: {registry.hits}")
+        registry.close()
+
+
+    if client.unsent:
+        print(f"\nRun deadline reached: {client.unsent} record(s) not sent, see the Resume.txt file(s) to continue")
 
-      
     print(f"\n***End of file***")
     print(f"***End of script***")
@@ -0,0 +1,199 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright (c) 2025 by OCLC
+#
+#  File		    : mdt_misc_lhrindex.py
+#  Description	: Queries on the local index of the holdings, without the API
+#  Author(s)	: Elena-Iulia Popa
+#  Creation	    : 19-10-2026
+#
+#  History:
+#  19-10-2026	: popae    : creation
+#           	: query: .txt Control Numbers (for get/delete) or .mrc LHRs (for replace)
+#           	: load: index .mrc/.xml dumps of earlier get runs
+#           	: stats: LHRs indexed per institution
+#
+#  Notes	:
+#           	: The index (lhr_index.db next to the scripts, or $LHR_INDEX) is filled by
+#           	: mdt_misc_lhrget.py; mdt_misc_lhrdelete.py removes what it deleted.
+#           	:   mdt_misc_lhrindex.py query -k SYMBOL --location "MAIN*" -o main.txt
+#           	:   mdt_misc_lhrindex.py query -k SYMBOL --older-than 20200101 -o old.mrc
+#           	:   mdt_misc_lhrindex.py query -k SYMBOL --ocn @ocns.txt -o ctrl_nrs.txt
+#
+#  SVN ident	: $Id$
+
+# Built-in/Generic Imports
+import os
+import sys
+import argparse
+import glob
+import re
+
+from mdt_misc_lhrclient import INDEX_FILE
+from mdt_misc_lhrcommon import HoldingsIndex, RECORD_TERMINATOR, read_input_records, open_output, open_input
+
+#============================================================#
+#                   START OF HELP PARSER
+#============================================================#
+parser = argparse.ArgumentParser(
+    description='Query the local index of the holdings built by mdt_misc_lhrget.py' ,
+    formatter_class=argparse.RawTextHelpFormatter  # # This prevents argparse from reformatting help text
+)
+
+parser._optionals.title = 'Options' #Customize options title if desired
+parser._positionals.title = 'Mandatory arguments' #Customize positionals title if desired
+
+parser.add_argument("--index", default=INDEX_FILE, help=(
+                                                f"Index file (default {INDEX_FILE}).\n"
+ )
+)
+
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+query_parser = subparsers.add_parser("query", formatter_class=argparse.RawTextHelpFormatter,
+                                     help="LHRs of an institution matching all given criteria")
+load_parser = subparsers.add_parser("load", formatter_class=argparse.RawTextHelpFormatter,
+                                    help="Index .mrc/.xml files with downloaded LHRs")
+stats_parser = subparsers.add_parser("stats", formatter_class=argparse.RawTextHelpFormatter,
+                                     help="Number of LHRs indexed per institution")
+
+for sub in (query_parser, load_parser):
+    sub.add_argument("-k", "--key", required=True, help=(
+                                                "Symbol of the Institution.\n"
+ )
+)
+
+query_parser.add_argument("--location", help=(
+                                                "852 $b; * is a wildcard (e.g. \"MAIN*\").\n"
+ )
+)
+
+query_parser.add_argument("--sublocation", help=(
+                                                "852 $c; * is a wildcard.\n"
+ )
+)
+
+query_parser.add_argument("--call-number", dest="call_number", help=(
+                                                "852 $h and $i, separated by a space; * is a wildcard.\n"
+ )
+)
+
+query_parser.add_argument("--ocn", help=(
+                                                "OCLC numbers in 004, comma separated, or @file with one per line.\n"
+ )
+)
+
+query_parser.add_argument("--barcode", help=(
+                                                "Barcodes (876-878 $p), comma separated, or @file with one per line.\n"
+ )
+)
+
+query_parser.add_argument("--older-than", dest="older_than", help=(
+                                                "005 before this date: YYYYMMDD, YYYY-MM-DD or any leading part (e.g. 2020).\n"
+ )
+)
+
+query_parser.add_argument("--newer-than", dest="newer_than", help=(
+                                                "005 on or after this date: YYYYMMDD, YYYY-MM-DD or any leading part.\n"
+ )
+)
+
+query_parser.add_argument("-o", "--out", help=(
+                                                "Output file:\n"
+                                                "- .txt: the Control Numbers, input for mdt_misc_lhrget.py / mdt_misc_lhrdelete.py\n"
+                                                "- .mrc (.mrc.gz, .mrc.zst): the LHRs as last downloaded, input for mdt_misc_lhrreplace.py\n"
+                                                "- Without -o the Control Numbers are printed.\n"
+ )
+)
+
+load_parser.add_argument("-i", "--in", dest="input_file", required=True, help=(
+                                                'Input file or "file_pattern" (double quotes): .mrc or MARCXML .xml with LHRs,\n'
+                                                'e.g. the DownloadedLHRs.mrc of earlier get runs (also gzip/zstd compressed).\n'
+ )
+)
+
+#============================================================#
+#                   END OF HELP PARSER
+#============================================================#
+
+
+def list_argument(value):
+    """'a,b' or '@file' (one value per line) -> list of values."""
+    if value is None:
+        return None
+    if value.startswith('@'):
+        with open_input(value[1:], 'rt') as file:
+            return [line.strip() for line in file if line.strip()]
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def date_argument(value):
+    """'2020-01-31' -> '20200131' (005 is yyyymmddhhmmss.f)."""
+    return re.sub(r'\D', '', value) if value else None
+
+
+def query(index, institution):
+    rows = index.query(institution, location=args.location, sublocation=args.sublocation, ocns=list_argument(args.ocn),
+                       older_than=date_argument(args.older_than), newer_than=date_argument(args.newer_than),
+                       call_number=args.call_number, barcodes=list_argument(args.barcode))
+
+    if args.out is None:
+        for ctrl_nr, record in rows:
+            print(ctrl_nr)
+    elif re.search(r'\.mrc(\.gz|\.zst)?$', args.out):
+        with open_output(args.out, 'wb') as out:
+            for ctrl_nr, record in rows:
+                out.write(record if record.endswith(RECORD_TERMINATOR) else record + RECORD_TERMINATOR)
+    elif args.out.endswith('.txt'):
+        with open(args.out, 'w') as out:
+            for ctrl_nr, record in rows:
+                out.write(f"{ctrl_nr}\n")
+    else:
+        print(f"\n!ERROR: Output file must be '.txt' or '.mrc'\n\nExiting program without execution...\n")
+        sys.exit(1)
+
+    print(f"LHRs found for {institution}: {len(rows)}" + (f", written to {args.out}" if args.out else ""), file=sys.stderr)
+
+
+def load(index, institution):
+    file_list = glob.glob(args.input_file)
+    if not file_list:
+        raise FileNotFoundError(f"No files found matching the pattern: {args.input_file}")
+
+    for file_name in file_list:
+        count = 0
+        for record in read_input_records(file_name):
+            if index.upsert(institution, record):
+                count += 1
+        index.commit()
+        print(f"{file_name}: {count} LHR(s) indexed for {institution}")
+
+
+def stats(index):
+    rows = index.counts()
+    if not rows:
+        print(f"No LHRs in {args.index}")
+    for institution, count, indexed in rows:
+        print(f"{institution}: {count} LHR(s), last indexed {indexed}")
+
+
+if __name__ == '__main__':
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.command != 'load' and not os.path.exists(args.index):
+        print(f"\n!ERROR: Index '{args.index}' does not exist; run mdt_misc_lhrget.py first\n\nExiting program without execution...\n")
+        sys.exit(1)
+
+    index = HoldingsIndex(args.index)
+    try:
+        if args.command == 'query':
+            query(index, args.key.upper())
+        elif args.command == 'load':
+            load(index, args.key.upper())
+        else:
+            stats(index)
+    finally:
+        index.close()
@@ -0,0 +1,464 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright (c) 2025 by OCLC
+#
+#  File		    : mdt_misc_lhrplan.py
+#  Description	: LHR get/delete/add/replace jobs larger than the API quota, spread over quota windows
+#  Author(s)	: Elena-Iulia Popa
+#  Creation	    : 19-10-2026
+#
+#  History:
+#  19-10-2026	: popae    : creation
+#           	: Projection of the windows needed and of the completion time before the start
+#           	: Each window runs up to its request budget (quota minus a reserve), then waits for the next one
+#           	: Progress saved in a state file: a stopped job continues where it was
+#           	: add/replace records read per window through an offset index, not all in memory
+#           	: --quota-reserve through parse_limit: 0 or 0% leave nothing unused
+#           	: A reserve leaving no budget (or a throughput of 0) is refused instead of projecting for ever
+#
+#  Notes	:
+#           	: The quota of an institution comes from API_PROFILES.env:
+#           	:   <SYMBOL>_QUOTA=50000          requests per window
+#           	:   <SYMBOL>_QUOTA_WINDOW=86400   seconds (default one day)
+#           	:   <SYMBOL>_QUOTA_RESET=00:00    local time at which a window starts
+#           	: Every request counts, retries and hedges included; adds found in the ledger do not.
+#           	: The script keeps running (and sleeping) until the job is done; run it with nohup,
+#           	: screen or a service. Started again with the same input it continues from the
+#           	: state file; records of an interrupted window may be sent twice (adds are
+#           	: protected by the ledger of mdt_misc_lhradd.py).
+#           	: A compressed or MARCXML add/replace input is first copied, record by record, to
+#           	: an uncompressed .mrc next to the state file; the copy is removed when the job is done.
+#
+#  SVN ident	: $Id$
+
+# Built-in/Generic Imports
+import os
+import sys
+import shutil
+import argparse
+import datetime
+import json
+import math
+import time
+from dataclasses import dataclass, field, asdict
+
+from mdt_misc_lhrclient import LhrClient, RateLimitExceeded, LEDGER_FILE
+from mdt_misc_lhrcommon import AddLedger, Progress, ResultWriter, parse_limit, format_duration, MrcOffsetIndex, RECORD_TERMINATOR
+from mdt_misc_lhrcommon import open_input, read_marcxml_records, is_marcxml, is_plain_file, input_extension, input_base_name
+
+#============================================================#
+#                   START OF HELP PARSER
+#============================================================#
+parser = argparse.ArgumentParser(
+    description='Run an LHR job larger than the API quota over as many quota windows as needed' ,
+    formatter_class=argparse.RawTextHelpFormatter  # # This prevents argparse from reformatting help text
+)
+
+parser._optionals.title = 'Options' #Customize options title if desired
+parser._positionals.title = 'Mandatory arguments' #Customize positionals title if desired
+
+# Positional (mandatory) argument:
+parser.add_argument("-i", "--in", dest="input_file", required=True, help=(
+                                                "Input file: .txt with Control Numbers for get/delete,\n"
+                                                ".mrc or MARCXML .xml with LHRs for add/replace (also gzip/zstd compressed).\n"
+ )
+)
+
+parser.add_argument("-k", "--key", required=True, help=(
+                                                "Symbol of the Institution for the WSKey retrieval.\n"
+ )
+)
+
+parser.add_argument("-r", "--run", required=True, choices=['g', 'd', 'a', 'r'], help=(
+                                                "'[g]et', '[d]elete', '[a]dd' or '[r]eplace'.\n"
+ )
+)
+
+# Optional arguments
+parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity.')
+
+parser.add_argument("--quota", type=int, help=(
+                                                "Requests allowed per quota window (default <SYMBOL>_QUOTA of API_PROFILES.env).\n"
+ )
+)
+
+parser.add_argument("--quota-window", dest="quota_window", type=float, help=(
+                                                "Length of a quota window in seconds (default <SYMBOL>_QUOTA_WINDOW, or 86400).\n"
+ )
+)
+
+parser.add_argument("--quota-reset", dest="quota_reset", help=(
+                                                "Local time HH:MM at which a quota window starts (default <SYMBOL>_QUOTA_RESET, or 00:00).\n"
+ )
+)
+
+parser.add_argument("--quota-reserve", dest="quota_reserve", default="5%", help=(
+                                                "Requests of every window left unused: N or P%% of the quota (default 5%%).\n"
+                                                "- Room for the retries of the requests in flight and for other use of the API.\n"
+                                                "- 0 (or 0%%) leaves nothing unused.\n"
+ )
+)
+
+parser.add_argument("--throughput", type=float, help=(
+                                                "Records per second for the projection before anything is measured\n"
+                                                "(default: RATE_LIMIT of the profile, or an estimate from the concurrency).\n"
+                                                "- After every window the projection uses the measured throughput.\n"
+ )
+)
+
+parser.add_argument("--plan-only", dest="plan_only", action='store_true', help=(
+                                                "Print the projection and exit without sending anything.\n"
+ )
+)
+
+parser.add_argument("--state", help=(
+                                                "State file of the job (default {input}.mdt_misc_lhrplan.{SYMBOL}.{operation}.state.json).\n"
+ )
+)
+
+parser.add_argument("-c", "--compress", choices=['gz', 'zst'], help=(
+                                                "Write the .mrc outputs compressed (gzip or zstd).\n"
+ )
+)
+
+parser.add_argument("--max-concurrency", dest="max_concurrency", type=int, help=(
+                                                "Maximum number of requests in flight (default 8, or the institution profile).\n"
+ )
+)
+
+#============================================================#
+#                   END OF HELP PARSER
+#============================================================#
+
+OPERATIONS = {'g': 'get', 'd': 'delete', 'a': 'add', 'r': 'replace'}
+OUTCOMES = {
+    'get':     ['success', 'not_found', 'bad_request', 'error', 'failed'],
+    'delete':  ['success', 'not_found', 'bad_request', 'error', 'failed'],
+    'add':     ['success', 'already_added', 'bad_request', 'error', 'failed'],
+    'replace': ['success', 'bad_request', 'error', 'failed'],
+}
+ASSUMED_LATENCY = 1.0   # seconds per request in flight, for a projection without measurements
+RESET_MARGIN = 60       # seconds waited after the start of a window, against clocks that differ
+CHECKPOINT = 1000       # results between two saves of the state file
+
+
+class QuotaWindows:
+    """Windows of `length` seconds, one of them starting at `reset` (HH:MM local time)."""
+
+    def __init__(self, length, reset):
+        self.length = length
+        hour, minute = (int(part) for part in reset.split(':'))
+        self.anchor = datetime.datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0).timestamp()
+
+    def start(self, when):
+        return self.anchor + math.floor((when - self.anchor) / self.length) * self.length
+
+    def end(self, when):
+        return self.start(when) + self.length
+
+
+@dataclass
+class JobState:
+    """Progress of a job, kept in a JSON file.
+
+    Records are numbered from 1 in input order. `position` is the first
+    record never handed to a window; `carry` holds the records of earlier
+    windows that were not sent, done first in the next window. The records
+    of add/replace are read from `records_file` through its offset index
+    (<records_file>.offsets).
+    """
+    path: str
+    input_file: str
+    operation: str
+    institution: str
+    total: int
+    outfile: str
+    position: int = 1
+    carry: list = field(default_factory=list)
+    window_start: float = None
+    window_requests: int = 0        # requests sent in the window of window_start
+    windows: int = 0
+    requests: int = 0
+    done: int = 0
+    seconds: float = 0.0            # time spent sending
+    counts: dict = field(default_factory=dict)
+    records_file: str = None
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            return cls(path=path, **json.load(file))
+
+    def save(self):
+        values = asdict(self)
+        del values['path']
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(values, file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def remaining(self):
+        return len(self.carry) + self.total - self.position + 1
+
+    def advance(self, handed, received, position_end):
+        """New carry/position after the records `handed` to a window, of which `received` (set) came back."""
+        missing = [nr for nr in handed if nr not in received]
+        self.position = min([nr for nr in missing if nr >= self.position], default=position_end)
+        self.carry = [nr for nr in missing if nr < self.position]
+
+
+def load_ctrl_nrs(file_name):
+    """Control Numbers of a get/delete input, no duplicates, in input order."""
+    with open_input(file_name, 'rt') as file:
+        ctrl_nrs = dict.fromkeys(line.strip() for line in file)
+    ctrl_nrs.pop('', None)
+    return list(ctrl_nrs)
+
+
+def index_records(file_name, copy_name, fresh):
+    """MrcOffsetIndex of the records of an add/replace input.
+
+    An uncompressed .mrc is indexed as it is. Compressed and MARCXML inputs
+    cannot be read by offset: they are copied once to the uncompressed
+    .mrc `copy_name`, record by record; a new job (`fresh`) copies again.
+    """
+    if is_plain_file(file_name) and not is_marcxml(file_name):
+        return MrcOffsetIndex(file_name)
+    if fresh or not os.path.exists(copy_name):
+        print(f"Copying the records of {file_name} to {copy_name}...")
+        with open(copy_name + '.tmp', 'wb') as copy:
+            if is_marcxml(file_name):
+                for record in read_marcxml_records(file_name):
+                    copy.write(record + RECORD_TERMINATOR)
+            else:
+                with open_input(file_name, 'rb') as file:
+                    shutil.copyfileobj(file, copy)
+        os.replace(copy_name + '.tmp', copy_name)
+    return MrcOffsetIndex(copy_name)
+
+
+def close_records(index, file_name):
+    """Close the offset index; remove the copy index_records made of a compressed or MARCXML input."""
+    index.close()
+    if index.file_name != file_name:
+        os.remove(index.file_name)
+        os.remove(index.path)
+
+
+def initial_rate(client, throughput):
+    """(records per second, where it comes from) for the projection."""
+    if throughput:
+        return throughput, "--throughput"
+    if client.profile.rate_limit > 0:
+        return client.profile.rate_limit, "RATE_LIMIT of the profile"
+    return client.limiter.max_limit / ASSUMED_LATENCY, f"estimate: {client.limiter.max_limit} in flight, {ASSUMED_LATENCY:.0f}s each"
+
+
+def project(state, windows, budget, rate, now):
+    """(windows needed, completion time) with `budget` requests per window and `rate` records per second.
+
+    Raises ValueError when no record fits in a window: the job would never end.
+    """
+    if budget <= 0 or rate <= 0:
+        raise ValueError(f"No record can be sent: request budget {budget} per window, {rate} records per second")
+    per_record = state.requests / state.done if state.done else 1.0
+    left = state.remaining()
+    count = 1
+    when = now
+    budget_left = budget - state.window_requests if state.window_start == windows.start(now) else budget
+    while True:
+        usable = min(max(budget_left, 0) / per_record, (windows.end(when) - when) * rate)
+        if usable <= 0 and budget_left == budget:
+            raise ValueError(f"No record fits in a quota window of {budget} requests")
+        if left <= usable:
+            return count, when + left / rate
+        left -= usable
+        count += 1
+        when = windows.end(when) + RESET_MARGIN
+        budget_left = budget
+
+
+def print_projection(state, windows, budget, rate, source):
+    count, finish = project(state, windows, budget, rate, time.time())
+    print(f"Records left: {state.remaining()} of {state.total}, request budget per window: {budget}")
+    print(f"Throughput: {rate:.1f} rec/s ({source})")
+    print(f"Projected: {count} window(s), done around {datetime.datetime.fromtimestamp(finish):%Y-%m-%d %H:%M}\n")
+
+
+def wait_until(when, reason):
+    print(f"{reason}: waiting until {datetime.datetime.fromtimestamp(when):%Y-%m-%d %H:%M:%S}...")
+    while time.time() < when:
+        time.sleep(min(when - time.time(), 60))
+
+
+def run_window(client, item, state, budget, window_end, writer):
+    """Send records until the budget or the window is used up, item(nr) giving each one;
+    returns True when the API answered 'API rate limit exceeded' (quota used by someone else too)."""
+    budget_left = budget - state.window_requests
+    per_record = state.requests / state.done if state.done else 1.0
+    new = max(int(budget_left / per_record) - len(state.carry), 0 if state.carry else 1)
+    position_end = min(state.position + new, state.total + 1)
+    handed = state.carry + list(range(state.position, position_end))
+    key = 'ctrl_nr' if state.operation in ('get', 'delete') else 'record'
+
+    client.requests = 0
+    client.request_budget = budget_left
+    client.set_deadline(window_end)
+    base_requests = state.window_requests
+    received = set()
+    started = time.monotonic()
+
+    def checkpoint():
+        state.window_requests = base_requests + client.requests
+        state.save()
+
+    progress = Progress(len(handed), OUTCOMES[state.operation], in_place=sys.stdout.isatty() and not args.verbose).start()
+    client.limiter.on_change = progress.set_limit
+    progress.set_limit(client.limiter.limit)
+    quota_hit = False
+    try:
+        for result in client.run_many({'operation': state.operation, key: item(nr), 'nr': nr} for nr in handed):
+            if result.outcome == 'unsent':
+                continue   # carried to the next window
+            received.add(result.nr)
+            state.counts[result.outcome] = state.counts.get(result.outcome, 0) + 1
+            progress.update(writer.write(result))
+            if len(received) % CHECKPOINT == 0:
+                checkpoint()
+    except RateLimitExceeded as err:
+        print(f"\n{err}")
+        quota_hit = True
+    finally:
+        progress.close()
+        state.advance(handed, received, position_end)
+        state.requests += client.requests
+        state.done += len(received)
+        state.seconds += time.monotonic() - started
+        state.windows += 1
+        checkpoint()
+    return quota_hit
+
+
+def main(file_name):
+    operation = OPERATIONS[args.run]
+    state_file = args.state or f"{input_base_name(file_name)}.{script_name}.{institution}.{operation}.state.json"
+
+    ledger = AddLedger(LEDGER_FILE) if operation == 'add' else None
+    client = LhrClient(inst_symbol, verbose=args.verbose, max_concurrency=args.max_concurrency, ledger=ledger)
+    profile = client.profile
+    quota = args.quota if args.quota is not None else profile.quota
+    if not quota:
+        print(f"\n!ERROR: No quota for {institution}: set {institution}_QUOTA in API_PROFILES.env or use --quota\n\n"
+              f"Exiting program without execution...\n")
+        sys.exit(1)
+    try:
+        budget = quota - parse_limit(args.quota_reserve, quota)
+    except ValueError as err:
+        print(f"\n!ERROR: --quota-reserve: {err}\n\nExiting program without execution...\n")
+        sys.exit(1)
+    if budget <= 0:
+        print(f"\n!ERROR: --quota-reserve {args.quota_reserve} leaves no request of the quota ({quota}) to use\n\n"
+              f"Exiting program without execution...\n")
+        sys.exit(1)
+    if args.throughput is not None and args.throughput <= 0:
+        print(f"\n!ERROR: --throughput must be above 0, not {args.throughput}\n\nExiting program without execution...\n")
+        sys.exit(1)
+    windows = QuotaWindows(args.quota_window or profile.quota_window, args.quota_reset or profile.quota_reset)
+
+    # Control Numbers in memory; records read from their offsets when their window comes
+    index = None
+    if operation in ('get', 'delete'):
+        ctrl_nrs = load_ctrl_nrs(file_name)
+        total, item = len(ctrl_nrs), lambda nr: ctrl_nrs[nr - 1]
+    else:
+        copy_name = f"{os.path.splitext(state_file)[0]}.mrc"
+        index = index_records(file_name, copy_name, fresh=not os.path.exists(state_file))
+        print(f"Offset index {'built' if index.built else 'read'}: {index.path}")
+        total, item = len(index), index.record
+
+    if os.path.exists(state_file):
+        state = JobState.load(state_file)
+        if (state.input_file, state.operation, state.institution, state.total) != (os.path.abspath(file_name), operation, institution, total):
+            print(f"\n!ERROR: State file '{state_file}' belongs to another job\n\nExiting program without execution...\n")
+            sys.exit(1)
+        print(f"Continuing the job of {state_file}: {state.done} record(s) done in {state.windows} window(s)")
+    else:
+        formatted_datetime = datetime.datetime.now().strftime("%y%m%d.%H%M%S")
+        outfile = f"{input_base_name(file_name)}.{script_name}.{institution}.{formatted_datetime}"
+        state = JobState(state_file, input_file=os.path.abspath(file_name), operation=operation,
+                             institution=institution, total=total, outfile=outfile,
+                             records_file=index.file_name if index is not None else None)
+    print(f"Nr. of records found: {total}\n")
+
+    rate, source = initial_rate(client, args.throughput)
+    if state.done and state.seconds:
+        rate, source = state.done / state.seconds, "measured"
+    print_projection(state, windows, budget, rate, source)
+    if args.plan_only:
+        if index is not None:
+            close_records(index, file_name)
+        return
+    state.save()
+
+    writer = ResultWriter(operation, state.outfile, args.compress)
+    try:
+        while state.remaining():
+            now = time.time()
+            if state.window_start != windows.start(now):
+                state.window_start = windows.start(now)
+                state.window_requests = 0
+            window_end = windows.end(now)
+
+            if state.window_requests >= budget:
+                wait_until(window_end + RESET_MARGIN, "Request budget of this window used")
+                continue
+            if window_end - now <= client.deadline_margin:
+                wait_until(window_end + RESET_MARGIN, "Window almost over")
+                continue
+
+            print(f"\n-->Window {state.windows + 1}: {budget - state.window_requests} request(s) left, "
+                  f"until {datetime.datetime.fromtimestamp(window_end):%Y-%m-%d %H:%M}")
+            if run_window(client, item, state, budget, window_end, writer):
+                state.window_requests = budget
+                state.save()
+
+            if state.remaining() and state.seconds:
+                rate, source = state.done / state.seconds, "measured"
+                print_projection(state, windows, budget, rate, source)
+    finally:
+        writer.close()
+
+    if index is not None:
+        close_records(index, file_name)
+
+    per_outcome = "  ".join(f"{outcome} {count}" for outcome, count in state.counts.items())
+    print(f"Job done: {state.done} record(s), {state.requests} request(s) in {state.windows} window(s), "
+          f"sending time {format_duration(state.seconds)} | {per_outcome}")
+    print(f"Outputs: {state.outfile}.*")
+    print(client.summary())
+
+
+if __name__ == '__main__':
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.verbose:
+        print("Verbose mode is ON.\n")
+
+    extensions = ('.txt',) if OPERATIONS[args.run] in ('get', 'delete') else ('.mrc', '.xml')
+    if input_extension(args.input_file) not in extensions:
+        print(f"\n!ERROR: Input file must be {' or '.join(extensions)}\n\nExiting program without execution...\n")
+        sys.exit(1)
+
+    inst_symbol = args.key
+    institution = inst_symbol.upper()
+    print(f"Running script for Institution: {institution}\n")
+
+    # Get the name of the script
+    script_name = os.path.basename(__file__)[:-3]
+
+    main(args.input_file)
+
+    print(f"\n***End of file***")
+    print(f"***End of script***")
@@ -0,0 +1,298 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright (c) 2025 by OCLC
+#
+#  File		    : mdt_misc_lhrreconcile.py
+#  Description	: Minimal set of LHR adds, replaces and deletes from a desired state to the current one
+#  Author(s)	: Elena-Iulia Popa
+#  Creation	    : 19-10-2026
+#
+#  History:
+#  19-10-2026	: popae    : creation
+#           	: Current state from a get run (.mrc) or from the local index of the holdings
+#           	: Records matched on a configurable key, compared without 001/003/005
+#           	: Plan files (ToAdd.mrc, ToReplace.mrc, ToDelete.txt) or --execute through the API
+#
+#  Notes	:
+#           	: Instead of delete all + add all, only what changed is sent:
+#           	:   - desired LHR without a current one with the same key      -> add
+#           	:   - both, but different contents                           -> replace (001/005 of the current LHR)
+#           	:   - current LHR without a desired one with the same key      -> delete
+#           	: The plan files are also the usual inputs of mdt_misc_lhradd.py,
+#           	: mdt_misc_lhrreplace.py and mdt_misc_lhrdelete.py.
+#
+#  SVN ident	: $Id$
+
+# Built-in/Generic Imports
+import os
+import sys
+import argparse
+import collections
+import datetime
+
+from mdt_misc_lhrclient import LhrClient, RateLimitExceeded, LEDGER_FILE, INDEX_FILE
+from mdt_misc_lhrcommon import AddLedger, HoldingsIndex, Progress, ResultWriter, RECORD_TERMINATOR
+from mdt_misc_lhrcommon import read_input_records, input_extension, input_base_name, open_output, output_name
+from mdt_misc_lhrcommon import parse_column_spec, extract_columns, record_fields, record_control_number
+from mdt_misc_lhrcommon import normalized_record_hash, set_control_fields, parse_limit
+
+#============================================================#
+#                   START OF HELP PARSER
+#============================================================#
+parser = argparse.ArgumentParser(
+    description='Compute (and optionally run) the LHR adds, replaces and deletes that turn the current state into the desired one' ,
+    formatter_class=argparse.RawTextHelpFormatter  # # This prevents argparse from reformatting help text
+)
+
+parser._optionals.title = 'Options' #Customize options title if desired
+parser._positionals.title = 'Mandatory arguments' #Customize positionals title if desired
+
+# Positional (mandatory) argument:
+parser.add_argument("-i", "--in", dest="input_file", required=True, help=(
+                                                "Desired state: .mrc or MARCXML .xml with all the LHRs the institution should have\n"
+                                                "(e.g. the nightly export of the ILS; also gzip/zstd compressed).\n"
+                                                "- 001/003/005 of these records are not used.\n"
+ )
+)
+
+parser.add_argument("-k", "--key", required=True, help=(
+                                                "Symbol of the Institution for the WSKey retrieval.\n"
+ )
+)
+
+# Optional arguments
+parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity.')
+
+parser.add_argument("--current", help=(
+                                                "Current state: .mrc or .xml with the LHRs as they are now, with their 001 and 005\n"
+                                                "(e.g. the DownloadedLHRs.mrc of a get run of all Control Numbers).\n"
+                                                "- Default: the LHRs of the Institution in the local index of the holdings\n"
+                                                "  (lhr_index.db, filled by mdt_misc_lhrget.py).\n"
+ )
+)
+
+parser.add_argument("--match", default="004,852$b,876$p", help=(
+                                                "Key matching a desired LHR with a current one: TAG or TAG$code, comma separated\n"
+                                                "(default 004,852$b,876$p: OCLC number, location and barcode).\n"
+                                                "- LHRs with an empty key are left alone and reported.\n"
+ )
+)
+
+parser.add_argument("--execute", action='store_true', help=(
+                                                "Send the replaces, adds and deletes to the API (in that order) instead of\n"
+                                                "only writing the plan files.\n"
+ )
+)
+
+parser.add_argument("--max-delete", dest="max_delete", default="20%", help=(
+                                                "With --execute, highest number (N) or share (P%%) of the current LHRs that may be\n"
+                                                "deleted (default 20%%); above it nothing is sent. Protects against a truncated export.\n"
+                                                "- 0 (or 0%%) allows no delete at all.\n"
+ )
+)
+
+parser.add_argument("-c", "--compress", choices=['gz', 'zst'], help=(
+                                                "Write the .mrc outputs compressed (gzip or zstd).\n"
+ )
+)
+
+parser.add_argument("--max-concurrency", dest="max_concurrency", type=int, help=(
+                                                "Maximum number of requests in flight with --execute (default 8, or the institution profile).\n"
+ )
+)
+
+#============================================================#
+#                   END OF HELP PARSER
+#============================================================#
+
+OPERATIONS = ('replace', 'add', 'delete')   # order of --execute: no holding is ever missing in between
+
+
+def match_key(record, columns):
+    """Values of the match key columns; None when they are all empty."""
+    row = extract_columns(record, columns)
+    key = tuple(row[name] for name, tag, code in columns)
+    return key if any(key) else None
+
+
+def control_field(record, tag):
+    for field_tag, data in record_fields(record):
+        if field_tag == tag:
+            return data.decode('utf-8', 'replace').strip()
+    return None
+
+
+def load_state(records, columns):
+    """Records grouped per match key (input order kept), and those without a key."""
+    by_key = collections.defaultdict(list)
+    no_key = []
+    for record in records:
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        record = record.rstrip(RECORD_TERMINATOR)
+        key = match_key(record, columns)
+        if key is None:
+            no_key.append(record)
+        else:
+            by_key[key].append(record)
+    return by_key, no_key
+
+
+def plan(desired, current):
+    """(to_add, to_replace, to_delete, unchanged): records to add, records to replace
+    (with 001/005 of the current LHR) and Control Numbers to delete.
+
+    LHRs sharing a key are paired in the order of their files; what is left
+    over on either side is added or deleted.
+    """
+    to_add, to_replace, to_delete = [], [], []
+    unchanged = 0
+    for key in list(desired) + [key for key in current if key not in desired]:
+        wanted = desired.get(key, [])
+        present = current.get(key, [])
+        for new, old in zip(wanted, present):
+            if normalized_record_hash(new) == normalized_record_hash(old):
+                unchanged += 1
+            else:
+                to_replace.append(set_control_fields(new, {'001': record_control_number(old),
+                                                           '003': None, '005': control_field(old, '005')}))
+        for new in wanted[len(present):]:
+            to_add.append(set_control_fields(new, {'001': None, '003': None, '005': None}))
+        for old in present[len(wanted):]:
+            to_delete.append(record_control_number(old))
+    return to_add, to_replace, to_delete, unchanged
+
+
+def write_plan(outfile, to_add, to_replace, to_delete, no_key):
+    paths = {}
+    for name, records in (('ToAdd.mrc', to_add), ('ToReplace.mrc', to_replace), ('NoMatchKey.mrc', no_key)):
+        if records:
+            paths[name] = output_name(f"{outfile}.{name}", args.compress)
+            with open_output(paths[name], 'wb') as out:
+                for record in records:
+                    out.write(record + RECORD_TERMINATOR)
+    if to_delete:
+        paths['ToDelete.txt'] = f"{outfile}.ToDelete.txt"
+        with open(paths['ToDelete.txt'], 'w') as out:
+            for ctrl_nr in to_delete:
+                out.write(f"{ctrl_nr}\n")
+    return paths
+
+
+def execute(outfile, to_add, to_replace, to_delete):
+    ledger = AddLedger(LEDGER_FILE)
+    index = HoldingsIndex(INDEX_FILE) if os.path.exists(INDEX_FILE) else None
+    client = LhrClient(inst_symbol, verbose=args.verbose, max_concurrency=args.max_concurrency, ledger=ledger)
+
+    jobs = {'replace': (to_replace, client.replace_many), 'add': (to_add, client.add_many),
+            'delete': (to_delete, client.delete_many)}
+    try:
+        for operation in OPERATIONS:
+            items, many = jobs[operation]
+            if not items:
+                continue
+            print(f"\n-->{operation}: {len(items)} LHR(s)")
+            outcomes = ['success', 'not_found', 'bad_request', 'error', 'unsent', 'failed'] if operation == 'delete' else \
+                       ['success', 'already_added', 'bad_request', 'error', 'unsent', 'failed'] if operation == 'add' else \
+                       ['success', 'bad_request', 'error', 'unsent', 'failed']
+
+            writer = ResultWriter(operation, f"{outfile}.{operation.capitalize()}", args.compress)
+            progress = Progress(len(items), outcomes, in_place=sys.stdout.isatty() and not args.verbose).start()
+            client.limiter.on_change = progress.set_limit
+            progress.set_limit(client.limiter.limit)
+            try:
+                for result in many(items):
+                    if index is not None and result.ok:
+                        if operation == 'delete':
+                            index.remove(institution, result.ctrl_nr)
+                        else:
+                            index.upsert(institution, result.body)
+                    progress.update(writer.write(result))
+            finally:
+                progress.close()
+                writer.close()
+                if index is not None:
+                    index.commit()
+        print(client.summary())
+    finally:
+        if index is not None:
+            index.close()
+
+
+def main(file_name, outfile):
+    columns = parse_column_spec(args.match)
+
+    desired, desired_no_key = load_state(read_input_records(file_name), columns)
+    if args.current:
+        current, current_no_key = load_state(read_input_records(args.current), columns)
+        source = args.current
+    else:
+        if not os.path.exists(INDEX_FILE):
+            print(f"\n!ERROR: No --current file and no local index '{INDEX_FILE}'\n\nExiting program without execution...\n")
+            sys.exit(1)
+        index = HoldingsIndex(INDEX_FILE)
+        current, current_no_key = load_state((record for ctrl_nr, record in index.query(institution)), columns)
+        index.close()
+        source = f"local index {INDEX_FILE}"
+
+    desired_count = sum(len(records) for records in desired.values()) + len(desired_no_key)
+    current_count = sum(len(records) for records in current.values()) + len(current_no_key)
+    print(f"Desired state: {desired_count} LHR(s) in {file_name}")
+    print(f"Current state: {current_count} LHR(s) from {source}")
+
+    to_add, to_replace, to_delete, unchanged = plan(desired, current)
+    no_key = desired_no_key + current_no_key
+    paths = write_plan(outfile, to_add, to_replace, to_delete, no_key)
+
+    print(f"\nUnchanged: {unchanged}  To replace: {len(to_replace)}  To add: {len(to_add)}  To delete: {len(to_delete)}")
+    print(f"API calls: {len(to_replace) + len(to_add) + len(to_delete)} instead of {current_count + desired_count} for delete all + add all")
+    if no_key:
+        print(f"LHRs without match key, left alone: {len(desired_no_key)} desired, {len(current_no_key)} current "
+              f"(see {paths['NoMatchKey.mrc']})")
+    for name, path in paths.items():
+        if name != 'NoMatchKey.mrc':
+            print(f"Plan: {path}")
+
+    if not args.execute:
+        return
+
+    max_delete = parse_limit(args.max_delete, current_count)
+    if len(to_delete) > max_delete:
+        print(f"\n!ERROR: {len(to_delete)} deletes is more than --max-delete {args.max_delete} ({max_delete}) of the current LHRs.\n"
+              f"Check the desired state, or raise --max-delete.\n\nExiting program without execution...\n")
+        sys.exit(1)
+
+    execute(outfile, to_add, to_replace, to_delete)
+
+
+if __name__ == '__main__':
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.verbose:
+        print("Verbose mode is ON.\n")
+
+    for file_name in filter(None, (args.input_file, args.current)):
+        if input_extension(file_name) not in ('.mrc', '.xml'):
+            print(f"\n!ERROR: '{file_name}' must be '.mrc' or '.xml'\n\nExiting program without execution...\n")
+            sys.exit(1)
+
+    inst_symbol = args.key
+    institution = inst_symbol.upper()
+    print(f"Running script for Institution: {institution}\n")
+
+    # Get the name of the script
+    script_name = os.path.basename(__file__)[:-3]
+    formatted_datetime = datetime.datetime.now().strftime("%y%m%d.%H%M%S")
+    outfile = f"{input_base_name(args.input_file)}.{script_name}.{institution}.{formatted_datetime}"
+
+    try:
+        main(args.input_file, outfile)
+    except RateLimitExceeded as err:
+        print(f"{err} Exiting program...\n")
+        sys.exit(0)
+
+    print(f"\n***End of file***")
+    print(f"***End of script***")
@@ -12,44 +12,37 @@
 #  13-01-2026	: popae    : creation
 #           	: When you download an LHR from API it comes with 005
 #           	: To test if needed while LHR replace is used
+#  19-10-2026	: popae    : requests through mdt_misc_lhrclient.LhrClient,
+#           	: no argparse/credentials/session work at import time
+#           	: --max-concurrency: requests in flight adapted by AIMD, limit in the summary
+#           	: Outputs in input order also with concurrent requests (default 8 in flight)
+#           	: Transient failures retried later from a deferred queue, Retry.mrc for the rest
+#           	: MARCXML (.xml) input, streamed and converted record by record
+#           	: --canary N|P%: sample first, report and projection, stop or continue
+#           	: Concurrency, rate limit, timeouts and retries from the institution profile (API_PROFILES.env)
+#           	: --deadline / --record-deadline: run and per record deadlines, Resume file with what was not sent
+#           	: --range START:END / --ctrl-nrs: only a slice of a .mrc file, read through its offset index
+#           	: --processes: the workers get their state from the Pool initializer (fork, spawn or forkserver)
+#           	: --processes: concurrency and rate limit of the institution divided among the workers
+#           	: Options, canary, validation, --range and worker processes shared with mdt_misc_lhradd.py
+#           	: (mdt_misc_lhrscript.RecordScript)
 #
 #  Notes	:
 #
 #  SVN ident	: $Id$
 
 # Built-in/Generic Imports
-import os
-import sys
-
-
-
 import os
 import sys
 import argparse
-import fnmatch
-import threading  # to refresh the token
 import glob
-from requests.exceptions import RetryError  # Import the correct exception
-
-#import yaml
-#import configuration file with API keys
-from dotenv import load_dotenv
-load_dotenv("/home/popae/Scripts/API_KEYS.env")
-
-
-from oauthlib.oauth2 import BackendApplicationClient
-from requests.auth import HTTPBasicAuth
-from requests_oauthlib import OAuth2Session
-import requests
 import datetime
-import sys
-import json
-import re
-import time
-import xml.etree.ElementTree as ET
-from pymarc import MARCReader
-
 
+from mdt_misc_lhrclient import RateLimitExceeded
+from mdt_misc_lhrcommon import CanaryFailed, parse_deadline
+from mdt_misc_lhrcommon import open_input, input_extension, input_base_name, spool_stdin
+from mdt_misc_lhrscript import RecordScript, add_processes_arguments, add_compress_argument, add_canary_arguments
+from mdt_misc_lhrscript import add_concurrency_argument, add_deadline_arguments, add_dry_run_argument
 
 #============================================================#
 #                   START OF HELP PARSER
@@ -66,6 +59,10 @@ parser._positionals.title = 'Mandatory arguments' #Customize positionals title i
 parser.add_argument("-i", "--in", dest="input_file", required=True, help=(
                                                 'Input file to be processed or "file_pattern".\n'
                                                 '- "file_pattern" requires double quotes.\n'
+                                                '- gzip/zstd compressed files (.mrc.gz, .mrc.zst) are read directly.\n'
+                                                '- MARCXML collections (.xml, .xml.gz, ...) are streamed: every record is\n'
+                                                '  converted to MARC when it is sent, memory use does not grow with the file.\n'
+                                                '- "-" reads the input from stdin.\n'
                                                 "- Input file is an mrc file with LHRs to be replaced.\n"
                                                 "- 001 field must be present, otherwise it creates a new LHR.\n"
                                                 "- 005 field must be present, otherwise it gives an error. Thus first get LHRs from API and then replace them.\n"
@@ -77,6 +74,7 @@ parser.add_argument("-k", "--key", required=True, help=(
  )
 )
 
+
 parser.add_argument("-r", "--run", nargs="?", required=True, choices=['u'], help=(
                                                 "'[u]pdate'.\n"
  )
@@ -85,298 +83,156 @@ parser.add_argument("-r", "--run", nargs="?", required=True, choices=['u'], help
 # Optional arguments
 parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity; use as argumnet AFTER the input file.')
 
-# Parse the arguments
-args = parser.parse_args()
+add_processes_arguments(parser)
 
-#============================================================#
-#                   END OF HELP PARSER
-#============================================================#
-
-
-if args.verbose:
-    print("Verbose mode is ON.\n")
-
-# Ensure input_file is provided if -morehelp is not used
-if args.input_file is None:
-    parser.error("The following arguments are required: input_file. Type -h or --help or -morehelp for more information")
-
-input_arg = args.input_file
-
-
-# serviceURL = config.get('metadata_service_url')
-serviceURL = 'https://metadata.api.oclc.org/worldcat'
-
-# Scope
-#scope = ['WorldCatMetadataAPI:manage_bibs', 'WorldCatMetadataAPI:view_brief_bib']
-scope = ['WorldCatMetadataAPI:manage_institution_lhrs']
+parser.add_argument("--ctrl-nrs", dest="ctrl_nrs", help=(
+                                                "Only the records whose 001 is in this .txt file (one Control Number per line),\n"
+                                                "found through the offset index as with --range.\n"
+                                                "- Control Numbers not in the input go to {outfile}.CtrlNrsNotFound.txt\n"
+ )
+)
 
-def load_oauth_credentials(inst_symbol: str):
-    prefix = inst_symbol.upper()
+add_compress_argument(parser, "ReplacedLHRs.mrc")
 
-    client_id = os.getenv(f"{prefix}_CLIENT_ID")
-    #print(f"Client ID: {client_id}\n")
+parser.add_argument("--validate", action='store_true', help=(
+                                                "Check the input locally before any API call (in parallel over all cores).\n"
+                                                "- Truncated records, bad leaders/directories and records with no 001 or 005 field\n"
+                                                "  are written to {outfile}.Rejected.mrc (reasons in {outfile}.Rejected.txt)\n"
+                                                "  and are not sent to the API.\n"
+ )
+)
 
-    client_secret = os.getenv(f"{prefix}_CLIENT_SECRET")
-    #print(f"Client Secret: {client_secret}\n")
+add_canary_arguments(parser)
 
+add_concurrency_argument(parser)
 
-    if not all([client_id, client_secret]):
-        raise ValueError(f"Missing credentials for user '{inst_symbol}'")
+add_deadline_arguments(parser, "Resume.mrc")
 
-    return {
-        "client_id": client_id,
-        "client_secret": client_secret,
-    }
+add_dry_run_argument(parser)
 
-inst_symbol = args.key
-institution = inst_symbol.upper()
-print(f"Running script for Institution: {institution}\n")
+#============================================================#
+#                   END OF HELP PARSER
+#============================================================#
 
-creds = load_oauth_credentials(inst_symbol)
+class ReplaceScript(RecordScript):
+    operation = 'replace'
+    outcomes = ['success', 'bad_request', 'error', 'unsent', 'failed']
+    validate_tags = {'required_tags': ('001', '005')}
+    selection_options = '--range / --ctrl-nrs'
+
+    def selecting(self):
+        return bool(self.args.range or self.args.ctrl_nrs)
+
+    def selected_nrs(self, index, outfile):
+        """Record nrs of --range, or of the Control Numbers of --ctrl-nrs."""
+        if self.args.range:
+            return super().selected_nrs(index, outfile)
+
+        with open_input(self.args.ctrl_nrs, 'rt') as file:
+            nrs, missing = index.nrs_of(line.strip() for line in file if line.strip())
+        if missing:
+            with open(f"{outfile}.CtrlNrsNotFound.txt", 'w') as out:
+                for ctrl_nr in missing:
+                    out.write(f"{ctrl_nr}\n")
+            print(f"Control Numbers not in the input: {len(missing)}, see {outfile}.CtrlNrsNotFound.txt")
+        return nrs
+
+    def print_outcome(self, result):
+        print(f"Ctrl nr: {result.ctrl_nr}")
+        if result.outcome == 'success':
+            print(f"LHR Replaced Successfully: {result.nr}\n")
+        else:
+            super().print_outcome(result)
 
-auth = HTTPBasicAuth(creds["client_id"], creds["client_secret"])
-client = BackendApplicationClient(client_id=creds["client_id"], scope=scope)
 
+if __name__ == '__main__':
 
-wskey = OAuth2Session(client=client)
+    # Parse the arguments
+    args = parser.parse_args()
 
-token = None
-max_retries = 3
-timeout_token = 50
-timeout_request = 50   #default timeout for the API
-max_retries = 10
-retry_delay = 3
+    if args.verbose:
+        print("Verbose mode is ON.\n")
 
-is_first_line = True
+    # Ensure input_file is provided if -morehelp is not used
+    if args.input_file is None:
+        parser.error("The following arguments are required: input_file. Type -h or --help or -morehelp for more information")
 
+    inst_symbol = args.key
+    institution = inst_symbol.upper()
+    print(f"Running script for Institution: {institution}\n")
 
-def main(file_name):
-    
-    token = fetch_token()
-    if token is None:
-        print("Fetching token in failed")
-    else:
-        if args.verbose:
-            print("Token in main fetched")
-    
-    with open(file_name, 'rb') as file:
-        data_in_file = file.read()
-
-    records = data_in_file.split(b'\x1D') # GS split -but it stores the last record as an empty string
-
-    #Check if last record is empty
-    if records[-1].strip() == b'': 
-        records = records[:-1] #Exclude the last empty record
-        records_count = len(records)
-        print(f"Nr. of records found: {records_count}")
-    else:
-        records_count = len(records)
-        print(f"Nr. of records found: {records_count}")
-
-
-    nr = 0
-    for record in records:
-        raw = record + b"\x1D"
-        record_obj = next(MARCReader(raw))
-        ctrl_nr = record_obj["001"].value()
-        print(f"Ctrl nr: {ctrl_nr}")
-        #input("Press Enter to continue...")
-        nr += 1
-               
-        process_record(record, ctrl_nr, nr)
-    
-def process_record(record, ctrl_nr, nr):    
-    #print("I am here 1")
-    try:
-        def request_data(record, ctrl_nr):
-            r = wskey.put(serviceURL + f"/manage/lhrs/{ctrl_nr}", data=record, headers={"Accept": "application/marc", "Content-Type":"application/marc"})
-            r.raise_for_status
-            result = r.content
-            result = result.decode("UTF-8")
-
-            #print(f"{result}\n")
-            #input("Press Enter to continue...")
-
-            return result
-            
-            # How an error result looks like:
-            # xml or json
-            """
-            {
-                "type": "NOT_ACCEPTABLE",
-                "title": "Invalid 'Accept' header.",
-                "detail": "A request with an invalid 'Accept' header was attempted: ...."
-            }
-            """
-
-            # How a good result looks:
-            #mrc binary file
-            """
-             00260nx  a2200121zi 4500001001000000004000700010005001700017007000300034008003300037852002900070876001100099538002800110\u001E227503625....\u001E\u001D      
-            """
-        #================ DEF FOR API ===============================>                    
-        
-        with open(output6, 'a') as out6, open(output1, 'a') as out1, open(output2, 'a') as out2:
-            processed = False
-            for attempt in range(max_retries): 
-                try:
-                    # Send the record to the API Request
-                    result = request_data(record, ctrl_nr)
-                    
-                    # Process the response from the API
-                    if 'API rate limit exceeded' in result:
-                        print(f"API rate limit exceeded.Exiting program...\n")
-                        sys.exit(0)
-                    
-                    elif (
-                            'API Key or Authorization header is required' in result or 
-                            '<!DOCTYPE html>' in result or  
-                            '<head><title>502 Bad Gateway</title></head>' in result
-                         ):
-
-                        out6.write(f"Attempt {attempt+1} - Error :\n{result}\n")
-                        out6.flush()
-                        
-                        print(f'Error encountered:\n***{result}***')
-                        print(f'Retrying request\n')
-                        
-                        # Refresh token and try again
-                        fetch_token()
-                        #result = request_data(ctrl_nr) This only sends to function, does not check for error again, it assume succes
-                        continue  # Go to next attempt to retry
-                            
-                            
-                    # If no error found, proceed                                
-                    
-                    #mcrc returned - thus good
-                    if '\x1E' in result:
-                        out1.write(f"{result}")
-                        print(f"LHR Replaced Successfully: {nr}\n")
-
-                    # bad requests go in a different file because of xml
-                    elif '<type>BAD_REQUEST</type>' in result:
-                        print(f"Bad Request\n")
-                        out2.write(f"{result}") # Bad request xml response
-                                   
-                    # Any other errors that are not caputred above in the log.
-                    # No retrying as the problem is not related to the request but to the record itself or the request is not valid.
-                    else:
-                        print(f"Went wrong.\n")
-                        out6.write(f"{result}") # 
-
-
-                    processed = True
-                    break  # Exit retry loop and move to next record
-                    #return result
-
-                except RetryError:
-                    #print(f"-->Retry failed after {max_retries} attempts.")
-                    error_msg = f"--> Retry failed after {max_retries} attempts for record nr {nr}.\n"
-                    print(error_msg)
-                    #out6.write(f"Retry failed after {max_retries} attempts for ID: {identifier}.\n")
-                    out6.write(error_msg)
-                    out6.flush()
-                    processed = True
-                    break  # Exit retry loop and move to next record
-                    
-                    
-                
-                except requests.exceptions.HTTPError as err:
-                    print("HTTP Error:")
-                    print(err)
-                        
-            if not processed:
-                print(f"Giving up on record nr {nr}. Moving to next record.\n")
-            #return None  # Return a value indicating failure so the calling code can skip
-
-    except BaseException as err:
-        print("Base Exception error:")
-        print(err)
-
-def fetch_token():
-    global token
-    
-    for attempt in range(max_retries):
+    deadline = None
+    if args.deadline:
         try:
-            token = wskey.fetch_token(token_url='https://oauth.oclc.org/token', auth=auth, timeout=timeout_token)
-            current_datetime = datetime.datetime.now()
-            formatted_datetime_token = current_datetime.strftime("%H:%M:%S")
-            if args.verbose:
-                print(f"Fetched new token at {formatted_datetime_token}: {token}\n")
-                print("----------------------------------------------------------------------------------------------------\n")
-            return token
-        except requests.exceptions.Timeout:
-            print(f"Token request timed out for {institution}, retrying in 3 seconds... ({attempt + 1}/{max_retries})")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                print("Max retries reached for token request.")
-                return None
-        
-        except Exception as e:
-            print(f"Error fetching token for {institution}: {e}")
-            return None
-        
-def token_refresher():
-    if args.verbose:
-        print("Fetching token for the first time...")
-    while True:
-        #time.sleep(10) # Sleep for 30 seconds
-        time.sleep(18 * 60) # Sleep for 18 minutes
-        if args.verbose:
-            print("Token refresh!")
-        fetch_token()
-        if args.verbose:
-            print("Refreshed token!")
+            deadline = parse_deadline(args.deadline)
+        except ValueError as err:
+            print(f"\n!ERROR: {err}\n\nExiting program without execution...\n")
+            sys.exit(1)
 
+    # One session for all input files; the token is fetched on first use and refreshed before it expires
+    script = ReplaceScript(args, deadline)
+    client = script.client = script.new_client()
+    if args.verbose:
+        print(f"Profile of {institution}: {client.profile}\n")
 
-if __name__ == '__main__':
-    
     # Get the name of the script
     script_name = os.path.basename(__file__)[:-3]
 
     # Get the current date
     current_datetime = datetime.datetime.now()
     formatted_datetime = current_datetime.strftime("%y%m%d.%H%M%S")
-    
-    # Token refresher call
-    token_thread = threading.Thread(target=token_refresher, daemon=True)
-    token_thread.start()
-    
-    
+
+
     # Use glob to expand the wildcard pattern
-    file_list = glob.glob(args.input_file)
-    
+    if args.input_file == '-':
+        file_list = [spool_stdin()]
+    else:
+        file_list = glob.glob(args.input_file)
+
     # Check if files were found
     if not file_list:
         raise FileNotFoundError(f"No files found matching the pattern: {args.input_file}")
         sys.exit(1)
-            
-    
+
+
+    if args.range and args.ctrl_nrs:
+        print(f"\n!ERROR: Use --range or --ctrl-nrs, not both\n\nExiting program without execution...\n")
+        sys.exit(1)
+    if (args.range or args.ctrl_nrs) and args.canary:
+        print(f"\n!ERROR: --canary cannot be combined with --range / --ctrl-nrs\n\nExiting program without execution...\n")
+        sys.exit(1)
+
     if args.run == 'u':
-        if all(os.path.splitext(file)[1] == '.mrc' for file in file_list):
-            print(f"\n***Format file approved '.mrc'\n")
+        if args.input_file == '-' or all(input_extension(file) in ('.mrc', '.xml') for file in file_list):
+            print(f"\n***Format file approved '.mrc' / '.xml'\n")
         else:
-            print(f"\n!ERROR: All input files must be '.mrc'\n\nExiting program without execution...\n")
+            print(f"\n!ERROR: All input files must be '.mrc' or '.xml'\n\nExiting program without execution...\n")
             sys.exit(1)
-    
 
-    # Select function to execute based on the second argument             
-    if args.run == 'u':        
-        # Process each file found 
+
+    # Select function to execute based on the second argument
+    if args.run == 'u':
+        # Process each file found
         for file_name in file_list:
             print("\n==================================================")
             print(f"-->Input file processed: {file_name}\n")
 
             # Output file paths
-            base_name = os.path.splitext(os.path.basename(file_name))[0]
+            base_name = input_base_name(file_name)
             outfile=f"{base_name}.{script_name}.{institution}.{formatted_datetime}"
-            output1=f"{outfile}.ReplacedLHRs.mrc"
-            output2=f"{outfile}.BadRequest.xml"
-            output6=f"{outfile}.LOG.txt"
 
-            main(file_name)
+            try:
+                script.main(file_name, outfile)
+            except RateLimitExceeded as err:
+                print(f"{err} Exiting program...\n")
+                sys.exit(0)
+            except CanaryFailed as err:
+                print(f"\n{err} Exiting program...\n")
+                sys.exit(1)
+
+
+    if client.unsent:
+        print(f"\nRun deadline reached: {client.unsent} record(s) not sent, see the Resume.mrc file(s) to continue")
 
-      
     print(f"\n***End of file***")
     print(f"***End of script***")
@@ -0,0 +1,574 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Copyright (c) 2025 by OCLC
+#
+#  File		    : mdt_misc_lhrscript.py
+#  Description	: Steps and options shared by mdt_misc_lhrget/delete.py (Control Numbers)
+#           	: and mdt_misc_lhradd/replace.py (LHRs in .mrc/MARCXML)
+#  Author(s)	: Elena-Iulia Popa
+#  Creation	    : 19-10-2026
+#
+#  History:
+#  19-10-2026	: popae    : creation
+#           	: Options, canary, validation, --range and worker processes of the four scripts in one place
+#
+#  Notes	:
+#           	: A script subclasses CtrlNrScript or RecordScript with its operation, outcomes and
+#           	: messages, and keeps its own parser, input checks and client settings.
+#
+#  SVN ident	: $Id$
+
+# Built-in/Generic Imports
+import os
+import sys
+import multiprocessing  # to shard big files over worker processes
+
+from mdt_misc_lhrclient import LhrClient, RateLimitExceeded
+from mdt_misc_lhrcommon import CanaryReport, CanaryFailed, canary_sample, parse_canary_size, parse_canary_max, DEFAULT_CANARY_MAX
+from mdt_misc_lhrcommon import mrc_byte_ranges, read_mrc_range, merge_part_outputs, output_paths
+from mdt_misc_lhrcommon import validate_mrc_file, validate_ctrl_nr_file, count_records, Progress, ResultWriter, MrcOffsetIndex
+from mdt_misc_lhrcommon import open_input, input_extension, is_plain_file, error_log_keys
+from mdt_misc_lhrcommon import read_mrc_records, is_marcxml, read_marcxml_records, read_input_records
+
+
+#================ OPTIONS ===============================>
+def add_processes_arguments(parser):
+    """-p/--processes and --range of the .mrc scripts."""
+    parser.add_argument("-p", "--processes", type=int, default=1, help=(
+                                                "Number of worker processes the input file is split over (default 1).\n"
+                                                "- The file is cut in record aligned ranges, one per worker.\n"
+                                                "- Outputs of the workers are merged in the usual output files at the end.\n"
+                                                "- The workers share the concurrency and rate limit of the institution: each\n"
+                                                "  gets 1/N of them, so N workers send no faster than one process would.\n"
+     )
+    )
+
+    parser.add_argument("--range", help=(
+                                                "Only the records START to END of the input (1 based, both included),\n"
+                                                "e.g. 1250000: to restart from record 1,250,000 or 2000001:3000000 for another box.\n"
+                                                "- The record nrs in the outputs stay those of the whole file.\n"
+                                                "- Needs an uncompressed .mrc file: its offset index (<file>.offsets) is built in\n"
+                                                "  one pass the first time and the records are read directly from their offsets.\n"
+     )
+    )
+
+
+def add_compress_argument(parser, output):
+    parser.add_argument("-c", "--compress", choices=['gz', 'zst'], help=(
+                                                f"Write the {output} output compressed (gzip or zstd).\n"
+     )
+    )
+
+
+def add_canary_arguments(parser):
+    parser.add_argument("--canary", help=(
+                                                "Process a sample first: N records or P%% of the input (e.g. 200 or 1%%).\n"
+                                                "- Outcomes, latency and throughput of the sample are reported with the\n"
+                                                "  projected duration and number of requests of the full run.\n"
+                                                "- Within the --canary-max limits the full run follows automatically,\n"
+                                                "  otherwise the script stops. Sample outputs go to {outfile}.Canary.*\n"
+     )
+    )
+
+    parser.add_argument("--canary-sample", dest="canary_sample", choices=['stratified', 'random'], default='stratified', help=(
+                                                "How the canary records are picked (default stratified: spread over the whole file).\n"
+     )
+    )
+
+    parser.add_argument("--canary-max", dest="canary_max", default=DEFAULT_CANARY_MAX, help=(
+                                                "Highest share per outcome before the run is stopped, as outcome=rate,...\n"
+                                                f"- Default: {DEFAULT_CANARY_MAX}\n"
+     )
+    )
+
+    parser.add_argument("--canary-only", dest="canary_only", action='store_true', help=(
+                                                "Stop after the canary report, also when it is within its limits.\n"
+     )
+    )
+
+
+def add_concurrency_argument(parser):
+    parser.add_argument("--max-concurrency", dest="max_concurrency", type=int, help=(
+                                                "Maximum number of requests in flight (default 8; 1 = one at a time).\n"
+                                                "- Default from <SYMBOL>_MAX_CONCURRENCY in API_PROFILES.env when set.\n"
+                                                "- Starts at 1 and goes up while the API answers fast and well,\n"
+                                                "  halves on 'API rate limit exceeded', 502 errors, timeouts or slow answers.\n"
+                                                "- The current limit is shown on the progress line and in the summary.\n"
+                                                "- The output files keep the order of the input file.\n"
+     )
+    )
+
+
+def add_deadline_arguments(parser, resume_file):
+    """--deadline and --record-deadline; `resume_file` is the output with the records not sent."""
+    parser.add_argument("--deadline", help=(
+                                                "Time by which the run must be over: HH:MM, \"YYYY-MM-DD HH:MM\" or +N[s|m|h] (e.g. +90m).\n"
+                                                "- Close to it (DEADLINE_MARGIN of the profile, default 10s) no new request is sent;\n"
+                                                "  the requests in flight are awaited and the records not sent go to\n"
+                                                f"  {{outfile}}.{resume_file}, the input of the next run.\n"
+     )
+    )
+
+    parser.add_argument("--record-deadline", dest="record_deadline", type=float, help=(
+                                                "Seconds a record may take over all its attempts and waits (default: no limit,\n"
+                                                "or <SYMBOL>_RECORD_DEADLINE of API_PROFILES.env); past it the record goes to Retry.\n"
+     )
+    )
+
+
+def add_dry_run_argument(parser):
+    parser.add_argument("--dry-run", dest="dry_run", action='store_true', help=(
+                                                "Only validate the input (see --validate); no API call is made.\n"
+     )
+    )
+
+
+#================ SCRIPTS ===============================>
+class LhrScript:
+    """One run of an LHR script: its options (`args`), its client and the
+    outcomes of its operation. Subclasses set `operation` and `outcomes`."""
+
+    operation = None
+    outcomes = None
+
+    def __init__(self, args, client=None):
+        self.args = args
+        self.client = client
+
+    def send_many(self, items, **kwargs):
+        return getattr(self.client, f"{self.operation}_many")(items, **kwargs)
+
+    def start_progress(self, total):
+        """One progress line instead of a print per record (unless --verbose), with the limit of the client."""
+        progress = Progress(total, self.outcomes, in_place=sys.stdout.isatty() and not self.args.verbose).start()
+        self.client.limiter.on_change = progress.set_limit
+        progress.set_limit(self.client.limiter.limit)
+        return progress
+
+    def canary_verdict(self, report):
+        """Report of the canary; False when the script stops here (--canary-only).
+        Raises CanaryFailed when the sample is over a threshold."""
+        limits = parse_canary_max(self.args.canary_max)
+        report.print_report(limits, self.client.limiter.limit)
+        reasons = report.check(limits)
+        if reasons:
+            raise CanaryFailed(f"Canary over its limits ({', '.join(reasons)}): the full run is not started.")
+        if self.args.canary_only:
+            print("Canary within its limits; --canary-only: stopping here.\n")
+            return False
+        print("Canary within its limits: continuing with the full run.\n")
+        return True
+
+
+class CtrlNrScript(LhrScript):
+    """Run over .txt files of Control Numbers (get, delete). Control Numbers
+    already requested for an earlier input file of the run come from the
+    run registry. Hooks: open_sender / close_sender around the requests of a
+    file, keep(result) for every result (local index, extra outputs)."""
+
+    outcomes = ['success', 'not_found', 'bad_request', 'error', 'unsent', 'failed']
+
+    def __init__(self, args, client, institution, registry, index=None):
+        super().__init__(args, client)
+        self.institution = institution
+        self.registry = registry
+        self.index = index
+
+    def open_sender(self, outfile, canary=False):
+        """The *_many function the Control Numbers of `outfile` go through."""
+        return getattr(self.client, f"{self.operation}_many")
+
+    def close_sender(self):
+        pass
+
+    def keep(self, result):
+        pass
+
+    def main(self, file_name, outfile):
+
+        # Error log of an earlier run: the Control Numbers that did not make it
+        if input_extension(file_name) == '.jsonl':
+            ctrl_nrs = dict.fromkeys(error_log_keys(file_name))
+            print(f"Control Numbers in error in {file_name}: {len(ctrl_nrs)}")
+            self.run_ctrl_nrs(ctrl_nrs, outfile, file_name)
+            return
+
+        # Local check of the input first, so rejected records cost no API call
+        rejected = set()
+        if self.args.validate or self.args.dry_run:
+            rejected = self.validate_input(file_name, outfile)
+            if self.args.dry_run:
+                return
+
+        with open_input(file_name, 'rt') as file:
+            ctrl_nrs = dict.fromkeys(line.strip() for line in file)   # no duplicates, input order kept
+        ctrl_nrs.pop('', None)   # blank lines
+
+        if rejected:
+            for value in rejected:
+                ctrl_nrs.pop(value, None)
+            print(f"Nr. of rejected Control Numbers skipped: {len(rejected)}")
+
+        self.run_ctrl_nrs(ctrl_nrs, outfile, file_name)
+
+    def run_ctrl_nrs(self, ctrl_nrs, outfile, file_name):
+        if self.args.canary:
+            ctrl_nrs = self.run_canary(list(ctrl_nrs), outfile, file_name)
+            if ctrl_nrs is None:
+                return
+
+        records_count = len(ctrl_nrs)
+        print(f"Nr. of records found: {records_count}")
+
+        writer = ResultWriter(self.operation, outfile, self.args.compress)
+        progress = self.start_progress(records_count)
+        coalesced = []
+        try:
+            # Control Numbers of an earlier input file of this run: its result again, no request
+            for result, first_file in self.registry.coalesce(ctrl_nrs, self.open_sender(outfile), file_name):
+                if first_file is not None:
+                    coalesced.append((result.ctrl_nr, first_file))
+                progress.update(self.process_record(result, writer))
+        finally:
+            progress.close()
+            writer.close()
+            self.close_sender()
+            self.write_coalesced(outfile, coalesced)
+            if self.index is not None:
+                self.index.commit()
+            print(self.client.summary())
+
+    def run_canary(self, ctrl_nrs, outfile, file_name):
+        """Sample of the Control Numbers through the usual process_record; returns the others,
+        or None to stop here. Raises CanaryFailed when the sample is over a threshold."""
+        size = parse_canary_size(self.args.canary, len(ctrl_nrs))
+        picks = canary_sample(len(ctrl_nrs), size, self.args.canary_sample)
+        sample = [ctrl_nrs[i] for i in sorted(picks)]
+        print(f"Canary: {len(sample)} Control Numbers first, outputs in {outfile}.Canary.*")
+
+        report = CanaryReport(self.operation, len(sample), len(ctrl_nrs), self.args.canary_sample)
+        writer = ResultWriter(self.operation, f"{outfile}.Canary", self.args.compress)
+        coalesced = []
+        try:
+            for result, first_file in self.registry.coalesce(sample, self.open_sender(f"{outfile}.Canary", canary=True), file_name):
+                if first_file is not None:
+                    coalesced.append((result.ctrl_nr, first_file))
+                self.process_record(result, writer)
+                report.add(result)
+        finally:
+            writer.close()
+            self.close_sender()
+            report.close()
+            self.write_coalesced(f"{outfile}.Canary", coalesced)
+            if self.index is not None:
+                self.index.commit()
+
+        if not self.canary_verdict(report):
+            return None
+        return [ctrl_nr for i, ctrl_nr in enumerate(ctrl_nrs) if i not in picks]
+
+    def write_coalesced(self, outfile, coalesced):
+        """{outfile}.Coalesced.txt: Control Numbers already requested for an earlier input file."""
+        if not coalesced:
+            return
+        with open(f"{outfile}.Coalesced.txt", 'w') as out:
+            for ctrl_nr, first_file in coalesced:
+                out.write(f"{ctrl_nr}|{first_file}\n")
+        print(f"Already requested for an earlier input file (not sent again): {len(coalesced)}, see {outfile}.Coalesced.txt")
+
+    def validate_input(self, file_name, outfile):
+        rejects = validate_ctrl_nr_file(file_name)
+
+        if rejects:
+            with open(f"{outfile}.Rejected.txt", 'w') as out7:
+                for line_nr, value, reason in rejects:
+                    out7.write(f"Line {line_nr}: {value}|{reason}\n")
+
+        print(f"Validation of {file_name}: {len(rejects)} rejected line(s)\n")
+        return set(value for line_nr, value, reason in rejects)
+
+    def process_record(self, result, writer):
+        ctrl_nr = result.ctrl_nr
+
+        if self.args.verbose:
+            for attempt, body in result.errors:
+                print(f'Error encountered for Control Number: {ctrl_nr}:\n***{body}***')
+                print(f'Retrying request for Control Number: {ctrl_nr}\n')
+
+            if result.outcome == 'success':
+                print(f"Success for Control Number: {ctrl_nr}\n")
+            elif result.outcome == 'bad_request':
+                print(f"Bad Request for Control Number: {ctrl_nr}\n")
+            elif result.outcome == 'not_found':
+                print(f"Not Found for Control Number: {ctrl_nr}\n")
+            elif result.outcome == 'unsent':
+                print(f"Run deadline: Control Number: {ctrl_nr} not sent, left for the Resume file\n")
+            elif result.outcome == 'failed':
+                print(f"Giving up on Control Number: {ctrl_nr}. Moving to next record.\n")
+            else:
+                print(f"Went wrong for Control Number: {ctrl_nr}\n")
+
+        self.keep(result)
+        return writer.write(result)
+
+
+class RecordScript(LhrScript):
+    """Run over .mrc or MARCXML files of LHRs (add, replace): local validation,
+    canary, --range through the offset index and --processes workers, which
+    get this object (without its client) through the Pool initializer.
+    Subclasses set `validate_tags` (arguments of validate_mrc_file) and
+    print_outcome, and may give the client a ledger."""
+
+    validate_tags = {}
+    selection_options = '--range'
+
+    def __init__(self, args, deadline=None):
+        super().__init__(args)
+        self.deadline = deadline   # run deadline (time.time() value), see --deadline
+        self.rejected = set()      # record nrs rejected by the local validation
+        self.skip = set()          # record nrs not to send: rejected, or done by the canary
+        self.progress = None
+
+    def __getstate__(self):
+        # Handed to a worker process (Pool initargs), which makes its own client
+        state = self.__dict__.copy()
+        state['client'] = None
+        return state
+
+    def ledger(self):
+        return None
+
+    def new_client(self, workers=1):
+        """LhrClient with the options of the command line; in one of `workers` processes
+        it gets its share of the concurrency and rate limit of the institution."""
+        client = LhrClient(self.args.key, verbose=self.args.verbose, max_concurrency=self.args.max_concurrency,
+                           ledger=self.ledger(), workers=workers)
+        if self.args.record_deadline is not None:
+            client.record_deadline = self.args.record_deadline
+        client.set_deadline(self.deadline)
+        return client
+
+    def selecting(self):
+        return bool(self.args.range)
+
+    def selected_nrs(self, index, outfile):
+        """Record nrs of --range, or None after an error."""
+        try:
+            return list(index.parse_range(self.args.range))
+        except ValueError as err:
+            print(f"\n!ERROR: {err}\n")
+            return None
+
+    def main(self, file_name, outfile):
+
+        # Local check of the input first, so rejected records cost no API call
+        self.rejected = set()
+        if self.args.validate or self.args.dry_run:
+            self.rejected = self.validate_input(file_name, outfile)
+            if self.args.dry_run:
+                return
+
+        self.skip = set(self.rejected)
+        if self.args.canary:
+            canary_nrs = self.run_canary(file_name, outfile)
+            if canary_nrs is None:
+                return
+            self.skip |= canary_nrs
+
+        if self.selecting():
+            self.main_selection(file_name, outfile)
+            return
+
+        if self.args.processes > 1 and (not is_plain_file(file_name) or is_marcxml(file_name)):
+            print("Compressed or MARCXML input: --processes needs byte ranges of an uncompressed .mrc file, running in one process.")
+        elif self.args.processes > 1:
+            self.main_sharded(file_name, outfile)
+            return
+
+        if is_marcxml(file_name):
+            # Streamed: each record is converted when its turn comes, the count is known at the end
+            records = read_marcxml_records(file_name)
+            records_count = None
+            print(f"MARCXML input: records are converted while they are sent")
+        else:
+            records = read_mrc_records(file_name)
+            records_count = len(records)
+            print(f"Nr. of records found: {records_count}")
+
+        if self.rejected:
+            print(f"Nr. of rejected records skipped: {len(self.rejected)}")
+
+        writer = ResultWriter(self.operation, outfile, self.args.compress)
+        self.progress = self.start_progress(records_count - len(self.skip) if records_count is not None else None)
+        try:
+            for result in self.send_many(records, skip=self.skip):
+                self.progress.update(self.process_record(result, writer))
+        finally:
+            self.progress.close()
+            writer.close()
+            if records_count is None:
+                print(f"Nr. of records found: {self.progress.done() + len(self.skip)}")
+            print(self.client.summary())
+
+    def main_selection(self, file_name, outfile):
+        """--range (and the like): only the selected records, read from their offsets."""
+        if not is_plain_file(file_name) or is_marcxml(file_name):
+            print(f"\n!ERROR: {self.selection_options}: the input must be an uncompressed .mrc file: '{file_name}'\n")
+            return
+        if self.args.processes > 1:
+            print(f"{self.selection_options}: running in one process.")
+
+        index = MrcOffsetIndex(file_name)
+        print(f"Offset index {'built' if index.built else 'read'}: {len(index)} records in {index.path}")
+        try:
+            nrs = self.selected_nrs(index, outfile)
+            if nrs is None:
+                return
+            nrs = [nr for nr in nrs if nr not in self.skip]
+            print(f"Nr. of records selected: {len(nrs)}")
+
+            writer = ResultWriter(self.operation, outfile, self.args.compress)
+            self.progress = self.start_progress(len(nrs))
+            try:
+                for result in self.send_many(index.records(nrs), nrs=nrs):
+                    self.progress.update(self.process_record(result, writer))
+            finally:
+                self.progress.close()
+                writer.close()
+                print(self.client.summary())
+        finally:
+            index.close()
+
+    def main_sharded(self, file_name, outfile):
+        ranges = mrc_byte_ranges(file_name, self.args.processes)
+        print(f"Nr. of worker processes: {len(ranges)}")
+
+        # Counters in shared memory, updated by the workers and shown by this process
+        records_count = count_records(file_name, 0, os.path.getsize(file_name))
+        self.progress = Progress(records_count - len(self.skip), self.outcomes, in_place=sys.stdout.isatty() and not self.args.verbose,
+                                 workers=len(ranges)).start()
+
+        # One token for all workers: whoever refreshes it first shares it with the others
+        manager = multiprocessing.Manager()
+        self.client.ensure_token()
+        self.client.share_token(manager.dict(), manager.Lock())
+
+        # The workers get their state from init_worker, so they also run when spawned instead of forked;
+        # one range per process, so the counters of a worker are those of its range
+        initargs = (self, self.client.shared_token, self.client.shared_lock, len(ranges))
+        with multiprocessing.Pool(processes=len(ranges), initializer=init_worker, initargs=initargs, maxtasksperchild=1) as pool:
+            results = pool.starmap(shard_worker, [(file_name, outfile, index, start, end, first_nr)
+                                                  for index, (start, end, first_nr) in enumerate(ranges)])
+
+        self.progress.close()
+        print(f"Nr. of records found: {sum(count for count, rate_limited, unsent, limits in results)}")
+        for index, (count, rate_limited, unsent, limits) in enumerate(results):
+            print(f"Worker {index}: {limits}")
+        self.client.unsent += sum(unsent for count, rate_limited, unsent, limits in results)
+        merge_part_outputs(output_paths(self.operation, outfile, self.args.compress).values(), len(ranges))
+
+        self.client.share_token(None, None)
+        manager.shutdown()
+
+        if any(rate_limited for count, rate_limited, unsent, limits in results):
+            raise RateLimitExceeded("API rate limit exceeded.")
+
+    def shard(self, file_name, outfile, index, start, end, first_nr):
+        """Records of one byte range, in a worker process (see init_worker)."""
+
+        # Own client and own part of the outputs
+        self.client.limiter.on_change = lambda limit: self.progress.set_limit(limit, index)
+        self.progress.set_limit(self.client.limiter.limit, index)
+        writer = ResultWriter(self.operation, outfile, self.args.compress, part=index)
+
+        records = read_mrc_range(file_name, start, end)
+
+        rate_limited = False
+        try:
+            for result in self.send_many(records, first_nr=first_nr, skip=self.skip):
+                self.progress.update(self.process_record(result, writer))
+        except RateLimitExceeded as err:
+            print(f"{err} Stopping worker {index}...\n")
+            rate_limited = True
+        finally:
+            writer.close()
+
+        return len(records), rate_limited, self.client.unsent, self.client.summary()
+
+    def run_canary(self, file_name, outfile):
+        """Sample of the records through the usual process_record; returns the record nrs done,
+        or None to stop here. Raises CanaryFailed when the sample is over a threshold."""
+        records = read_input_records(file_name)
+        if isinstance(records, list):
+            records_count = len(records)
+        else:
+            records_count = sum(1 for record in read_marcxml_records(file_name))   # streamed: count first
+
+        candidates = [nr for nr in range(1, records_count + 1) if nr not in self.rejected]
+        size = parse_canary_size(self.args.canary, len(candidates))
+        only = set(candidates[i] for i in canary_sample(len(candidates), size, self.args.canary_sample))
+        print(f"Canary: {len(only)} records first, outputs in {outfile}.Canary.*")
+
+        report = CanaryReport(self.operation, len(only), len(candidates), self.args.canary_sample)
+        writer = ResultWriter(self.operation, f"{outfile}.Canary", self.args.compress)
+        try:
+            for result in self.send_many(records, only=only):
+                self.process_record(result, writer)
+                report.add(result)
+        finally:
+            writer.close()
+            report.close()
+
+        if not self.canary_verdict(report):
+            return None
+        return only
+
+    def validate_input(self, file_name, outfile):
+        rejects = validate_mrc_file(file_name, **self.validate_tags)
+
+        if rejects:
+            with open(f"{outfile}.Rejected.txt", 'w') as out7, open(f"{outfile}.Rejected.mrc", 'wb') as out8:
+                for nr, reason, record in rejects:
+                    out7.write(f"Record nr {nr}: {reason}\n")
+                    out8.write(record + b'\x1D')
+
+        print(f"Validation of {file_name}: {len(rejects)} rejected record(s)\n")
+        return set(nr for nr, reason, record in rejects)
+
+    def process_record(self, result, writer):
+
+        if self.args.verbose:
+            for attempt, body in result.errors:
+                print(f'Error encountered:\n***{body}***')
+                print(f'Retrying request\n')
+            self.print_outcome(result)
+
+        return writer.write(result)
+
+    def print_outcome(self, result):
+        if result.outcome == 'bad_request':
+            print(f"Bad Request\n")
+        elif result.outcome == 'unsent':
+            print(f"Run deadline: record nr {result.nr} not sent, left for the Resume file\n")
+        elif result.outcome == 'failed':
+            print(f"Giving up on record nr {result.nr}. Moving to next record.\n")
+        else:
+            print(f"Went wrong.\n")
+
+
+worker = None   # RecordScript of a worker process
+
+
+def init_worker(script, shared_token, shared_lock, workers):
+    """State of a worker process: the script with the options, the records to skip and the
+    shared counters, and its own client, which uses the token of the parent process and
+    sends at most its share of the rate limit and concurrency of the institution."""
+    global worker
+    worker = script
+    worker.client = worker.new_client(workers)
+    worker.client.share_token(shared_token, shared_lock)
+
+
+def shard_worker(file_name, outfile, index, start, end, first_nr):
+    return worker.shard(file_name, outfile, index, start, end, first_nr)
@@ -0,0 +1,69 @@
+#  Test helpers: an LhrClient whose requests are answered by a stub instead of the API.
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mdt_misc_lhrclient import LhrClient, LhrProfile
+from mdt_misc_lhrcommon import build_iso2709
+
+LEADER = '00000nx  a2200000zi 4500'
+NOT_FOUND = '{"type": "NOT_FOUND", "title": "Not found"}'
+OUTAGE = '<html><head><title>502 Bad Gateway</title></head></html>'
+RATE_LIMITED = '{"message": "API rate limit exceeded"}'
+
+
+def lhr(ctrl_nr):
+    """Body of a successful answer: an LHR with this Control Number."""
+    return build_iso2709(LEADER, [('001', ctrl_nr.encode()), ('852', b'  \x1faNL')]).decode() + '\x1D'
+
+
+def write_mrc(path, ctrl_nrs):
+    """.mrc file with one LHR per Control Number."""
+    with open(path, 'wb') as file:
+        for ctrl_nr in ctrl_nrs:
+            file.write(lhr(ctrl_nr).encode())
+
+
+class StubApi:
+    """Answers of request_data: `answer(operation, ctrl_nr, record)` gives (status, body).
+    Every request is logged as (time.monotonic(), operation, ctrl_nr)."""
+
+    def __init__(self, answer=None, latency=None):
+        self.answer = answer or (lambda operation, ctrl_nr, record: (200, lhr(ctrl_nr)))
+        self.latency = latency or (lambda operation, ctrl_nr: 0)
+        self.log = []
+        self.lock = threading.Lock()
+
+    def __call__(self, operation, ctrl_nr=None, record=None, timeout=None):
+        time.sleep(self.latency(operation, ctrl_nr))
+        with self.lock:
+            self.log.append((time.monotonic(), operation, ctrl_nr))
+        return self.answer(operation, ctrl_nr, record)
+
+    def sent(self, operation):
+        return [ctrl_nr for when, op, ctrl_nr in self.log if op == operation]
+
+
+@pytest.fixture
+def make_client(monkeypatch, tmp_path):
+    """make_client(api, ledger, limiter, hedge, **profile) -> LhrClient of institution TEST answered by `api` (a StubApi)."""
+    monkeypatch.setenv('TEST_CLIENT_ID', 'id')
+    monkeypatch.setenv('TEST_CLIENT_SECRET', 'secret')
+    keys = tmp_path / 'API_KEYS.env'
+    keys.write_text('')
+
+    def make(api, ledger=None, limiter=None, hedge=None, **settings):
+        settings = dict(dict(max_concurrency=4, retry_delay=0.01, max_defer_delay=0.05, max_retries=3,
+                             drain_retries=1, spill_dir=str(tmp_path)), **settings)
+        client = LhrClient('TEST', env_file=str(keys), profile=LhrProfile(**settings), ledger=ledger,
+                           limiter=limiter, hedge=hedge)
+        client.ensure_token = lambda: None
+        client.request_data = api
+        return client
+
+    return make
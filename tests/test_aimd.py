@@ -0,0 +1,65 @@
+#  AimdLimiter: requests in flight raised while the API answers well, halved on trouble.
+import time
+
+from mdt_misc_lhrcommon import AimdLimiter, TokenBucket
+
+from conftest import StubApi, RATE_LIMITED, lhr
+
+
+def test_additive_increase_up_to_the_max():
+    changes = []
+    limiter = AimdLimiter(initial=1, max_limit=4, on_change=changes.append)
+    for _ in range(20):
+        limiter.success(0.01)
+    assert limiter.limit == 4
+    assert changes == [2, 3, 4]
+    assert limiter.peak == 4
+
+
+def test_one_cut_per_round():
+    limiter = AimdLimiter(initial=8, max_limit=8)
+    sent_before = limiter.acquire()
+    limiter.overload()
+    assert limiter.limit == 4
+
+    # Answers of the requests already in flight do not cut again
+    limiter.overload(started=sent_before)
+    assert limiter.throttled(started=sent_before)
+    assert limiter.limit == 4 and limiter.cuts == 1
+
+    limiter.overload(started=time.monotonic())
+    assert limiter.limit == 2 and limiter.cuts == 2
+
+
+def test_latency_spike_cuts():
+    limiter = AimdLimiter(initial=4, max_limit=8, latency_floor=0.1)
+    limiter.success(0.05)
+    limiter.success(0.5)   # 10 times the usual latency
+    assert limiter.limit == 2
+
+
+def test_throttled_at_the_minimum():
+    limiter = AimdLimiter(initial=1)
+    assert limiter.throttled() is False
+    assert limiter.limit == 1
+
+
+def test_client_halves_on_rate_limit(make_client):
+    def answer(operation, ctrl_nr, record):
+        return (429, RATE_LIMITED) if ctrl_nr == '20' and api.sent('get').count('20') == 1 else (200, lhr(ctrl_nr))
+
+    api = StubApi(answer=answer)
+    client = make_client(api, limiter=AimdLimiter(initial=1, max_limit=8))
+    results = list(client.get_many([str(nr) for nr in range(1, 41)]))
+
+    assert all(result.outcome == 'success' for result in results)
+    assert client.limiter.peak > 1
+    assert client.limiter.cuts == 1
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(20, burst=1)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - started >= 0.24
@@ -0,0 +1,65 @@
+#  CircuitBreaker: all requests paused while the API answers with outage pages.
+import threading
+import time
+
+from mdt_misc_lhrcommon import CircuitBreaker, is_outage_response, error_type
+
+from conftest import StubApi, OUTAGE, RATE_LIMITED, NOT_FOUND, lhr
+
+
+def test_opens_probes_and_closes():
+    breaker = CircuitBreaker(threshold=0.5, window=4, min_calls=4, probe_delay=0.1)
+    for ok in (True, False, True):
+        breaker.record(ok)
+    assert not breaker.is_open
+    breaker.record(False)
+    assert breaker.is_open and breaker.outages == 1
+
+    # Callers wait for the probe delay; one of them is let through as probe
+    started = time.monotonic()
+    breaker.before_request()
+    assert time.monotonic() - started >= 0.09
+    assert breaker.state == 'half_open'
+
+    # Probe failed: open again with a doubled delay; probe answered: closed
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker.delay == 0.2
+    breaker.open_until = time.monotonic()
+    breaker.before_request()
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.delay == 0.1
+
+
+def test_other_callers_wait_for_the_probe():
+    breaker = CircuitBreaker(window=1, min_calls=1, probe_delay=0)
+    breaker.record(False)
+    breaker.before_request()   # the probe
+    passed = threading.Event()
+    waiting = threading.Thread(target=lambda: (breaker.before_request(), passed.set()))
+    waiting.start()
+    assert not passed.wait(0.2)
+    breaker.record(True)
+    assert passed.wait(2)
+    waiting.join()
+
+
+def test_outage_pauses_the_client(make_client):
+    def answer(operation, ctrl_nr, record):
+        return (502, OUTAGE) if len(api.log) <= 5 else (200, lhr(ctrl_nr))
+
+    api = StubApi(answer=answer)
+    client = make_client(api, max_concurrency=1, max_retries=10)
+    client.breaker.base_delay = client.breaker.delay = 0.05
+    results = list(client.get_many(['1', '2', '3']))
+
+    assert [result.outcome for result in results] == ['success'] * 3
+    assert client.breaker.outages == 1
+    assert not client.breaker.is_open
+
+
+def test_error_type():
+    assert is_outage_response(OUTAGE)
+    assert error_type(OUTAGE) == 'outage'
+    assert error_type(RATE_LIMITED) == 'rate_limit'
+    assert error_type(NOT_FOUND) == 'not_found'
+    assert error_type('{"oops": 1}') == 'api_error'
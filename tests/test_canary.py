@@ -0,0 +1,56 @@
+#  --canary: a sample of the input first, the full run only within the limits.
+import pytest
+
+import mdt_misc_lhrget as lhrget
+from mdt_misc_lhrclient import LhrResult
+from mdt_misc_lhrcommon import CanaryReport, CanaryFailed, canary_sample, parse_canary_size, parse_canary_max, RunRegistry
+
+from conftest import StubApi, lhr
+
+
+def test_canary_size_and_sample():
+    assert parse_canary_size('200', 50) == 50
+    assert parse_canary_size('1%', 50) == 1
+    assert parse_canary_size('10%', 1000) == 100
+
+    # Stratified: one record in every slice of the input
+    picks = canary_sample(1000, 10, seed=1)
+    assert sorted(pick // 100 for pick in picks) == list(range(10))
+    assert len(canary_sample(1000, 10, 'random', seed=1)) == 10
+    assert canary_sample(3, 5) == {0, 1, 2}
+
+
+def test_report_check():
+    report = CanaryReport('get', 20, 1000, 'stratified')
+    for outcome in ['success'] * 18 + ['bad_request', 'error']:
+        report.add(LhrResult(operation='get', outcome=outcome, attempts=1))
+    report.close()
+    limits = parse_canary_max("bad_request=0.02,error=0.05")
+    assert report.check(limits) == ["bad_request 5.0% > 2.0%"]
+
+
+def run(make_client, tmp_path, answer, *extra):
+    path = tmp_path / 'ids.txt'
+    path.write_text(''.join(f"{nr}\n" for nr in range(1, 21)))
+    api = StubApi(answer=answer)
+    args = lhrget.parser.parse_args(['-i', str(path), '-k', 'TEST', '-r', 'g', '--canary', '5', *extra])
+    script = lhrget.GetScript(args, make_client(api), 'TEST', RunRegistry(spill_dir=str(tmp_path)))
+    script.main(str(path), str(tmp_path / 'out'))
+    return api
+
+
+def test_full_run_after_the_canary(make_client, tmp_path):
+    api = run(make_client, tmp_path, None)
+    assert sorted(api.sent('get'), key=int) == [str(nr) for nr in range(1, 21)]   # each one once
+    assert (tmp_path / 'out.Canary.SuccessCtrlNrs.txt').exists()
+
+
+def test_canary_over_its_limits(make_client, tmp_path):
+    with pytest.raises(CanaryFailed):
+        run(make_client, tmp_path, lambda operation, ctrl_nr, record: (400, '<error><type>BAD_REQUEST</type></error>'))
+    assert not (tmp_path / 'out.SuccessCtrlNrs.txt').exists()
+
+
+def test_canary_only(make_client, tmp_path):
+    api = run(make_client, tmp_path, lambda operation, ctrl_nr, record: (200, lhr(ctrl_nr)), '--canary-only')
+    assert len(api.sent('get')) == 5
@@ -0,0 +1,98 @@
+#  LhrClient.run_many: order of the results, deferred retries, records left unsent.
+import random
+
+import pytest
+
+from mdt_misc_lhrclient import RateLimitExceeded
+from mdt_misc_lhrcommon import AimdLimiter
+
+from conftest import StubApi, NOT_FOUND, OUTAGE, RATE_LIMITED, lhr
+
+
+def test_results_in_input_order(make_client):
+    ctrl_nrs = [str(100 + nr) for nr in range(40)]
+    api = StubApi(latency=lambda operation, ctrl_nr: random.uniform(0, 0.02))
+    results = list(make_client(api).get_many(ctrl_nrs))
+
+    assert [result.ctrl_nr for result in results] == ctrl_nrs
+    assert all(result.outcome == 'success' for result in results)
+
+
+def test_outcomes(make_client):
+    api = StubApi(answer=lambda operation, ctrl_nr, record: (404, NOT_FOUND) if ctrl_nr == '2' else (200, lhr(ctrl_nr)))
+    results = list(make_client(api).delete_many(['1', '2', '3']))
+
+    assert [result.outcome for result in results] == ['success', 'not_found', 'success']
+
+
+def test_unordered_results_as_answered(make_client):
+    api = StubApi(latency=lambda operation, ctrl_nr: 0.3 if ctrl_nr == '1' else 0)
+    results = list(make_client(api, limiter=AimdLimiter(initial=4, max_limit=4)).get_many(['1', '2', '3'], ordered=False))
+
+    assert results[-1].ctrl_nr == '1'
+    assert sorted(result.ctrl_nr for result in results) == ['1', '2', '3']
+
+
+def test_transient_failure_deferred(make_client):
+    attempts = {}
+
+    def answer(operation, ctrl_nr, record):
+        attempts[ctrl_nr] = attempts.get(ctrl_nr, 0) + 1
+        if ctrl_nr == '2' and attempts[ctrl_nr] == 1:
+            return 502, OUTAGE
+        return 200, lhr(ctrl_nr)
+
+    client = make_client(StubApi(answer=answer))
+    results = list(client.get_many(['1', '2', '3']))
+
+    assert [result.ctrl_nr for result in results] == ['1', '2', '3']
+    assert [result.outcome for result in results] == ['success'] * 3
+    assert results[1].attempts == 2
+    assert client.deferrals == 1
+
+
+def test_out_of_attempts_failed(make_client):
+    api = StubApi(answer=lambda operation, ctrl_nr, record: (502, OUTAGE) if ctrl_nr == '2' else (200, lhr(ctrl_nr)))
+    client = make_client(api, max_retries=2, drain_retries=1)
+    client.breaker.threshold = 1.1   # the outages of one record do not open the circuit
+    results = list(client.get_many(['1', '2', '3']))
+
+    assert [result.outcome for result in results] == ['success', 'failed', 'success']
+    assert client.drained == 1
+    assert api.sent('get').count('2') == 3
+
+
+def test_rate_limit_leaves_the_rest_unsent(make_client):
+    def answer(operation, ctrl_nr, record):
+        if ctrl_nr == '2' and api.sent('get').count('2') == 1:
+            return 502, OUTAGE
+        if ctrl_nr == '3':
+            return 429, RATE_LIMITED
+        return 200, lhr(ctrl_nr)
+
+    api = StubApi(answer=answer)
+    client = make_client(api, limiter=AimdLimiter(initial=1, max_limit=1), retry_delay=0.5, max_defer_delay=1)
+    client.breaker.threshold = 1.1
+    ctrl_nrs = [str(nr) for nr in range(1, 11)]
+    results = []
+    with pytest.raises(RateLimitExceeded):
+        for result in client.get_many(ctrl_nrs):
+            results.append(result)
+
+    # 2 was waiting for its retry, 3 got the rate limit, 4-10 were not read yet: all handed back
+    assert [result.ctrl_nr for result in results] == ctrl_nrs
+    assert [result.outcome for result in results] == ['success'] + ['unsent'] * 9
+    assert client.unsent == 9
+
+
+def test_request_budget_leaves_the_rest_unsent(make_client):
+    api = StubApi()
+    client = make_client(api, max_concurrency=1)
+    client.request_budget = 3
+    ctrl_nrs = [str(nr) for nr in range(1, 11)]
+    results = list(client.get_many(ctrl_nrs))
+
+    assert [result.ctrl_nr for result in results] == ctrl_nrs
+    assert [result.outcome for result in results] == ['success'] * 3 + ['unsent'] * 7
+    assert client.unsent == 7
+    assert len(api.log) == 3
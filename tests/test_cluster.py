@@ -0,0 +1,90 @@
+#  SqliteRateLimiter: requests per second of an institution shared by all nodes; submit and merge of the jobs.
+import os
+import time
+
+import pytest
+
+from mdt_misc_lhrcluster import SqliteRateLimiter, LeaseWorker, submit, connect
+from mdt_misc_lhrcommon import output_paths, part_path
+
+
+def test_rate_must_be_positive(tmp_path):
+    with pytest.raises(ValueError):
+        SqliteRateLimiter(str(tmp_path / 'queue.db'), 'TEST', 0)
+
+
+@pytest.mark.parametrize('rate, budget, period', [(20, 20, 1.0), (2.5, 3, 1.2), (0.5, 1, 2.0)])
+def test_window_budget_shared_by_the_nodes(tmp_path, rate, budget, period):
+    queue = str(tmp_path / 'queue.db')
+    nodes = [SqliteRateLimiter(queue, 'TEST', rate), SqliteRateLimiter(queue, 'TEST', rate)]
+    assert (nodes[0].budget, nodes[0].period) == (budget, pytest.approx(period))
+    assert nodes[0].batch >= 1
+
+    granted = 0
+    for turn in range(2 * budget):
+        granted += nodes[turn % 2]._reserve(window=1000)
+    assert granted == budget
+    assert nodes[0]._reserve(window=1001) > 0
+    assert SqliteRateLimiter(queue, 'OTHER', rate)._reserve(window=1000) > 0
+
+
+def test_acquire_waits_for_the_next_window(tmp_path):
+    limiter = SqliteRateLimiter(str(tmp_path / 'queue.db'), 'TEST', 10)
+    started = time.monotonic()
+    for _ in range(21):   # three windows of 10
+        limiter.acquire()
+    assert time.monotonic() - started >= 1.0
+
+
+#================ SUBMIT / MERGE ===============================>
+def write_ctrl_nrs(tmp_path, count):
+    path = tmp_path / 'ids.txt'
+    path.write_text(''.join(f"{100 + nr}\n" for nr in range(count)))
+    return str(path)
+
+
+def test_submit_needs_a_rate(tmp_path):
+    queue = str(tmp_path / 'queue.db')
+    with pytest.raises(ValueError):
+        submit(queue, write_ctrl_nrs(tmp_path, 3), 'TEST', 'get', 2, None)
+    with pytest.raises(ValueError):
+        submit(queue, write_ctrl_nrs(tmp_path, 3), 'TEST', 'get', 2, 0)
+
+    # RATE_LIMIT of the profile (API_PROFILES.env)
+    job_id = submit(queue, write_ctrl_nrs(tmp_path, 3), 'OCLCSYMBOL1', 'get', 2, None)
+    assert connect(queue).execute("SELECT rate FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == 5
+
+
+def test_stalled_merge_run_again(tmp_path):
+    queue = str(tmp_path / 'queue.db')
+    job_id = submit(queue, write_ctrl_nrs(tmp_path, 4), 'TEST', 'get', 2, 10)
+    db = connect(queue)
+    outfile = db.execute("SELECT outfile FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    success = output_paths('get', outfile)['success']
+    for idx in range(2):
+        with open(part_path(success, idx), 'w') as part:
+            part.write(f"lease {idx}\n")
+
+    # Node stopped halfway through the merge: all leases done, half of the output written, lease of the merge expired
+    db.execute("UPDATE leases SET status = 'done', counts = '{\"success\": 2}' WHERE job_id = ?", (job_id,))
+    db.execute("UPDATE jobs SET status = 'merging', merge_owner = 'gone', merge_expires = ? WHERE id = ?", (time.time() - 1, job_id))
+    with open(success, 'w') as out:
+        out.write("lease 0\n")
+
+    LeaseWorker(queue, 'node', lease_ttl=60).merge_stalled()
+
+    with open(success) as out:
+        assert out.read() == "lease 0\nlease 1\n"
+    assert not os.path.exists(part_path(success, 0))
+    assert db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == 'done'
+
+
+def test_merge_in_progress_not_taken_over(tmp_path):
+    queue = str(tmp_path / 'queue.db')
+    job_id = submit(queue, write_ctrl_nrs(tmp_path, 2), 'TEST', 'get', 2, 10)
+    db = connect(queue)
+    db.execute("UPDATE leases SET status = 'done' WHERE job_id = ?", (job_id,))
+    db.execute("UPDATE jobs SET status = 'merging', merge_owner = 'other', merge_expires = ? WHERE id = ?", (time.time() + 60, job_id))
+
+    LeaseWorker(queue, 'node', lease_ttl=60).merge_stalled()
+    assert db.execute("SELECT status, merge_owner FROM jobs WHERE id = ?", (job_id,)).fetchone() == ('merging', 'other')
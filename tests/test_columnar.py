@@ -0,0 +1,42 @@
+#  --columnar: selected fields of the downloaded LHRs, one row per LHR.
+import csv
+
+import pytest
+
+from mdt_misc_lhrcommon import parse_column_spec, extract_columns, ColumnarWriter, build_iso2709
+
+from conftest import LEADER
+
+RECORD = build_iso2709(LEADER, [('001', b'123'), ('852', b'  \x1faNL\x1fbMAIN\x1fbSTACK'), ('876', b'  \x1fp111'),
+                                ('876', b'  \x1fp222')])
+
+
+def test_parse_column_spec():
+    assert parse_column_spec("852$b=location, 001") == [('location', '852', 'b'), ('001', '001', None)]
+    with pytest.raises(ValueError):
+        parse_column_spec("85$b")
+
+
+def test_extract_columns():
+    columns = parse_column_spec("001=ctrl_nr,852$b=location,876$p=barcode,877$p")
+    assert extract_columns(RECORD, columns) == {'ctrl_nr': '123', 'location': 'MAIN|STACK', 'barcode': '111|222', '877$p': None}
+    assert extract_columns(RECORD.decode(), columns)['ctrl_nr'] == '123'
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_columnar_writer(tmp_path, file_format):
+    if file_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    writer = ColumnarWriter(str(tmp_path / 'out'), parse_column_spec("001=ctrl_nr,852$a"), batch_size=2, file_format=file_format)
+    for _ in range(3):
+        writer.write(RECORD)
+    writer.close()
+    assert writer.count == 3 and writer.path.endswith(f".LHRs.{file_format}")
+
+    if file_format == 'csv':
+        with open(writer.path, newline='') as file:
+            rows = list(csv.DictReader(file))
+    else:
+        import pyarrow.parquet
+        rows = pyarrow.parquet.read_table(writer.path).to_pylist()
+    assert rows == [{'ctrl_nr': '123', '852$a': 'NL'}] * 3
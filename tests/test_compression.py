@@ -0,0 +1,54 @@
+#  gzip/zstd inputs recognised on their content, compressed outputs.
+import gzip
+
+import pytest
+
+from mdt_misc_lhrcommon import open_input, open_output, read_mrc_records, compression_of, is_plain_file
+from mdt_misc_lhrcommon import input_extension, input_base_name, output_name, part_path, merge_part_outputs
+
+from conftest import lhr
+
+
+def compress(data, compression):
+    if compression == 'gz':
+        return gzip.compress(data)
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdCompressor().compress(data)
+
+
+@pytest.mark.parametrize('compression', ['gz', 'zst'])
+def test_compressed_input(tmp_path, compression):
+    data = ''.join(lhr(ctrl_nr) for ctrl_nr in ['1', '2', '3']).encode()
+    path = tmp_path / 'in.mrc.data'   # extension says nothing: the content does
+    path.write_bytes(compress(data, compression))
+
+    assert compression_of(str(path)) == compression
+    assert not is_plain_file(str(path))
+    assert len(read_mrc_records(str(path))) == 3
+
+    ids = tmp_path / 'ids'
+    ids.write_bytes(compress(b"11\n22\n", compression))
+    with open_input(str(ids), 'rt') as file:
+        assert file.read().split() == ['11', '22']
+
+
+def test_names():
+    assert input_extension('dir/data.mrc.gz') == '.mrc'
+    assert input_base_name('dir/data.mrc.zst') == 'data'
+    assert output_name('out.AddedLHRs.mrc', 'gz') == 'out.AddedLHRs.mrc.gz'
+    assert output_name('out.AddedLHRs.mrc') == 'out.AddedLHRs.mrc'
+
+
+@pytest.mark.parametrize('compression', ['gz', 'zst'])
+def test_compressed_output_of_workers(tmp_path, compression):
+    if compression == 'zst':
+        pytest.importorskip('zstandard')
+    path = output_name(str(tmp_path / 'out.AddedLHRs.mrc'), compression)
+    for index in range(2):
+        with open_output(part_path(path, index), 'ab') as out:
+            out.write(f"part {index}\n".encode())
+    merge_part_outputs([path], 2)
+
+    # Merged parts are consecutive frames/members of one valid file
+    with open_input(path, 'rt') as file:
+        assert file.read() == "part 0\npart 1\n"
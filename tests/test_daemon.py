@@ -0,0 +1,68 @@
+#  LhrDaemon: job files picked up from the spool directory, outputs and moves of the jobs.
+import os
+import threading
+import time
+
+import pytest
+
+import mdt_misc_lhrdaemon as lhrdaemon
+
+from conftest import StubApi, NOT_FOUND, lhr
+
+
+@pytest.fixture
+def daemon(make_client, monkeypatch, tmp_path):
+    monkeypatch.setattr(lhrdaemon, 'LEDGER_FILE', str(tmp_path / 'ledger.db'))
+    spool = tmp_path / 'spool'
+    (spool / 'test' / 'get').mkdir(parents=True)
+    daemon = lhrdaemon.LhrDaemon(str(spool))
+    api = StubApi(answer=lambda operation, ctrl_nr, record: (404, NOT_FOUND) if ctrl_nr == '9' else (200, lhr(ctrl_nr)),
+                  latency=lambda operation, ctrl_nr: 0.05)
+    daemon.clients['TEST'] = make_client(api)
+    daemon.api = api
+    return daemon
+
+
+def test_jobs_of_the_spool_directory(daemon):
+    get_dir = os.path.join(daemon.spool, 'test', 'get')
+    for name, text in [('a.txt', "1\n2\n\n9\n"), ('b.txt', "3\n"), ('c.mrc', ""), ('.d.txt', "4\n"), ('e.txt.tmp', "5\n")]:
+        with open(os.path.join(get_dir, name), 'w') as job:
+            job.write(text)
+
+    daemon.run(once=True)
+
+    # Every complete job of the institution processed, one after the other, the others left alone
+    assert sorted(os.listdir(os.path.join(get_dir, 'done'))) == ['a.txt', 'b.txt']
+    assert os.listdir(os.path.join(get_dir, 'failed')) == ['c.mrc']
+    assert sorted(os.listdir(get_dir)) == ['.d.txt', 'done', 'e.txt.tmp', 'failed', 'out', 'work']
+    assert os.listdir(os.path.join(get_dir, 'work')) == []
+    assert sorted(daemon.api.sent('get')) == ['1', '2', '3', '9']
+    outputs = os.listdir(os.path.join(get_dir, 'out'))
+    assert any(name.startswith('a.mdt_misc_lhrget.TEST.') and name.endswith('.NotFoundLHRs.json') for name in outputs)
+
+
+def test_interrupted_jobs_processed_again(daemon):
+    work_dir = os.path.join(daemon.spool, 'test', 'get', 'work')
+    os.makedirs(work_dir)
+    with open(os.path.join(work_dir, 'a.txt'), 'w') as job:
+        job.write("1\n")
+
+    daemon.run(once=True)
+    assert os.listdir(os.path.join(daemon.spool, 'test', 'get', 'done')) == ['a.txt']
+
+
+def test_queued_jobs_back_to_the_spool_on_stop(daemon):
+    get_dir = os.path.join(daemon.spool, 'test', 'get')
+    daemon.api.latency = lambda operation, ctrl_nr: 0.3
+    for name in ('a.txt', 'b.txt'):
+        with open(os.path.join(get_dir, name), 'w') as job:
+            job.write("1\n")
+
+    watcher = threading.Thread(target=daemon.run)
+    watcher.start()
+    time.sleep(0.1)   # a.txt running, b.txt queued behind it
+    daemon.stop()
+    watcher.join()
+
+    assert os.listdir(os.path.join(get_dir, 'done')) == ['a.txt']
+    assert os.path.exists(os.path.join(get_dir, 'b.txt'))
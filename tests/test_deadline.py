@@ -0,0 +1,52 @@
+#  Run deadline and per record deadline: the records not done are 'unsent' or 'failed'.
+import datetime
+import time
+
+import pytest
+
+from mdt_misc_lhrcommon import parse_deadline
+
+from conftest import StubApi, OUTAGE
+
+
+NOW = datetime.datetime(2026, 10, 19, 18, 30)
+
+
+def test_parse_deadline():
+    assert parse_deadline('+90m', NOW) == (NOW + datetime.timedelta(minutes=90)).timestamp()
+    assert parse_deadline('+2h', NOW) == (NOW + datetime.timedelta(hours=2)).timestamp()
+    assert parse_deadline('+30s', NOW) == (NOW + datetime.timedelta(seconds=30)).timestamp()
+    assert parse_deadline('20:00', NOW) == datetime.datetime(2026, 10, 19, 20, 0).timestamp()
+    # Already past today: tomorrow
+    assert parse_deadline('6:15', NOW) == datetime.datetime(2026, 10, 20, 6, 15).timestamp()
+    assert parse_deadline('2026-10-21 07:00', NOW) == datetime.datetime(2026, 10, 21, 7, 0).timestamp()
+    with pytest.raises(ValueError):
+        parse_deadline('tomorrow', NOW)
+
+
+def test_run_deadline_leaves_the_rest_unsent(make_client):
+    api = StubApi(latency=lambda operation, ctrl_nr: 0.2)
+    client = make_client(api, max_concurrency=1, deadline_margin=0)
+    client.set_deadline(time.time() + 0.3)
+    ctrl_nrs = [str(nr) for nr in range(1, 11)]
+    results = list(client.get_many(ctrl_nrs))
+
+    # What was in flight is awaited, nothing is sent once the deadline is reached
+    assert [result.ctrl_nr for result in results] == ctrl_nrs
+    done = len(api.log)
+    assert 1 <= done < 10
+    assert [result.outcome for result in results] == ['success'] * done + ['unsent'] * (10 - done)
+    assert client.unsent == 10 - done
+
+
+def test_record_deadline_fails_the_record(make_client):
+    api = StubApi(answer=lambda operation, ctrl_nr, record: (502, OUTAGE),
+                  latency=lambda operation, ctrl_nr: 0.1)
+    client = make_client(api, max_retries=10, drain_retries=0, record_deadline=0.25)
+    client.breaker.threshold = 1.1
+    results = list(client.get_many(['1']))
+
+    # Out of time long before the 10 attempts
+    assert results[0].outcome == 'failed'
+    assert 'Record deadline' in results[0].body
+    assert len(api.log) < 10
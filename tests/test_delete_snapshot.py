@@ -0,0 +1,68 @@
+#  mdt_misc_lhrdelete.py --snapshot: every LHR safely in the snapshot before its DELETE.
+import pytest
+
+import mdt_misc_lhrdelete as lhrdelete
+from mdt_misc_lhrclient import RateLimitExceeded
+from mdt_misc_lhrcommon import AimdLimiter
+
+from conftest import StubApi, NOT_FOUND, RATE_LIMITED, lhr
+
+
+def test_snapshot_before_delete(make_client, monkeypatch, tmp_path):
+    outfile = str(tmp_path / 'out')
+    snapshot_path = f"{outfile}.Snapshot.mrc"
+    unsafe = []
+
+    def get(operation, ctrl_nr, record):
+        return (404, NOT_FOUND) if ctrl_nr == '4' else (200, lhr(ctrl_nr))
+
+    def delete(operation, ctrl_nr, record):
+        # What is on disk at the time of the DELETE
+        with open(snapshot_path, 'rb') as file:
+            if f"\x1e{ctrl_nr}\x1e".encode() not in file.read():
+                unsafe.append(ctrl_nr)
+        return 200, lhr(ctrl_nr)
+
+    gets = StubApi(answer=get, latency=lambda operation, ctrl_nr: 0.5 if ctrl_nr == '3' else 0)
+    deletes = StubApi(answer=delete)
+    monkeypatch.setattr(lhrdelete, 'snapshot_client', make_client(gets, limiter=AimdLimiter(initial=4, max_limit=4)), raising=False)
+    monkeypatch.setattr(lhrdelete, 'client', make_client(deletes, limiter=AimdLimiter(initial=4, max_limit=4)), raising=False)
+    monkeypatch.setattr(lhrdelete, 'SNAPSHOT_SYNC_SECONDS', 0.05)
+
+    snapshot = lhrdelete.Snapshot(outfile)
+    ctrl_nrs = ['1', '2', '3', '4', '5']
+    results = list(snapshot.delete_many(ctrl_nrs))
+    snapshot.close()
+
+    # One result per Control Number, in input order; the LHR that could not be downloaded is not deleted
+    assert [result.ctrl_nr for result in results] == ctrl_nrs
+    assert [result.outcome for result in results] == ['success', 'success', 'success', 'not_found', 'success']
+    assert sorted(deletes.sent('delete')) == ['1', '2', '3', '5']
+    assert unsafe == []
+    assert snapshot.count == 4
+
+    # The slow GET of 3 held back no other delete
+    answered = {ctrl_nr: when for when, operation, ctrl_nr in gets.log}
+    sent = {ctrl_nr: when for when, operation, ctrl_nr in deletes.log}
+    assert sent['1'] < answered['3']
+    assert sent['5'] < answered['3']
+
+
+def test_snapshot_rate_limited(make_client, monkeypatch, tmp_path):
+    gets = StubApi(answer=lambda operation, ctrl_nr, record: (429, RATE_LIMITED) if ctrl_nr == '3' else (200, lhr(ctrl_nr)))
+    deletes = StubApi()
+    monkeypatch.setattr(lhrdelete, 'snapshot_client', make_client(gets, limiter=AimdLimiter(initial=1, max_limit=1)), raising=False)
+    monkeypatch.setattr(lhrdelete, 'client', make_client(deletes), raising=False)
+
+    snapshot = lhrdelete.Snapshot(str(tmp_path / 'out'))
+    ctrl_nrs = ['1', '2', '3', '4', '5']
+    results = []
+    with pytest.raises(RateLimitExceeded):
+        for result in snapshot.delete_many(ctrl_nrs):
+            results.append(result)
+    snapshot.close()
+
+    # Every Control Number has its result; those not deleted are unsent (Resume file)
+    assert [result.ctrl_nr for result in results] == ctrl_nrs
+    assert [result.outcome for result in results[2:]] == ['unsent'] * 3
+    assert sorted(deletes.sent('delete')) == [result.ctrl_nr for result in results if result.outcome == 'success']
@@ -0,0 +1,54 @@
+#  Hedged GETs: a duplicate of a slow GET, first answer kept, extra load capped.
+import time
+
+import pytest
+
+from mdt_misc_lhrcommon import HedgePolicy, parse_percent
+
+from conftest import StubApi
+
+
+def test_hedge_delay_and_cap():
+    hedge = HedgePolicy(percentile=0.9, max_share=0.1, min_samples=10, min_delay=0.01)
+    assert hedge.delay() is None   # nothing known about the latencies yet
+    for latency in range(1, 11):
+        hedge.observe(latency / 10)
+    assert hedge.delay() == pytest.approx(1.0)
+
+    # 1 hedge per 10 requests at most
+    allowed = 0
+    for _ in range(20):
+        hedge.delay()
+        allowed += hedge.allow()
+    assert allowed == 2
+
+
+def test_slow_get_answered_by_its_hedge(make_client):
+    first = set()
+
+    def latency(operation, ctrl_nr):
+        if ctrl_nr == 'slow' and ctrl_nr not in first:
+            first.add(ctrl_nr)
+            return 1.0
+        return 0
+
+    hedge = HedgePolicy(percentile=0.5, max_share=1.0, min_samples=1, min_delay=0.05)
+    hedge.observe(0.01)
+    api = StubApi(latency=latency)
+    client = make_client(api, hedge=hedge)
+    started = time.monotonic()
+    result = client.get('slow')
+
+    assert result.outcome == 'success'
+    assert time.monotonic() - started < 0.9
+    assert (hedge.hedges, hedge.wins) == (1, 1)
+    assert client.requests == 2
+
+
+def test_parse_percent():
+    assert parse_percent('5%') == parse_percent('5') == pytest.approx(0.05)
+    assert parse_percent('0.5') == pytest.approx(0.005)
+    assert parse_percent(95.0) == pytest.approx(0.95)
+    for value in ('-1', '101%', 'lots'):
+        with pytest.raises(ValueError):
+            parse_percent(value)
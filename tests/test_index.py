@@ -0,0 +1,70 @@
+#  HoldingsIndex: the LHRs as last downloaded, queried by location, OCN, 005 and barcode.
+import mdt_misc_lhrget as lhrget
+from mdt_misc_lhrcommon import HoldingsIndex, RunRegistry, build_iso2709
+
+from conftest import StubApi, LEADER, NOT_FOUND, lhr
+
+
+def holding(ctrl_nr, ocn, last_modified, location, sublocation, call_number, barcodes=()):
+    fields = [('001', ctrl_nr.encode()), ('004', ocn.encode()), ('005', last_modified.encode()),
+              ('852', f"  \x1fa NL\x1fb{location}\x1fc{sublocation}\x1fh{call_number}".encode())]
+    fields += [('876', f"  \x1fp{barcode}".encode()) for barcode in barcodes]
+    return build_iso2709(LEADER, fields) + b'\x1D'
+
+
+def test_query(tmp_path):
+    index = HoldingsIndex(str(tmp_path / 'index.db'))
+    index.upsert('TEST', holding('1', '100', '20190101120000.0', 'MAIN', 'STACKS', 'QA 76', ['B1', 'B2']))
+    index.upsert('TEST', holding('2', '200', '20210601120000.0', 'MAIN', 'REF', 'QA 77'))
+    index.upsert('TEST', holding('3', '300', '20200101120000.0', 'BRANCH', 'STACKS', 'PN 1', ['B3']).decode())
+    index.upsert('OTHER', holding('4', '100', '20190101120000.0', 'MAIN', 'STACKS', 'QA 76'))
+
+    def ctrl_nrs(**criteria):
+        return [ctrl_nr for ctrl_nr, record in index.query('TEST', **criteria)]
+
+    assert ctrl_nrs() == ['1', '2', '3']
+    assert ctrl_nrs(location='MA*') == ['1', '2']
+    assert ctrl_nrs(location='MAIN', sublocation='STACKS') == ['1']
+    assert ctrl_nrs(call_number='QA*') == ['1', '2']
+    assert ctrl_nrs(ocns=['100', '300']) == ['1', '3']
+    assert ctrl_nrs(older_than='2020') == ['1']
+    assert ctrl_nrs(newer_than='20200101') == ['2', '3']
+    assert ctrl_nrs(barcodes=['B2', 'B3']) == ['1', '3']
+    assert index.query('TEST', barcodes=['B3'])[0][1] == holding('3', '300', '20200101120000.0', 'BRANCH', 'STACKS',
+                                                                 'PN 1', ['B3'])
+    index.close()
+
+
+def test_upsert_and_remove(tmp_path):
+    path = str(tmp_path / 'index.db')
+    index = HoldingsIndex(path, batch_size=3)
+    index.upsert('TEST', holding('1', '100', '20190101120000.0', 'MAIN', 'STACKS', 'QA 76', ['B1']))
+    index.upsert('TEST', holding('1', '100', '20220101120000.0', 'BRANCH', 'STACKS', 'QA 76', ['B9']))
+    index.upsert('TEST', holding('2', '200', '20210601120000.0', 'MAIN', 'REF', 'QA 77'))
+    index.remove('TEST', '2')
+
+    # Latest version only, its barcodes replaced; not committed yet is not seen by another connection
+    assert [row[0] for row in index.query('TEST', location='BRANCH', barcodes=['B9'])] == ['1']
+    assert index.query('TEST', barcodes=['B1']) == []
+    assert [(institution, count) for institution, count, indexed in HoldingsIndex(path).counts()] == [('TEST', 2)]
+
+    index.commit()
+    assert [(institution, count) for institution, count, indexed in HoldingsIndex(path).counts()] == [('TEST', 1)]
+    assert index.upsert('TEST', build_iso2709(LEADER, [('852', b'  \x1fbMAIN')]) + b'\x1D') is None
+    index.close()
+
+
+def test_get_keeps_the_index(make_client, tmp_path):
+    path = tmp_path / 'ids.txt'
+    path.write_text("1\n2\n")
+    index = HoldingsIndex(str(tmp_path / 'index.db'))
+    index.upsert('TEST', holding('2', '200', '20210601120000.0', 'MAIN', 'REF', 'QA 77'))
+    api = StubApi(answer=lambda operation, ctrl_nr, record: (404, NOT_FOUND) if ctrl_nr == '2' else (200, lhr(ctrl_nr)))
+
+    args = lhrget.parser.parse_args(['-i', 'in', '-k', 'TEST', '-r', lhrget.parser._option_string_actions['-r'].choices[0]])
+    script = lhrget.GetScript(args, make_client(api), 'TEST', RunRegistry(spill_dir=str(tmp_path)), index)
+    script.main(str(path), str(tmp_path / 'out'))
+
+    # Downloaded LHR stored, the one not found any more forgotten
+    assert index.query('TEST') == [('1', lhr('1').encode())]
+    index.close()
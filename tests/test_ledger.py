@@ -0,0 +1,112 @@
+#  AddLedger: claims of the adds, also through LhrClient; adds without a clear answer kept as unknown.
+import sqlite3
+
+import pytest
+import urllib3
+from requests.exceptions import ConnectionError, ReadTimeout
+
+from mdt_misc_lhrcommon import AddLedger, build_iso2709
+
+from conftest import StubApi, LEADER, OUTAGE
+
+RECORD = build_iso2709(LEADER, [('852', b'  \x1faNL')])
+
+
+def added(ledger):
+    return ledger.db().execute("SELECT status, count(*) FROM added GROUP BY status").fetchall()
+
+
+def test_ledger_claim_store_release(tmp_path):
+    ledger = AddLedger(str(tmp_path / 'ledger.db'))
+    assert ledger.claim('TEST', 'hash') is None              # claim taken
+    assert ledger.claim('TEST', 'hash') == AddLedger.PENDING  # taken by another request
+    assert ledger.lookup('TEST', 'hash') is None
+
+    ledger.release('TEST', 'hash')
+    assert ledger.claim('TEST', 'hash') is None
+    ledger.store('TEST', 'hash', '12345')
+    assert ledger.claim('TEST', 'hash') == '12345'
+    assert ledger.lookup('TEST', 'hash') == '12345'
+
+    ledger.forget('TEST', '12345')
+    assert ledger.lookup('TEST', 'hash') is None
+
+
+def test_ledger_unknown_until_retried(tmp_path):
+    path = str(tmp_path / 'ledger.db')
+    ledger = AddLedger(path)
+    ledger.claim('TEST', 'hash')
+    ledger.mark_unknown('TEST', 'hash')
+    ledger.release('TEST', 'hash')                            # no effect on an unknown add
+    assert ledger.claim('TEST', 'hash') == AddLedger.UNKNOWN
+    assert AddLedger(path, retry_unknown=True).claim('TEST', 'hash') is None
+
+
+def test_ledger_stale_claim_unknown(tmp_path):
+    ledger = AddLedger(str(tmp_path / 'ledger.db'), claim_timeout=0)
+    assert ledger.claim('TEST', 'hash') is None
+    assert ledger.claim('TEST', 'hash') == AddLedger.UNKNOWN
+    assert added(ledger) == [('unknown', 1)]
+
+
+def test_ledger_written_before_the_claims(tmp_path):
+    path = str(tmp_path / 'ledger.db')
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE added (institution TEXT NOT NULL, record_hash TEXT NOT NULL, ctrl_nr TEXT NOT NULL, "
+               "added TEXT NOT NULL, PRIMARY KEY (institution, record_hash))")
+    db.execute("INSERT INTO added VALUES ('TEST', 'hash', '777', '2025-01-01T00:00:00')")
+    db.commit()
+    db.close()
+
+    assert AddLedger(path).claim('TEST', 'hash') == '777'
+
+
+def test_client_adds_a_record_once(make_client, tmp_path):
+    api = StubApi(answer=lambda operation, ctrl_nr, record: (201, build_iso2709(LEADER, [('001', b'4242')]).decode() + '\x1D'))
+    client = make_client(api, ledger=AddLedger(str(tmp_path / 'ledger.db')))
+    results = list(client.add_many([RECORD, RECORD]))
+
+    assert [result.outcome for result in results] == ['success', 'already_added']
+    assert [result.ctrl_nr for result in results] == ['4242', '4242']
+    assert len(api.sent('add')) == 1
+    assert client.ledger_skips == 1
+    assert 'already added' in client.summary()
+
+
+def refused(operation, ctrl_nr, record):
+    raise ConnectionError(urllib3.exceptions.MaxRetryError(None, '/', urllib3.exceptions.NewConnectionError(None, 'refused')))
+
+
+def timed_out(operation, ctrl_nr, record):
+    raise ReadTimeout('read timeout')
+
+
+@pytest.mark.parametrize('answer', [lambda operation, ctrl_nr, record: (400, '<error><type>BAD_REQUEST</type></error>'),
+                                    refused])
+def test_client_releases_the_claim_of_a_rejected_add(make_client, tmp_path, answer):
+    ledger = AddLedger(str(tmp_path / 'ledger.db'))
+    results = list(make_client(StubApi(answer=answer), ledger=ledger, max_retries=1, drain_retries=0).add_many([RECORD]))
+
+    assert results[0].outcome != 'success'
+    assert added(ledger) == []
+
+
+@pytest.mark.parametrize('answer', [timed_out,
+                                    lambda operation, ctrl_nr, record: (502, OUTAGE),
+                                    lambda operation, ctrl_nr, record: (500, '{"title": "Internal error"}')])
+def test_client_keeps_the_claim_of_an_add_without_a_clear_answer(make_client, tmp_path, answer):
+    ledger = AddLedger(str(tmp_path / 'ledger.db'))
+    api = StubApi(answer=answer)
+    client = make_client(api, ledger=ledger)
+    results = list(client.add_many([RECORD]))
+
+    # Reported failed (Retry file) after one request: no automatic retry of the add
+    assert results[0].outcome == 'failed'
+    assert results[0].record == RECORD
+    assert len(api.sent('add')) == 1
+    assert added(ledger) == [('unknown', 1)]
+
+    # Not sent by the next run either
+    results = list(make_client(api, ledger=ledger).add_many([RECORD]))
+    assert results[0].outcome == 'failed'
+    assert len(api.sent('add')) == 1
@@ -0,0 +1,48 @@
+#  MARCXML input of add/replace: streamed and converted record by record to ISO 2709.
+import gzip
+
+from mdt_misc_lhrcommon import read_marcxml_records, read_input_records, is_marcxml, record_fields, check_mrc_record
+
+from conftest import LEADER
+
+COLLECTION = f"""<?xml version="1.0" encoding="UTF-8"?>
+<collection xmlns="http://www.loc.gov/MARC21/slim">
+  <record>
+    <leader>{LEADER}</leader>
+    <controlfield tag="004">12345</controlfield>
+    <datafield tag="852" ind1="0" ind2=" ">
+      <subfield code="a">NL</subfield>
+      <subfield code="h">Bücher 1</subfield>
+    </datafield>
+  </record>
+  <record>
+    <leader>{LEADER}</leader>
+    <controlfield tag="004">67890</controlfield>
+  </record>
+</collection>
+"""
+
+
+def test_marcxml_records(tmp_path):
+    path = tmp_path / 'in.xml'
+    path.write_text(COLLECTION, encoding='utf-8')
+    records = list(read_marcxml_records(str(path)))
+
+    assert len(records) == 2
+    assert all(check_mrc_record(record) is None for record in records)
+    assert records[0][9:10] == b'a'   # UTF-8
+    assert list(record_fields(records[0])) == [('004', b'12345'), ('852', '0 \x1faNL\x1fhBücher 1'.encode('utf-8'))]
+    assert list(record_fields(records[1])) == [('004', b'67890')]
+
+
+def test_marcxml_compressed_and_without_extension(tmp_path):
+    path = tmp_path / 'in.xml.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as file:
+        file.write(COLLECTION)
+    assert len(list(read_input_records(str(path)))) == 2
+
+    # stdin is spooled to a file without extension: recognised on its content
+    spooled = tmp_path / 'stdin'
+    spooled.write_text(COLLECTION, encoding='utf-8')
+    assert is_marcxml(str(spooled))
+    assert len(list(read_input_records(str(spooled)))) == 2
@@ -0,0 +1,41 @@
+#  MrcOffsetIndex: records of an .mrc read by their number, offsets kept in <file>.offsets.
+import os
+
+import pytest
+
+from mdt_misc_lhrcommon import MrcOffsetIndex, RECORD_TERMINATOR
+
+from conftest import write_mrc
+
+
+def test_offset_index(tmp_path):
+    path = str(tmp_path / 'in.mrc')
+    write_mrc(path, ['11', '22', '33', '44'])
+
+    index = MrcOffsetIndex(path)
+    assert index.built and len(index) == 4
+    assert os.path.exists(f"{path}.offsets")
+    assert b'\x1e22\x1e' in index.record(2)
+    assert not index.record(2).endswith(RECORD_TERMINATOR)
+    assert list(index.parse_range('3:')) == [3, 4]
+    assert index.nrs_of(['44', '11', '99']) == ([1, 4], ['99'])
+    index.close()
+
+    # Read back from <file>.offsets, built again once the file changed
+    index = MrcOffsetIndex(path)
+    assert not index.built
+    index.close()
+    write_mrc(path, ['55'])
+    os.utime(path, ns=(0, 0))
+    index = MrcOffsetIndex(path)
+    assert index.built and len(index) == 1
+    index.close()
+
+
+def test_offset_index_bad_range(tmp_path):
+    path = str(tmp_path / 'in.mrc')
+    write_mrc(path, ['11'])
+    index = MrcOffsetIndex(path)
+    with pytest.raises(ValueError):
+        index.parse_range('5:2')
+    index.close()
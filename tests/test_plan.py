@@ -0,0 +1,62 @@
+#  mdt_misc_lhrplan.py: projection of the quota windows, job state.
+import pytest
+
+from mdt_misc_lhrplan import JobState, QuotaWindows, project
+
+DAY = 86400
+
+
+def job(tmp_path, total, **progress):
+    return JobState(str(tmp_path / 'job.state.json'), input_file='in.txt', operation='get', institution='TEST',
+                    total=total, outfile='out', **progress)
+
+
+def test_projection_spans_the_windows(tmp_path):
+    windows = QuotaWindows(DAY, '00:00')
+    now = windows.start(0) + 1000
+    # 2500 records, 1000 requests per window, fast enough to use every budget
+    assert project(job(tmp_path, 2500), windows, 1000, 100, now)[0] == 3
+    # One window is enough, done after 500 records at 100 per second
+    assert project(job(tmp_path, 500), windows, 1000, 100, now) == (1, now + 5)
+
+
+def test_projection_counts_the_requests_per_record(tmp_path):
+    windows = QuotaWindows(DAY, '00:00')
+    now = windows.start(0) + 1000
+    # Two requests per record so far (retries): 1000 requests are 500 records
+    state = job(tmp_path, 1500, position=501, done=500, requests=1000)
+    assert project(state, windows, 1000, 100, now)[0] == 2
+
+
+def test_projection_budget_of_the_window_used(tmp_path):
+    windows = QuotaWindows(DAY, '00:00')
+    now = windows.start(0) + 1000
+    state = job(tmp_path, 100, window_start=windows.start(now), window_requests=1000)
+    count, finish = project(state, windows, 1000, 100, now)
+    assert count == 2 and finish > windows.end(now)
+
+
+@pytest.mark.parametrize('budget, rate', [(0, 100), (-5, 100), (1000, 0)])
+def test_projection_without_budget_fails(tmp_path, budget, rate):
+    windows = QuotaWindows(DAY, '00:00')
+    with pytest.raises(ValueError):
+        project(job(tmp_path, 10), windows, budget, rate, windows.start(0) + 1000)
+
+
+def test_state_saved_and_loaded(tmp_path):
+    state = job(tmp_path, 10, position=4, carry=[2], done=2, requests=3)
+    state.save()
+    assert JobState.load(state.path) == state
+    assert state.remaining() == 8
+
+
+def test_unsent_records_carried_over(tmp_path):
+    # 10 done, 11 left unsent by the window: the next window starts at 11
+    state = job(tmp_path, 20, position=10)
+    state.advance([10, 11], {10}, 12)
+    assert (state.position, state.carry) == (11, [])
+    # The carried 2 left unsent again, 11 done: 2 is done first in the next window
+    state = job(tmp_path, 20, position=11, carry=[2])
+    state.advance([2, 11], {11}, 12)
+    assert (state.position, state.carry) == (12, [2])
+    assert state.remaining() == 10
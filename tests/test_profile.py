@@ -0,0 +1,32 @@
+#  API_PROFILES.env: tuning per institution, divided among the worker processes.
+import pytest
+
+from mdt_misc_lhrclient import LhrClient, LhrProfile, load_profile
+
+
+def test_load_profile(tmp_path):
+    path = tmp_path / 'API_PROFILES.env'
+    path.write_text("DEFAULT_MAX_CONCURRENCY=4\nDEFAULT_RATE_LIMIT=10\n"
+                    "TEST_MAX_CONCURRENCY=12\nTEST_SPILL_DIR= /tmp/spill \nTEST_TIMEOUT_REQUEST=\n")
+
+    profile = load_profile('test', str(path))
+    assert (profile.max_concurrency, profile.rate_limit, profile.spill_dir) == (12, 10.0, '/tmp/spill')
+    assert profile.timeout_request == LhrProfile().timeout_request   # empty: module default
+    assert load_profile('OTHER', str(path)).max_concurrency == 4
+    assert load_profile('TEST', str(tmp_path / 'missing.env')) == LhrProfile()
+
+    path.write_text("TEST_RATE_LIMIT=fast\n")
+    with pytest.raises(ValueError):
+        load_profile('TEST', str(path))
+
+
+@pytest.mark.parametrize('workers, concurrency, rate', [(1, 8, 10), (2, 4, 5), (16, 1, 0.625)])
+def test_limits_divided_among_the_workers(monkeypatch, tmp_path, workers, concurrency, rate):
+    monkeypatch.setenv('TEST_CLIENT_ID', 'id')
+    monkeypatch.setenv('TEST_CLIENT_SECRET', 'secret')
+    keys = tmp_path / 'API_KEYS.env'
+    keys.write_text('')
+
+    client = LhrClient('TEST', env_file=str(keys), profile=LhrProfile(max_concurrency=8, rate_limit=10), workers=workers)
+    assert client.limiter.max_limit == concurrency
+    assert client.rate_limiter.rate == pytest.approx(rate)
@@ -0,0 +1,48 @@
+#  Progress: one line with the counts per outcome, rate and ETA.
+import io
+import multiprocessing
+
+from mdt_misc_lhrcommon import Progress, format_duration
+
+OUTCOMES = ['success', 'not_found', 'failed']
+
+
+def test_line():
+    progress = Progress(10, OUTCOMES, in_place=False, stream=io.StringIO())
+    progress.update('success', 3)
+    progress.update('not_found')
+    progress.update('something else')   # counted as the last outcome
+    progress.set_limit(4)
+
+    line = progress.line()
+    assert line.startswith("[5/10]  50.0% |")
+    assert "| limit 4 |" in line
+    assert line.endswith("success 3  not_found 1  failed 1")
+    assert Progress(None, OUTCOMES, stream=io.StringIO()).line().startswith("[0/?]")
+
+
+def test_close_prints_the_last_line():
+    stream = io.StringIO()
+    progress = Progress(2, OUTCOMES, in_place=True, stream=stream).start()
+    progress.update('success', 2)
+    progress.close()
+    assert "\r[2/2] 100.0%" in stream.getvalue()
+    assert stream.getvalue().endswith("Elapsed: 0:00:00\n")
+
+
+def count(progress):
+    progress.update('success')
+
+
+def test_counters_shared_with_worker_processes():
+    progress = Progress(4, OUTCOMES, stream=io.StringIO(), workers=2)
+    workers = [multiprocessing.Process(target=count, args=(progress,)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert progress.done() == 4
+
+
+def test_format_duration():
+    assert format_duration(3725.9) == "1:02:05"
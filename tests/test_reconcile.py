@@ -0,0 +1,97 @@
+#  mdt_misc_lhrreconcile.py: the minimal adds, replaces and deletes, and --max-delete.
+import pytest
+
+import mdt_misc_lhrreconcile as lhrreconcile
+from mdt_misc_lhrcommon import build_iso2709, parse_column_spec, parse_limit, record_control_number, record_fields
+
+from conftest import LEADER
+
+
+def holding(ocn, location, barcode, call_number, ctrl_nr=None, last_modified=None):
+    fields = [('001', ctrl_nr.encode())] if ctrl_nr else []
+    fields += [('005', last_modified.encode())] if last_modified else []
+    fields += [('004', ocn.encode()), ('852', f"  \x1fb{location}\x1fh{call_number}".encode()),
+               ('876', f"  \x1fp{barcode}".encode())]
+    return build_iso2709(LEADER, fields) + b'\x1D'
+
+
+def write_mrc(path, records):
+    with open(path, 'wb') as file:
+        for record in records:
+            file.write(record)
+
+
+def fields(record):
+    return dict(record_fields(record))
+
+
+def test_plan():
+    columns = parse_column_spec('004,852$b,876$p')
+    desired, desired_no_key = lhrreconcile.load_state([
+        holding('100', 'MAIN', 'B1', 'QA 76'),                 # unchanged
+        holding('200', 'MAIN', 'B2', 'QA 99'),                 # call number changed
+        holding('300', 'MAIN', 'B3', 'PN 1'),                  # new
+        build_iso2709(LEADER, [('500', b'  \x1faNo key')]),
+    ], columns)
+    current, current_no_key = lhrreconcile.load_state([
+        holding('100', 'MAIN', 'B1', 'QA 76', '11', '20200101120000.0'),
+        holding('200', 'MAIN', 'B2', 'QA 77', '22', '20200101120000.0'),
+        holding('400', 'MAIN', 'B4', 'PN 2', '44', '20200101120000.0').decode(),   # gone
+    ], columns)
+
+    to_add, to_replace, to_delete, unchanged = lhrreconcile.plan(desired, current)
+
+    assert unchanged == 1
+    assert len(desired_no_key) == 1 and current_no_key == []
+    # The replace carries the 001 and 005 of the LHR it replaces; the add has none
+    assert [fields(record)['001'] for record in to_replace] == [b'22']
+    assert fields(to_replace[0])['005'] == b'20200101120000.0'
+    assert b'QA 99' in fields(to_replace[0])['852']
+    assert [record_control_number(record) for record in to_add] == [None]
+    assert b'\x1fpB3' in fields(to_add[0])['876']
+    assert to_delete == ['44']
+
+
+def test_reconcile_writes_the_plan(monkeypatch, tmp_path, capsys):
+    desired = tmp_path / 'desired.mrc'
+    current = tmp_path / 'current.mrc'
+    write_mrc(desired, [holding('100', 'MAIN', 'B1', 'QA 76'), holding('300', 'MAIN', 'B3', 'PN 1')])
+    write_mrc(current, [holding('100', 'MAIN', 'B1', 'QA 76', '11', '20200101120000.0'),
+                        holding('400', 'MAIN', 'B4', 'PN 2', '44', '20200101120000.0')])
+    args = lhrreconcile.parser.parse_args(['-i', str(desired), '-k', 'TEST', '--current', str(current)])
+    monkeypatch.setattr(lhrreconcile, 'args', args, raising=False)
+    monkeypatch.setattr(lhrreconcile, 'institution', 'TEST', raising=False)
+
+    outfile = str(tmp_path / 'out')
+    lhrreconcile.main(str(desired), outfile)
+
+    assert 'Unchanged: 1  To replace: 0  To add: 1  To delete: 1' in capsys.readouterr().out
+    with open(f"{outfile}.ToDelete.txt") as file:
+        assert file.read() == "44\n"
+    with open(f"{outfile}.ToAdd.mrc", 'rb') as file:
+        assert b'\x1fpB3' in file.read()
+
+
+def test_max_delete(monkeypatch, tmp_path, capsys):
+    desired = tmp_path / 'desired.mrc'
+    current = tmp_path / 'current.mrc'
+    write_mrc(desired, [holding('100', 'MAIN', 'B1', 'QA 76')])
+    write_mrc(current, [holding('100', 'MAIN', 'B1', 'QA 76', '11'), holding('400', 'MAIN', 'B4', 'PN 2', '44')])
+    args = lhrreconcile.parser.parse_args(['-i', str(desired), '-k', 'TEST', '--current', str(current),
+                                           '--execute', '--max-delete', '0'])
+    monkeypatch.setattr(lhrreconcile, 'args', args, raising=False)
+    monkeypatch.setattr(lhrreconcile, 'institution', 'TEST', raising=False)
+    monkeypatch.setattr(lhrreconcile, 'execute', lambda *plan: pytest.fail("executed over --max-delete"))
+
+    with pytest.raises(SystemExit):
+        lhrreconcile.main(str(desired), str(tmp_path / 'out'))
+    assert '1 deletes is more than --max-delete 0' in capsys.readouterr().out
+
+
+def test_parse_limit():
+    assert parse_limit('0', 50) == 0
+    assert parse_limit('0%', 50) == 0
+    assert parse_limit('10%', 50) == 5
+    assert parse_limit('80', 50) == 50
+    with pytest.raises(ValueError):
+        parse_limit('-1', 50)
@@ -0,0 +1,54 @@
+#  RunRegistry: a Control Number in several input files of a run is sent once.
+import mdt_misc_lhrget as lhrget
+from mdt_misc_lhrclient import LhrResult
+from mdt_misc_lhrcommon import RunRegistry, output_paths
+
+from conftest import StubApi
+
+
+def answered(keys):
+    for key in keys:
+        yield LhrResult(operation='get', outcome='unsent' if key == '9' else 'success', attempts=1, ctrl_nr=key)
+
+
+def test_coalesce(tmp_path):
+    registry = RunRegistry(capacity=1, spill_dir=str(tmp_path))
+    sent = []
+
+    def many(keys):
+        keys = list(keys)
+        sent.append(keys)
+        return answered(keys)
+
+    first = list(registry.coalesce(['1', '2', '9'], many, 'a.txt'))
+    second = list(registry.coalesce(['2', '3', '1', '9'], many, 'b.txt'))
+    registry.close()
+
+    # Only the new ones sent; 2 came back from the spill file; unsent may be sent by a later file
+    assert sent == [['1', '2', '9'], ['3', '9']]
+    assert [first_file for result, first_file in first] == [None, None, None]
+    assert [(result.ctrl_nr, first_file) for result, first_file in second] == \
+           [('2', 'a.txt'), ('3', None), ('1', 'a.txt'), ('9', None)]
+    assert registry.hits == 2
+
+
+def test_get_over_two_files(make_client, tmp_path):
+    first = tmp_path / 'first.txt'
+    second = tmp_path / 'second.txt'
+    first.write_text("11\n22\n")
+    second.write_text("22\n33\n")
+    api = StubApi()
+    registry = RunRegistry(spill_dir=str(tmp_path))
+
+    args = lhrget.parser.parse_args(['-i', 'in', '-k', 'TEST', '-r', lhrget.parser._option_string_actions['-r'].choices[0]])
+    script = lhrget.GetScript(args, make_client(api), 'TEST', registry)
+    script.main(str(first), str(tmp_path / 'first'))
+    script.main(str(second), str(tmp_path / 'second'))
+
+    # 22 sent once, yet both files have all their outputs
+    assert sorted(api.sent('get')) == ['11', '22', '33']
+    with open(output_paths('get', str(tmp_path / 'second'))['success']) as success:
+        lines = success.read().splitlines()
+    assert len(lines) == 2 and '22' in lines[0] and '33' in lines[1]
+    with open(tmp_path / 'second.Coalesced.txt') as coalesced:
+        assert coalesced.read() == f"22|{first}\n"
@@ -0,0 +1,24 @@
+#  ReorderBuffer: results handed out in input order, spilled to disk past its capacity.
+from mdt_misc_lhrcommon import ReorderBuffer
+
+
+def test_reorder_buffer_spills_past_capacity(tmp_path):
+    buffer = ReorderBuffer(capacity=2, spill_dir=str(tmp_path))
+    handed = []
+    for seq in [5, 3, 4, 1, 2]:
+        handed += buffer.add(seq, f"item {seq}")
+    assert handed == []
+    assert buffer.spill_count == 3
+    assert len(buffer) == 5
+
+    handed += buffer.add(0, "item 0")
+    assert handed == [f"item {seq}" for seq in range(6)]
+    assert len(buffer) == 0
+    buffer.close()
+
+
+def test_reorder_buffer_drain_skips_gaps(tmp_path):
+    buffer = ReorderBuffer(capacity=1, spill_dir=str(tmp_path))
+    for seq in [3, 1]:
+        buffer.add(seq, seq)
+    assert buffer.drain() == [1, 3]
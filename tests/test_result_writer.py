@@ -0,0 +1,65 @@
+#  ResultWriter: output files opened on first write, LOG.jsonl with each answer stored once.
+import os
+
+from mdt_misc_lhrclient import LhrResult
+from mdt_misc_lhrcommon import ResultWriter, read_error_log, error_log_keys, output_paths, RECORD_TERMINATOR
+
+from conftest import OUTAGE, lhr
+
+ERROR = '<error><type>INTERNAL</type><message>Try again</message></error>'
+
+
+def test_only_outputs_written_to_exist(tmp_path):
+    outfile = str(tmp_path / 'out')
+    paths = output_paths('get', outfile)
+    writer = ResultWriter('get', outfile)
+    assert not any(os.path.exists(path) for path in paths.values())
+
+    writer.write(LhrResult('get', 'success', ctrl_nr='1', body=lhr('1'), attempts=1))
+    writer.close()
+    assert sorted(key for key, path in paths.items() if os.path.exists(path)) == ['records', 'success']
+
+
+def test_log_stores_each_answer_once(tmp_path):
+    outfile = str(tmp_path / 'out')
+    writer = ResultWriter('get', outfile)
+    writer.write(LhrResult('get', 'error', ctrl_nr='1', body=ERROR, attempts=1, http_status=500))
+    writer.write(LhrResult('get', 'error', ctrl_nr='2', body=ERROR, attempts=1, http_status=500))
+    writer.write(LhrResult('get', 'failed', ctrl_nr='3', attempts=3, errors=[(1, OUTAGE), (2, OUTAGE)]))
+    writer.write(LhrResult('get', 'unsent', ctrl_nr='4'))
+    writer.close()
+
+    log = output_paths('get', outfile)['log']
+    with open(log) as file:
+        text = file.read()
+    assert text.count(ERROR) == 1 and text.count('502 Bad Gateway') == 1
+
+    entries = list(read_error_log(log, statuses=None))
+    assert [(entry['ctrl_nr'], entry['status']) for entry in entries] == [
+        ('1', 'error'), ('2', 'error'), ('3', 'retry'), ('3', 'retry'), ('3', 'failed')]
+    assert entries[0]['body'] == ERROR and entries[0]['http_status'] == 500
+    assert entries[-1]['error'] == 'gave_up'
+    assert error_log_keys(log) == ['1', '2', '3']
+
+    with open(output_paths('get', outfile)['retry']) as file:
+        assert file.read() == "3\n"
+    with open(output_paths('get', outfile)['resume']) as file:
+        assert file.read() == "4\n"
+
+
+def test_records_not_added_ready_to_run_again(tmp_path):
+    outfile = str(tmp_path / 'out')
+    writer = ResultWriter('add', outfile)
+    writer.write(LhrResult('add', 'failed', nr=1, record=b'record 1', attempts=3))
+    writer.write(LhrResult('add', 'unsent', nr=2, record=b'record 2'))
+    writer.write(LhrResult('add', 'already_added', nr=3, ctrl_nr='42'))
+    writer.close()
+
+    paths = output_paths('add', outfile)
+    with open(paths['retry'], 'rb') as file:
+        assert file.read() == b'record 1' + RECORD_TERMINATOR
+    with open(paths['resume'], 'rb') as file:
+        assert file.read() == b'record 2' + RECORD_TERMINATOR
+    with open(paths['already_added']) as file:
+        assert '42' in file.read()
+    assert error_log_keys(paths['log'], key='nr') == [1]
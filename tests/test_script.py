@@ -0,0 +1,42 @@
+#  mdt_misc_lhrscript: the steps shared by the scripts, run with a stub API.
+import argparse
+import pickle
+
+import mdt_misc_lhrget as lhrget
+import mdt_misc_lhradd as lhradd
+from mdt_misc_lhrcommon import RunRegistry, output_paths
+
+from conftest import StubApi, NOT_FOUND, lhr
+
+
+def options(parser, *extra):
+    return parser.parse_args(['-i', 'in', '-k', 'TEST', '-r', parser._option_string_actions['-r'].choices[0], *extra])
+
+
+def test_ctrl_nr_script(make_client, tmp_path):
+    path = tmp_path / 'ids.txt'
+    path.write_text("11\n22\nnot a nr\n\n33\n22\n")
+    api = StubApi(answer=lambda operation, ctrl_nr, record: (404, NOT_FOUND) if ctrl_nr == '33' else (200, lhr(ctrl_nr)))
+    outfile = str(tmp_path / 'out')
+
+    script = lhrget.GetScript(options(lhrget.parser, '--validate'), make_client(api), 'TEST', RunRegistry(spill_dir=str(tmp_path)))
+    script.main(str(path), outfile)
+
+    # Rejected line and duplicate not sent; one result per Control Number
+    assert sorted(api.sent('get')) == ['11', '22', '33']
+    with open(output_paths('get', outfile)['success']) as success:
+        lines = success.read().splitlines()
+    assert len(lines) == 2 and '11' in lines[0] and '22' in lines[1]
+    with open(f"{outfile}.Rejected.txt") as rejected:
+        assert 'not a nr' in rejected.read()
+
+
+def test_record_script_to_a_worker_without_its_client(make_client):
+    script = lhradd.AddScript(options(lhradd.parser, '--no-ledger'))
+    script.client = make_client(StubApi())
+    script.skip = {2, 5}
+
+    copy = pickle.loads(pickle.dumps(script))
+    assert copy.client is None
+    assert copy.skip == {2, 5}
+    assert isinstance(script.new_client(workers=2), type(script.client))
@@ -0,0 +1,50 @@
+#  --processes: .mrc files cut in record aligned byte ranges, outputs of the workers merged.
+import os
+
+from mdt_misc_lhrcommon import mrc_byte_ranges, count_records, read_mrc_range, merge_part_outputs, part_path
+
+from conftest import write_mrc
+
+
+def test_byte_ranges_cut_on_records(tmp_path):
+    path = str(tmp_path / 'in.mrc')
+    ctrl_nrs = [str(10 ** (nr % 7) + nr) for nr in range(25)]   # records of different lengths
+    write_mrc(path, ctrl_nrs)
+
+    ranges = mrc_byte_ranges(path, 4)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(path)
+
+    # No record split or lost, and first_nr is the ordinal of the first record of each range
+    records = []
+    for start, end, first_nr in ranges:
+        assert first_nr == len(records) + 1
+        records += read_mrc_range(path, start, end)
+        assert count_records(path, start, end) == len(records) - first_nr + 1
+    assert [record.split(b'\x1e')[1].decode() for record in records] == ctrl_nrs
+
+
+def test_more_parts_than_records(tmp_path):
+    path = str(tmp_path / 'in.mrc')
+    write_mrc(path, ['1', '2'])
+    assert len(mrc_byte_ranges(path, 8)) <= 2
+    assert mrc_byte_ranges(str(tmp_path / 'in.mrc'), 1) == [(0, os.path.getsize(path), 1)]
+
+
+def test_merge_part_outputs(tmp_path):
+    success, retry = str(tmp_path / 'out.Success.txt'), str(tmp_path / 'out.Retry.txt')
+    for index in (0, 2):   # worker 1 wrote nothing
+        with open(part_path(success, index), 'w') as part:
+            part.write(f"worker {index}\n")
+
+    merge_part_outputs([success, retry], 3, keep_parts=True)
+    with open(success) as out:
+        assert out.read() == "worker 0\nworker 2\n"
+    assert not os.path.exists(retry)
+    assert os.path.exists(part_path(success, 0))
+
+    merge_part_outputs([success, retry], 3)   # again, same result, parts removed
+    with open(success) as out:
+        assert out.read() == "worker 0\nworker 2\n"
+    assert not os.path.exists(part_path(success, 2))
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.merging')] == []
@@ -0,0 +1,34 @@
+#  --validate: records and Control Numbers rejected locally, before any API call.
+from mdt_misc_lhrcommon import check_mrc_record, validate_mrc_file, validate_ctrl_nr_file, build_iso2709
+
+from conftest import LEADER, lhr, write_mrc
+
+
+def test_check_mrc_record():
+    record = lhr('123').encode()[:-1]
+    assert check_mrc_record(record) is None
+    assert check_mrc_record(record, required_tags=('001',)) is None
+    assert check_mrc_record(record, forbidden_tags=('001',)) == "field 001 must not be present"
+    assert check_mrc_record(record, required_tags=('005',)) == "field 005 is missing"
+    assert check_mrc_record(record[:20]) == "truncated record (no complete leader)"
+    assert check_mrc_record(record[:-5]).startswith("truncated record")
+    assert check_mrc_record(b'abcde' + record[5:]).startswith("bad leader length")
+
+
+def test_validate_mrc_file_over_processes(tmp_path):
+    path = str(tmp_path / 'in.mrc')
+    write_mrc(path, [str(nr) for nr in range(1, 31)])
+    with open(path, 'ab') as file:
+        file.write(build_iso2709(LEADER, [('852', b'  \x1faNL')]) + b'\x1d')   # nr 31: no 001
+        file.write(lhr('32').encode()[:-10] + b'\x1d')                          # nr 32: truncated
+
+    rejects = validate_mrc_file(path, processes=3, required_tags=('001',))
+    assert [(nr, reason.split(' (')[0]) for nr, reason, record in rejects] == [(31, "field 001 is missing"), (32, "truncated record")]
+    assert validate_mrc_file(path, processes=1, required_tags=('001',)) == rejects
+
+
+def test_validate_ctrl_nr_file(tmp_path):
+    path = tmp_path / 'ids.txt'
+    path.write_text("11\n\n12a\n13\n")
+    rejects = validate_ctrl_nr_file(str(path), lines_per_chunk=2)
+    assert rejects == [(2, '', "empty line"), (3, '12a', "Control Number is not numeric")]